@@ -0,0 +1,297 @@
+"""
+Benchmarks for the comparison pipeline.
+
+Synthetic TXT, MIF and XLSX inputs of a given size are generated together
+with a drifted copy (a share of lines changed, removed or inserted), and the
+main stages are timed on them: compare_texts, extract_with_regex, the Excel
+reader and the HTTP endpoints end to end (upload and compare). Every case
+runs a few times and the best time is kept.
+
+Results are written as JSON and can be checked against a saved baseline; the
+run fails when the throughput of a case drops by more than the threshold.
+
+    python benchmark.py --save benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json --threshold 0.2
+
+Baselines are only comparable on the same machine.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import openpyxl
+
+import blob_store
+import readers
+from comparison import compare_texts, extract_with_regex
+
+PROFILES = {
+    # (line counts, drift rates, largest XLSX / HTTP input)
+    "quick": ([1000, 100000], [0.01], 100000),
+    "standard": ([1000, 100000, 1000000], [0.001, 0.01, 0.1], 100000),
+    "full": ([1000, 100000, 1000000, 10000000], [0.001, 0.01, 0.1], 1000000),
+}
+
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2
+
+TXT_REGEX = r'(?m)^(\w+)\.(\w+) = (\S+)'
+TXT_FILTER = r'^#'
+MIF_REGEX = r'(?m)^\s*([0-9A-F]+) : ([0-9A-F]+);'
+
+
+class Case(NamedTuple):
+    name: str
+    lines: int
+    size: int  # bytes processed per run
+    run: Callable[[], object]
+
+
+# Input generators
+
+def generate_txt(lines: int, seed: int = 0) -> List[str]:
+    """Configuration dump style lines: sections, comments and key = value pairs"""
+    rng = random.Random(seed)
+    values = [f"{rng.randrange(1 << 32):08x}" for _ in range(1024)]
+    return [
+        f"# section {i >> 6}" if i % 64 == 0 else f"unit{i >> 6}.param{i & 63} = {values[i & 1023]}"
+        for i in range(lines)
+    ]
+
+
+def generate_mif(lines: int, seed: int = 0) -> List[str]:
+    """MIF style memory contents: a header, then one address : value line per word"""
+    rng = random.Random(seed)
+    words = [f"{rng.randrange(1 << 32):08X}" for _ in range(4096)]
+    header = [f"DEPTH = {lines};", "WIDTH = 32;", "ADDRESS_RADIX = HEX;", "DATA_RADIX = HEX;", "CONTENT", "BEGIN"]
+    body = [f"    {address:08X} : {words[address & 4095]};" for address in range(max(0, lines - len(header) - 1))]
+    return (header + body + ["END;"])[:lines]
+
+
+def drift(lines: List[str], rate: float, seed: int = 0) -> List[str]:
+    """Copy of lines with about rate * len(lines) lines changed, removed or inserted"""
+    rng = random.Random(seed + 1)
+    count = min(len(lines), int(len(lines) * rate))
+    edits = dict(zip(rng.sample(range(len(lines)), count), (rng.randrange(3) for _ in range(count))))
+    drifted = []
+    for i, line in enumerate(lines):
+        edit = edits.get(i)
+        if edit is None:
+            drifted.append(line)
+        elif edit == 0:
+            drifted.append(line + " changed")
+        # edit == 1 removes the line
+        elif edit == 2:
+            drifted.extend((f"inserted {i}", line))
+    return drifted
+
+
+def write_xlsx(path: str, lines: List[str]):
+    """Store lines as rows of a single-sheet workbook, split into columns on spaces"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Sheet1")
+    for line in lines:
+        sheet.append(line.split(' '))
+    workbook.save(path)
+
+
+# Cases
+
+def _text_cases(kind: str, generate: Callable[[int, int], List[str]], regex: str, sizes: List[int],
+                rates: List[float], selected: Callable[[str], bool]) -> Iterator[Case]:
+    for lines in sizes:
+        extract_name = f"extract_with_regex/{kind}/{lines}"
+        compare_names = {rate: [f"compare_texts/{kind}/{lines}/drift={rate}"] for rate in rates}
+        if kind == "txt":
+            for rate in rates:
+                compare_names[rate].append(f"compare_texts/{kind}-regex-filter/{lines}/drift={rate}")
+        rates_selected = [rate for rate in rates if any(map(selected, compare_names[rate]))]
+        if not rates_selected and not selected(extract_name):
+            continue
+        base = generate(lines, 0)
+        text1 = '\n'.join(base)
+        yield Case(extract_name, lines, len(text1), lambda text=text1: extract_with_regex(text, regex))
+        for rate in rates_selected:
+            text2 = '\n'.join(drift(base, rate))
+            size = len(text1) + len(text2)
+            plain, *filtered = compare_names[rate]
+            yield Case(plain, lines, size, lambda a=text1, b=text2: compare_texts(a, b))
+            for name in filtered:
+                yield Case(name, lines, size,
+                           lambda a=text1, b=text2: compare_texts(a, b, regex_pattern=TXT_REGEX,
+                                                                  filter_pattern=TXT_FILTER))
+
+
+def _excel_cases(workdir: str, sizes: List[int], selected: Callable[[str], bool]) -> Iterator[Case]:
+    for lines in sizes:
+        name = f"excel_reader/xlsx/{lines}"
+        if not selected(name):
+            continue
+        path = os.path.join(workdir, f"input-{lines}.xlsx")
+        write_xlsx(path, generate_txt(lines))
+        yield Case(name, lines, os.path.getsize(path),
+                   lambda path=path: sum(1 for _ in readers.iter_excel_lines(path)))
+
+
+def _http_name(lines: int, rate: float) -> str:
+    return f"http/upload-compare/{lines}/drift={rate}"
+
+
+def _http_cases(workdir: str, sizes: List[int], rate: float, selected: Callable[[str], bool]) -> Iterator[Case]:
+    """Upload both inputs and compare them through the API, in-process"""
+    sizes = [lines for lines in sizes if selected(_http_name(lines, rate))]
+    if not sizes:
+        return
+    os.environ["DB_PATH"] = os.path.join(workdir, "benchmark.db")
+    os.environ["BLOB_DIR"] = blob_store.BLOB_DIR = os.path.join(workdir, "blobs")
+    os.environ["MAX_FILE_SIZE"] = "0"
+    # Imported late so that the app picks up the settings above
+    from fastapi.testclient import TestClient
+    import main
+
+    main.init_db()
+    with TestClient(main.app) as client:
+        yield from _upload_compare_cases(client, sizes, rate)
+
+
+def _upload_compare_cases(client, sizes: List[int], rate: float) -> Iterator[Case]:
+    token = client.post("/auth/login?username=admin&password=admin").json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    runs = iter(range(1 << 30))
+
+    def upload_and_compare(text1: str, text2: str) -> dict:
+        # A fresh first line per run keeps the blob store and the result cache cold
+        run = next(runs)
+        blobs = []
+        for name, text in (("file1.txt", text1), ("file2.txt", text2)):
+            response = client.post("/upload?include_content=false", headers=headers,
+                                   files={"file": (name, f"run {run}\n{text}".encode('utf-8'), "text/plain")})
+            response.raise_for_status()
+            blobs.append(response.json()["blob_id"])
+        response = client.post(f"/compare?file1_blob={blobs[0]}&file2_blob={blobs[1]}", headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    for lines in sizes:
+        base = generate_txt(lines)
+        text1, text2 = '\n'.join(base), '\n'.join(drift(base, rate))
+        yield Case(_http_name(lines, rate), lines, len(text1) + len(text2),
+                   lambda a=text1, b=text2: upload_and_compare(a, b))
+
+
+def iter_cases(profile: str, workdir: str, selected: Callable[[str], bool] = lambda name: True) -> Iterator[Case]:
+    """The cases of a profile; inputs are only generated for the cases that are selected"""
+    sizes, rates, largest = PROFILES[profile]
+    small = [lines for lines in sizes if lines <= largest]
+    yield from _text_cases("txt", generate_txt, TXT_REGEX, sizes, rates, selected)
+    yield from _text_cases("mif", generate_mif, MIF_REGEX, sizes, rates, selected)
+    yield from _excel_cases(workdir, small, selected)
+    yield from _http_cases(workdir, small, rates[len(rates) // 2], selected)
+
+
+# Measurement and regression checks
+
+def measure(case: Case, repeat: int = DEFAULT_REPEAT) -> dict:
+    """Best wall-clock time of repeated runs, with the throughput derived from it"""
+    times = []
+    for _ in range(max(1, repeat)):
+        gc.collect()
+        start = time.perf_counter()
+        case.run()
+        times.append(time.perf_counter() - start)
+    best = min(times)
+    return {
+        "seconds": best,
+        "lines_per_second": case.lines / best if best else None,
+        "mb_per_second": case.size / best / 1e6 if best else None,
+        "runs": len(times),
+    }
+
+
+def machine_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def regressions(results: Dict[str, dict], baseline: Dict[str, dict],
+                threshold: float = DEFAULT_THRESHOLD) -> List[Tuple[str, float]]:
+    """Cases whose throughput fell below (1 - threshold) of the baseline, with their ratio"""
+    slower = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if not reference or not reference.get("lines_per_second") or not result.get("lines_per_second"):
+            continue
+        ratio = result["lines_per_second"] / reference["lines_per_second"]
+        if ratio < 1 - threshold:
+            slower.append((name, ratio))
+    return slower
+
+
+def run(profile: str = "standard", only: Optional[str] = None, repeat: int = DEFAULT_REPEAT,
+        report: Callable[[str, dict], None] = lambda name, result: None) -> dict:
+    results = {}
+    selected = (lambda name: fnmatch.fnmatch(name, only)) if only else (lambda name: True)
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as workdir:
+        for case in iter_cases(profile, workdir, selected):
+            if not selected(case.name):
+                continue
+            results[case.name] = measure(case, repeat)
+            report(case.name, results[case.name])
+    return {"profile": profile, "machine": machine_info(), "created": time.time(), "results": results}
+
+
+def _print_result(name: str, result: dict):
+    print(f"{name:60} {result['seconds']:9.3f}s {result['lines_per_second']:14,.0f} lines/s "
+          f"{result['mb_per_second']:8.1f} MB/s", flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the comparison pipeline")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="standard")
+    parser.add_argument("--only", help="run only the cases matching this glob, e.g. 'compare_texts/*'")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="fail if throughput regressed against this baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="tolerated throughput drop as a fraction (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    # Read before the run, so that --save can replace the baseline it is compared against
+    baseline = None
+    if args.compare and os.path.exists(args.compare):
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    elif args.compare:
+        print(f"no baseline at {args.compare}, skipping the comparison; record one with --save",
+              file=sys.stderr)
+
+    report = run(args.profile, args.only, args.repeat, _print_result)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if baseline is None:
+        return 0
+
+    if baseline.get("machine") != report["machine"]:
+        print("warning: the baseline was recorded on a different machine", file=sys.stderr)
+    slower = regressions(report["results"], baseline.get("results", {}), args.threshold)
+    for name, ratio in slower:
+        print(f"REGRESSION {name}: {ratio:.0%} of baseline throughput", file=sys.stderr)
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Content-addressed storage for uploaded files.
+
+Raw uploads are stored under their SHA-256 digest. The text extracted from
+a blob is cached next to the raw bytes, so identical re-uploads cost neither
+disk space nor another round of parsing, and comparisons can reference blobs
+instead of shipping full file bodies back and forth.
+
+How bytes turn into text depends on the kind of file they were uploaded as
+(see TEXT_KINDS), so the same bytes can have one cached text per kind. The
+blob id handed out to clients names both: the digest, followed by the kind
+unless the file is plain text.
+
+    BLOB_DIR/ab/abcdef...             raw bytes
+    BLOB_DIR/ab/abcdef....txt         extracted text of blob id abcdef...
+    BLOB_DIR/ab/abcdef....excel.txt   extracted text of blob id abcdef....excel
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import re
+import tempfile
+from typing import IO, Iterable, Iterator, NamedTuple, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+
+# The text kind of each file extension; files of any other extension are "other"
+TEXT_KINDS = {'.xlsx': 'excel', '.xls': 'excel', '.mif': 'text', '.txt': 'text'}
+
+_BLOB_ID_RE = re.compile(r'^([0-9a-f]{64})(?:\.(excel|other))?$')
+
+
+class BlobRef(NamedTuple):
+    """Reference to the extracted text of a stored blob"""
+    blob_id: str
+
+
+def text_kind(file_extension: str) -> str:
+    return TEXT_KINDS.get(file_extension.lower(), 'other')
+
+
+def blob_id_for(digest: str, file_extension: str) -> str:
+    """The blob id of the text of a file with this extension"""
+    kind = text_kind(file_extension)
+    return digest if kind == 'text' else f"{digest}.{kind}"
+
+
+def parse_blob_id(blob_id: str) -> Tuple[str, str]:
+    """Split a blob id into the digest of its raw bytes and its text kind"""
+    match = _BLOB_ID_RE.match(blob_id or '')
+    if match is None:
+        raise HTTPException(status_code=400, detail="Invalid blob id")
+    return match.group(1), match.group(2) or 'text'
+
+
+def raw_path(blob_id: str) -> str:
+    digest, _ = parse_blob_id(blob_id)
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def text_path(blob_id: str) -> str:
+    digest, kind = parse_blob_id(blob_id)
+    suffix = '.txt' if kind == 'text' else f'.{kind}.txt'
+    return os.path.join(BLOB_DIR, digest[:2], digest + suffix)
+
+
+def _write_atomic(path: str, data: Union[bytes, Iterable[bytes]]):
+    """Write data (or a stream of chunks) next to path and move it into place in one step"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                for chunk in data:
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _spool(prefix: str) -> Tuple[IO[bytes], str]:
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=BLOB_DIR, prefix=prefix)
+    return os.fdopen(fd, 'wb'), path
+
+
+def _move_into_place(tmp_path: str, path: str):
+    """Move a spooled file to its final path, unless an identical blob is there already"""
+    if os.path.exists(path):
+        os.unlink(tmp_path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+
+
+class BlobWriter:
+    """Spool a blob to disk chunk by chunk, hashing it on the way
+
+    With a decoder, the blob's text is decoded and spooled as well, and
+    cached as its plain-text kind together with the blob on commit. If the data turns out not to
+    decode, the text is dropped and left to regular extraction.
+    """
+
+    def __init__(self, max_size: int = 0, decoder: Optional[io.IncrementalNewlineDecoder] = None):
+        self.max_size = max_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._raw, self._raw_path = _spool('.upload-')
+        self._decoder = decoder
+        self._text: Optional[IO[bytes]] = None
+        if decoder is not None:
+            self._text, self._text_path = _spool('.upload-text-')
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.max_size and self.size > self.max_size:
+            raise HTTPException(status_code=413, detail=f"File exceeds the size limit of {self.max_size} bytes")
+        self._digest.update(chunk)
+        self._raw.write(chunk)
+        self._decode(chunk)
+
+    def _decode(self, chunk: bytes, final: bool = False):
+        if self._text is None:
+            return
+        try:
+            self._text.write(self._decoder.decode(chunk, final).encode('utf-8'))
+        except UnicodeDecodeError:
+            self._drop_text()
+
+    def _drop_text(self):
+        if self._text is not None:
+            self._text.close()
+            os.unlink(self._text_path)
+            self._text = None
+
+    def commit(self) -> str:
+        """Move the blob (and its text) into the store and return its digest"""
+        self._decode(b'', final=True)
+        self._raw.close()
+        blob_id = self._digest.hexdigest()
+        _move_into_place(self._raw_path, raw_path(blob_id))
+        if self._text is not None:
+            self._text.close()
+            _move_into_place(self._text_path, text_path(blob_id))
+            self._text = None
+        return blob_id
+
+    def discard(self):
+        if not self._raw.closed:
+            self._raw.close()
+            os.unlink(self._raw_path)
+        self._drop_text()
+
+
+def put_text(blob_id: str, text: str):
+    _write_atomic(text_path(blob_id), text.encode('utf-8'))
+
+
+def put_text_chunks(blob_id: str, chunks: Iterable[str]):
+    """Store extracted text produced piece by piece, without joining it in memory"""
+    _write_atomic(text_path(blob_id), (chunk.encode('utf-8') for chunk in chunks))
+
+
+def get_text_path(blob_id: str) -> Optional[str]:
+    """Return the path of a blob's cached text if it has been extracted"""
+    path = text_path(blob_id)
+    return path if os.path.exists(path) else None
+
+
+def get_text(blob_id: str) -> Optional[str]:
+    """Return the cached text of a blob, or None if it was not extracted yet"""
+    try:
+        with open(text_path(blob_id), 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def map_text(blob_id: str) -> Union[mmap.mmap, bytes]:
+    """Memory-map the cached UTF-8 text of a blob; pages are only read when touched"""
+    try:
+        f = open(text_path(blob_id), 'rb')
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Blob not found: {blob_id}")
+    with f:
+        # Empty files cannot be mapped
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_lines(value: Union[str, BlobRef]) -> Iterator[str]:
+    """The lines of a comparison input as str.splitlines() splits them, streaming blob text from disk"""
+    if not isinstance(value, BlobRef):
+        yield from value.splitlines()
+        return
+    try:
+        f = open(text_path(value.blob_id), 'r', encoding='utf-8', newline='')
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Blob not found: {value.blob_id}")
+    with f:
+        # Files only break lines at \n and \r, splitlines() also at the rarer separators
+        for line in f:
+            yield from line.splitlines()
@@ -0,0 +1,227 @@
+"""
+File processing and comparison helpers.
+
+Everything in this module is plain, picklable code without any dependency on
+the FastAPI app so that it can run inside the comparison worker processes.
+"""
+
+import json
+import re
+from typing import Callable, Iterator, List, Optional, Union
+
+from fastapi import HTTPException
+
+import blob_store
+import diff_engine
+import metrics
+import patterns
+import prepass
+import readers
+from blob_store import BlobRef
+from grouping import Grouper
+from line_table import LineTable, is_ascii, verified_blocks
+
+_KIND_NAMES = {'excel': 'Excel', 'text': 'text'}
+
+def _iter_excel_text(file_path: str) -> Iterator[str]:
+    """The text of an Excel file as tab-delimited lines, one row at a time"""
+    lines = readers.iter_excel_lines(file_path)
+    first = next(lines, None)
+    if first is None:
+        return
+    yield first
+    for line in lines:
+        yield '\n' + line
+
+def extract_blob_text(blob_id: str, return_text: bool = True) -> Optional[str]:
+    """Return the text of a stored blob, extracting and caching it on first use
+
+    The blob id tells how the raw bytes are read. The text is streamed from
+    the raw file into the cache, so extraction never holds a whole file in
+    memory unless return_text asks for it.
+    """
+    if blob_store.get_text_path(blob_id) is None:
+        file_path = blob_store.raw_path(blob_id)
+        _, kind = blob_store.parse_blob_id(blob_id)
+        try:
+            with metrics.stage("parse"):
+                if kind == 'excel':
+                    blob_store.put_text_chunks(blob_id, _iter_excel_text(file_path))
+                else:
+                    blob_store.put_text_chunks(blob_id, readers.iter_text_chunks(file_path))
+        except Exception as e:
+            if kind == 'other':
+                # For other files, show a placeholder when they are not text
+                blob_store.put_text(blob_id, "Binary file content not displayed")
+            else:
+                raise HTTPException(status_code=400, detail=f"Error reading {_KIND_NAMES[kind]} file: {str(e)}")
+    return blob_store.get_text(blob_id) if return_text else None
+
+def extract_with_regex(text: str, pattern: Union[str, re.Pattern]) -> List[str]:
+    """Extract matches using regex pattern"""
+    if isinstance(pattern, str):
+        pattern = patterns.registry.compile(pattern)
+    return pattern.findall(text)
+
+def prepare_table(text: Union[str, BlobRef], regex: Optional[re.Pattern] = None,
+                  line_filter: Optional[re.Pattern] = None) -> LineTable:
+    """Apply regex extraction and filtering and return the lines to diff for one input
+
+    Blob inputs are memory-mapped instead of loaded. When their text is
+    ASCII, the patterns run directly on the mapped bytes and only the lines
+    that are kept get decoded, when they are rendered.
+    """
+    if isinstance(text, BlobRef):
+        data = blob_store.map_text(text.blob_id)
+        binary = is_ascii(data)
+    else:
+        data, binary = text, False
+    
+    # Apply regex extraction if pattern provided
+    if regex:
+        with metrics.stage("extract") as timer:
+            binary_regex = patterns.as_bytes(regex) if binary else None
+            if binary_regex:
+                # Matches stay undecoded bytes
+                matches = binary_regex.findall(data)
+                space, newline = b' ', b'\n'
+            else:
+                matches = extract_with_regex(data if isinstance(data, str) else str(data, 'utf-8'), regex)
+                space, newline = ' ', '\n'
+            # Handle tuple matches (multiple groups) by joining them
+            if matches and isinstance(matches[0], tuple):
+                matches = list(map(space.join, matches))
+            data = newline.join(matches)
+            timer.lines = len(matches)
+    
+    table = LineTable.from_text(data) if isinstance(data, str) else LineTable.from_bytes(data)
+    # Apply filter if pattern provided
+    if line_filter:
+        with metrics.stage("filter", lines=len(table)):
+            binary_filter = patterns.as_bytes(line_filter, "filter") if binary else None
+            if binary_filter:
+                table = table.filtered(binary_filter.search, binary=True)
+            else:
+                table = table.filtered(line_filter.search)
+    return table
+
+def prepare_lines(text1: Union[str, BlobRef], text2: Union[str, BlobRef], regex: Optional[re.Pattern] = None,
+                  line_filter: Optional[re.Pattern] = None) -> tuple:
+    """Return the prepared lines of both inputs as lists of strings"""
+    return list(prepare_table(text1, regex, line_filter)), list(prepare_table(text2, regex, line_filter))
+
+def matching_blocks(table1: LineTable, table2: LineTable) -> Iterator[diff_engine.Block]:
+    """Diff two line tables on their line hashes"""
+    blocks = prepass.iter_matching_blocks(table1.hashes, table2.hashes)
+    return verified_blocks(table1, table2, blocks)
+
+def _count_changes(lines: List[str]) -> tuple:
+    added = len([d for d in lines if d.startswith('+') and not d.startswith('+++')])
+    removed = len([d for d in lines if d.startswith('-') and not d.startswith('---')])
+    return added, removed
+
+def compare_texts(text1: Union[str, BlobRef], text2: Union[str, BlobRef], regex_pattern: Optional[str] = None, 
+                  filter_pattern: Optional[str] = None, group_by: Optional[str] = None,
+                  progress: Optional[Callable[[int, int, int], None]] = None,
+                  include_default_group: bool = True) -> dict:
+    """Compare two texts with optional regex processing
+
+    If given, progress is called after every hunk with the number of lines
+    of the first text scanned so far, its total line count and the number of
+    hunks found. Inputs may be blob references, which are loaded here so
+    that worker processes read them straight from the blob store.
+    """
+    # Compile every pattern up front so that errors surface before any work is done
+    regex, line_filter, grouping = patterns.compile_patterns(regex_pattern, filter_pattern, group_by)
+    lines1 = prepare_table(text1, regex, line_filter)
+    lines2 = prepare_table(text2, regex, line_filter)
+    
+    # Calculate diff
+    on_hunk = None
+    if progress:
+        on_hunk = lambda scanned, hunks: progress(scanned, len(lines1), hunks)
+    with metrics.stage("diff", lines=len(lines1) + len(lines2)):
+        diff = list(diff_engine.unified_diff(
+            lines1,
+            lines2,
+            fromfile='file1',
+            tofile='file2',
+            progress=on_hunk,
+            blocks=matching_blocks(lines1, lines2)
+        ))
+    with metrics.stage("group", lines=len(diff)):
+        return build_result(diff, grouping, include_default_group)
+
+def build_result(diff: List[str], grouping: Optional[re.Pattern] = None, include_default_group: bool = True) -> dict:
+    """Assemble the compare_texts result from the unified diff lines"""
+    grouped_diff = {}
+    result = {"diff": diff, "grouped_diff": grouped_diff}
+    if grouping:
+        # Changed lines by group key, and the counts of every grouping level
+        grouper = Grouper(grouping)
+        grouper.add_diff(diff)
+        grouped_diff.update(grouper.lines)
+        result["groups"] = grouper.groups()
+    elif include_default_group:
+        grouped_diff['default'] = diff
+    
+    lines_added, lines_removed = _count_changes(diff)
+    result["stats"] = {
+        "lines_added": lines_added,
+        "lines_removed": lines_removed,
+    }
+    return result
+
+def iter_comparison_records(text1: Union[str, BlobRef], text2: Union[str, BlobRef],
+                            regex_pattern: Optional[str] = None, filter_pattern: Optional[str] = None,
+                            group_by: Optional[str] = None, include_default_group: bool = True):
+    """Yield the result of compare_texts incrementally as NDJSON-ready records
+
+    A "header" record carries the file header lines, every hunk produces a
+    "hunk" record followed by one "group" record per group key found in it,
+    and a final "stats" record closes the stream, preceded by a "groups"
+    record with the group counts when grouping.
+    """
+    regex, line_filter, grouping = patterns.compile_patterns(regex_pattern, filter_pattern, group_by)
+    lines1 = prepare_table(text1, regex, line_filter)
+    lines2 = prepare_table(text2, regex, line_filter)
+    
+    header = ['--- file1\n', '+++ file2\n']
+    # The streamed group records carry the lines, so the grouper only keeps counts
+    grouper = Grouper(grouping, collect_lines=False) if grouping else None
+    lines_added = lines_removed = hunks = 0
+    for group in diff_engine.iter_hunks(lines1, lines2, blocks=matching_blocks(lines1, lines2)):
+        lines = list(diff_engine.format_hunk(lines1, lines2, group))
+        added, removed = _count_changes(lines)
+        lines_added += added
+        lines_removed += removed
+        
+        if not hunks:
+            yield {"type": "header", "lines": header}
+        yield {"type": "hunk", "lines": lines}
+        
+        hunks += 1
+        if grouper is not None:
+            for key, entries in grouper.add_hunk(lines).items():
+                yield {"type": "group", "key": key, "lines": entries}
+        elif include_default_group:
+            # Header lines belong to the first default group entries, as in compare_texts
+            yield {"type": "group", "key": "default", "lines": header + lines if hunks == 1 else lines}
+    
+    if grouper is not None:
+        yield {"type": "groups", "groups": grouper.groups()}
+    yield {"type": "stats", "lines_added": lines_added, "lines_removed": lines_removed, "hunks": hunks}
+
+def write_comparison_ndjson(path: str, *args, **kwargs):
+    """Write the comparison records to path, flushing after every record so readers can tail it"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in iter_comparison_records(*args, **kwargs):
+            f.write(json.dumps(record))
+            f.write('\n')
+            f.flush()
+
+def compare_texts_json(*args, **kwargs) -> bytes:
+    """Run compare_texts and serialize the result, so workers also take the JSON encoding cost"""
+    result = compare_texts(*args, **kwargs)
+    with metrics.stage("serialize", lines=len(result["diff"])):
+        return json.dumps(result).encode('utf-8')
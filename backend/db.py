@@ -0,0 +1,155 @@
+"""
+Shared SQLite data-access layer.
+
+Connections are pooled and reused across requests instead of being opened
+for every query. Each connection is switched to WAL mode (readers no longer
+block on writers), uses synchronous=NORMAL and a busy timeout, and keeps its
+own prepared statement cache, which only pays off because connections live
+on. Async helpers run queries on a small thread pool so the event loop never
+waits on disk I/O or locks.
+
+Pools are per process: a pool inherited through fork (worker processes) is
+left alone and a fresh one is opened in the child.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import metrics
+
+DB_PATH = os.getenv("DB_PATH", "filecomparehub.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "5000"))  # milliseconds
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self._idle: List[sqlite3.Connection] = []
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT / 1000,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection; the transaction is committed on success"""
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_pid = os.getpid()
+_pools_lock = threading.Lock()
+# Pools inherited through fork; kept referenced so their connections are never closed by the child
+_inherited: List[ConnectionPool] = []
+_threads: Optional[ThreadPoolExecutor] = None
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    global _pools, _pools_pid
+    db_path = db_path or DB_PATH
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            _inherited.extend(_pools.values())
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(db_path)
+        if pool is None:
+            pool = _pools[db_path] = ConnectionPool(db_path)
+        return pool
+
+
+@contextmanager
+def connection(db_path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    with get_pool(db_path).connection() as conn:
+        yield conn
+
+
+def close_pools():
+    global _threads
+    with _pools_lock:
+        pools = list(_pools.values()) if _pools_pid == os.getpid() else []
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+    if _threads is not None:
+        _threads.shutdown(wait=False)
+        _threads = None
+
+
+def _call(fn: Callable, args: tuple, db_path: Optional[str]):
+    with connection(db_path) as conn:
+        return fn(conn, *args)
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[List[str]]):
+    """Apply the migrations not yet recorded in PRAGMA user_version"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(migrations[version:], start=version + 1):
+        for statement in statements:
+            conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {number}")
+
+
+async def run(fn: Callable[..., Any], *args, db_path: Optional[str] = None):
+    """Run fn(conn, *args) with a pooled connection on the database thread pool"""
+    global _threads
+    if _threads is None:
+        _threads = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_threads, _call, fn, args, db_path)
+    finally:
+        metrics.observe_db(time.perf_counter() - start)
+
+
+async def fetch_one(query: str, params: tuple = ()) -> Optional[tuple]:
+    return await run(lambda conn: conn.execute(query, params).fetchone())
+
+
+async def fetch_all(query: str, params: tuple = ()) -> List[tuple]:
+    return await run(lambda conn: conn.execute(query, params).fetchall())
+
+
+async def execute(query: str, params: tuple = ()) -> sqlite3.Cursor:
+    """Run a write statement; the returned cursor exposes lastrowid and rowcount"""
+    return await run(lambda conn: conn.execute(query, params))
@@ -0,0 +1,248 @@
+"""
+Streaming line diff engine used by compare_texts.
+
+The engine anchors on lines that occur exactly once on both sides (patience
+diff), strips common prefixes/suffixes of every region and only falls back to
+difflib for small regions without unique anchors. Matching blocks, opcodes,
+hunks and unified diff lines are all produced lazily, so callers can start
+consuming output before the whole comparison has finished.
+"""
+
+import difflib
+from bisect import bisect_left
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Bump whenever the produced diffs or results change so that cached results are invalidated
+ENGINE_VERSION = "4"
+
+# Regions without unique anchors are handed to difflib only when they are
+# small enough; larger ones are reported as a single replacement so the
+# engine stays close to linear on pathological inputs.
+MAX_FALLBACK_CELLS = 250_000
+
+Block = Tuple[int, int, int]
+Opcode = Tuple[str, int, int, int, int]
+
+
+def _unique_anchors(a: Sequence[str], alo: int, ahi: int,
+                    b: Sequence[str], blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """Return the longest increasing run of lines unique to both regions"""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, i, 0, 0]
+        else:
+            entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+
+    pairs = sorted((e[1], e[3]) for e in counts.values() if e[0] == 1 and e[2] == 1)
+    if not pairs:
+        return []
+
+    # Patience sorting: longest increasing subsequence on the b indices
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    prev: List[int] = [-1] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+        prev[k] = tail_idx[pos - 1] if pos > 0 else -1
+
+    anchors = []
+    k = tail_idx[-1]
+    while k != -1:
+        anchors.append(pairs[k])
+        k = prev[k]
+    anchors.reverse()
+    return anchors
+
+
+def iter_matching_blocks(a: Sequence[str], b: Sequence[str], alo: int = 0, ahi: Optional[int] = None,
+                         blo: int = 0, bhi: Optional[int] = None) -> Iterator[Block]:
+    """Yield (i, j, n) matching blocks in ascending order, like SequenceMatcher.
+
+    Only a[alo:ahi] and b[blo:bhi] are compared. The last block is always the
+    (ahi, bhi, 0) sentinel, i.e. (len(a), len(b), 0) for whole sequences.
+    """
+    ahi = len(a) if ahi is None else ahi
+    bhi = len(b) if bhi is None else bhi
+    # Regions are processed depth-first from an explicit stack so that blocks
+    # come out in order without recursion limits on large inputs.
+    stack = [(alo, ahi, blo, bhi)]
+    end_a, end_b = ahi, bhi
+    pending = None
+
+    def merge(block):
+        nonlocal pending
+        if pending is not None and pending[0] + pending[2] == block[0] and pending[1] + pending[2] == block[1]:
+            pending = (pending[0], pending[1], pending[2] + block[2])
+            return None
+        done, pending = pending, block
+        return done
+
+    while stack:
+        item = stack.pop()
+        if item[0] == 'match':
+            done = merge(item[1])
+            if done is not None:
+                yield done
+            continue
+
+        alo, ahi, blo, bhi = item
+        # Common prefix
+        start = 0
+        while alo + start < ahi and blo + start < bhi and a[alo + start] == b[blo + start]:
+            start += 1
+        if start:
+            done = merge((alo, blo, start))
+            if done is not None:
+                yield done
+            alo += start
+            blo += start
+        # Common suffix
+        end = 0
+        while ahi - end > alo and bhi - end > blo and a[ahi - end - 1] == b[bhi - end - 1]:
+            end += 1
+        suffix = (ahi - end, bhi - end, end) if end else None
+        ahi -= end
+        bhi -= end
+
+        todo = []
+        if alo < ahi and blo < bhi:
+            anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+            if anchors:
+                i0, j0 = alo, blo
+                for i, j in anchors:
+                    todo.append((i0, i, j0, j))
+                    todo.append(('match', (i, j, 1)))
+                    i0, j0 = i + 1, j + 1
+                todo.append((i0, ahi, j0, bhi))
+            elif (ahi - alo) * (bhi - blo) <= MAX_FALLBACK_CELLS:
+                matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+                for i, j, n in matcher.get_matching_blocks():
+                    if n:
+                        todo.append(('match', (alo + i, blo + j, n)))
+        if suffix:
+            todo.append(('match', suffix))
+        stack.extend(reversed(todo))
+
+    if pending is not None:
+        yield pending
+    yield (end_a, end_b, 0)
+
+
+def iter_opcodes(a: Sequence[str], b: Sequence[str], blocks: Optional[Iterable[Block]] = None) -> Iterator[Opcode]:
+    """Yield difflib-style (tag, i1, i2, j1, j2) opcodes
+
+    Precomputed matching blocks (sentinel included) may be passed in instead
+    of diffing a and b again.
+    """
+    i = j = 0
+    for ai, bj, size in iter_matching_blocks(a, b) if blocks is None else blocks:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            yield (tag, i, ai, j, bj)
+        i, j = ai + size, bj + size
+        if size:
+            yield ('equal', ai, i, bj, j)
+
+
+def iter_hunks(a: Sequence[str], b: Sequence[str], n: int = 3,
+               blocks: Optional[Iterable[Block]] = None) -> Iterator[List[Opcode]]:
+    """Yield groups of opcodes with up to n lines of context, one per hunk.
+
+    Equivalent to SequenceMatcher.get_grouped_opcodes, but streaming.
+    """
+    nn = n + n
+    group: List[Opcode] = []
+    first = True
+    codes = iter_opcodes(a, b, blocks)
+    current = next(codes, None)
+    while current is not None:
+        following = next(codes, None)
+        tag, i1, i2, j1, j2 = current
+        if tag == 'equal':
+            if first:
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+            if following is None:
+                i2, j2 = min(i2, i1 + n), min(j2, j1 + n)
+            elif i2 - i1 > nn:
+                group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+                if any(code[0] != 'equal' for code in group):
+                    yield group
+                group = []
+                i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+        first = False
+        current = following
+    if any(code[0] != 'equal' for code in group):
+        yield group
+
+
+def _format_range_unified(start: int, stop: int) -> str:
+    """Convert a range to the "ed" format used by unified diffs"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def format_hunk(a: Sequence[str], b: Sequence[str], group: List[Opcode],
+                lineterm: str = '\n') -> Iterator[str]:
+    """Render one opcode group as unified diff lines, header included"""
+    first, last = group[0], group[-1]
+    file1_range = _format_range_unified(first[1], last[2])
+    file2_range = _format_range_unified(first[3], last[4])
+    yield f"@@ -{file1_range} +{file2_range} @@{lineterm}"
+    for tag, i1, i2, j1, j2 in group:
+        if tag == 'equal':
+            for line in a[i1:i2]:
+                yield ' ' + line
+            continue
+        if tag in ('replace', 'delete'):
+            for line in a[i1:i2]:
+                yield '-' + line
+        if tag in ('replace', 'insert'):
+            for line in b[j1:j2]:
+                yield '+' + line
+
+
+def unified_diff(a: Sequence[str], b: Sequence[str], fromfile: str = '', tofile: str = '',
+                 n: int = 3, lineterm: str = '\n',
+                 progress: Optional[Callable[[int, int], None]] = None,
+                 blocks: Optional[Iterable[Block]] = None) -> Iterator[str]:
+    """Drop-in, streaming replacement for difflib.unified_diff
+
+    If given, progress is called after every hunk with the number of lines
+    of a scanned so far and the number of hunks emitted.
+    """
+    hunks = 0
+    for group in iter_hunks(a, b, n, blocks):
+        if not hunks:
+            yield f"--- {fromfile}{lineterm}"
+            yield f"+++ {tofile}{lineterm}"
+        yield from format_hunk(a, b, group, lineterm)
+        hunks += 1
+        if progress:
+            progress(group[-1][2], hunks)
+    if progress:
+        progress(len(a), hunks)
@@ -0,0 +1,215 @@
+"""
+Process pool for CPU-bound comparison, parsing and extraction work.
+
+Heavy work is submitted through ``executor.run(...)`` so that the asyncio
+event loop keeps serving other requests. The number of in-flight jobs is
+bounded (running + queued); once saturated, new jobs are rejected with 429,
+unless their caller waits for capacity first (see wait_for_capacity).
+Every job gets a deadline that is enforced inside the worker as well as in
+the awaiting coroutine. A worker that does not give up at its deadline is
+killed when the coroutine gives up on it, and the pool is replaced.
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import signal
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.context import BaseContext
+from typing import Any, Callable, Deque, Optional
+
+from fastapi import HTTPException
+
+import metrics
+
+# Backend processes on this machine (uvicorn --workers); the cores are split between their pools
+BACKEND_WORKERS = max(1, int(os.getenv("BACKEND_WORKERS", "1")))
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS", str(max(1, (os.cpu_count() or 1) // BACKEND_WORKERS))))
+COMPARE_QUEUE_SIZE = int(os.getenv("COMPARE_QUEUE_SIZE", "16"))
+COMPARE_TIMEOUT = float(os.getenv("COMPARE_TIMEOUT", "120"))
+# Modules imported by every worker when it starts, instead of by its first job
+WORKER_PRELOAD = [name for name in os.getenv("WORKER_PRELOAD", "openpyxl").split(",") if name.strip()]
+
+
+class JobTimeout(BaseException):
+    """Raised inside a worker when a job runs past its deadline
+
+    Not an Exception, so that the broad exception handlers of the code a job
+    runs cannot swallow the deadline.
+    """
+
+
+class JobError(Exception):
+    """Picklable carrier for HTTPExceptions raised inside a worker"""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+# The pid of the worker running each job slot of the pool, 0 when the slot is idle
+_job_pids = None
+
+
+def _on_deadline(signum, frame):
+    raise JobTimeout()
+
+
+def _start_worker(job_pids, initializer: Optional[Callable]):
+    global _job_pids
+    _job_pids = job_pids
+    if initializer is not None:
+        initializer()
+
+
+def _preload_worker():
+    for name in WORKER_PRELOAD:
+        try:
+            importlib.import_module(name.strip())
+        except ImportError:
+            pass
+
+
+def _invoke(fn: Callable, timeout: Optional[float], slot: int, args: tuple, kwargs: dict):
+    """Run fn in the worker, enforcing the deadline with a real-time timer
+
+    Returns the result together with the stage timings recorded by fn.
+    """
+    _job_pids[slot] = os.getpid()
+    use_timer = bool(timeout) and hasattr(signal, "setitimer")
+    if use_timer:
+        signal.signal(signal.SIGALRM, _on_deadline)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with metrics.collecting_stages() as stages:
+            result = fn(*args, **kwargs)
+        return result, stages
+    except HTTPException as e:
+        raise JobError(e.status_code, e.detail)
+    finally:
+        if use_timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        _job_pids[slot] = 0
+
+
+class ComparisonExecutor:
+    def __init__(self, max_workers: int = COMPARE_WORKERS, max_queue: int = COMPARE_QUEUE_SIZE,
+                 timeout: float = COMPARE_TIMEOUT, initializer: Optional[Callable] = None,
+                 mp_context: Optional[BaseContext] = None):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = self.max_workers + max(0, max_queue)
+        self.timeout = timeout
+        self.initializer = initializer
+        # Workers are forked by default; pass a spawn context for workers that must not inherit the API process
+        self.mp_context = mp_context
+        self.pending = 0
+        # Futures of the callers waiting for capacity, woken one per finished job
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._job_pids = None
+        self._free_slots = list(range(self.max_pending))
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            context = self.mp_context or multiprocessing.get_context()
+            self._job_pids = context.RawArray('l', self.max_pending)
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                             initializer=_start_worker,
+                                             initargs=(self._job_pids, self.initializer))
+        return self._pool
+
+    def _kill_job(self, pool: ProcessPoolExecutor, job_pids, slot: int):
+        """Kill the worker still running the job in slot and retire its pool
+
+        A killed worker breaks the whole pool, so every other job still
+        running on it fails with 503 and new jobs go to a fresh pool.
+        """
+        pid = job_pids[slot]
+        if pid:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        if self._pool is pool:
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self):
+        """Start every worker now so that the first jobs skip process startup"""
+        pool = self._get_pool()
+        for _ in range(self.max_workers):
+            pool.submit(os.getpid)
+
+    def check_capacity(self):
+        """Raise a 429 error if no more jobs can be accepted"""
+        if self.pending >= self.max_pending:
+            raise HTTPException(status_code=429, detail="Server is busy, please retry later")
+
+    async def wait_for_capacity(self):
+        """Wait until a job can be accepted; a run started right after cannot fail with 429"""
+        while self.pending >= self.max_pending:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Pass on a wake-up this waiter can no longer use
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_waiter()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def _wake_waiter(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs):
+        """Run fn(*args, **kwargs) in the pool and return its result"""
+        self.check_capacity()
+
+        timeout = timeout or self.timeout
+        self.pending += 1
+        slot = self._free_slots.pop()
+        pool = self._get_pool()
+        job_pids = self._job_pids
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(pool, _invoke, fn, timeout, slot, args, kwargs)
+            # The worker enforces the deadline itself; the grace period only
+            # covers queueing and result transfer.
+            result, stages = await asyncio.wait_for(future, timeout * 2 if timeout else None)
+            metrics.replay_stages(stages)
+            return result
+        except JobTimeout:
+            raise HTTPException(status_code=504, detail="Processing timed out")
+        except asyncio.TimeoutError:
+            # The worker ignored its deadline and would keep its process busy
+            self._kill_job(pool, job_pids, slot)
+            raise HTTPException(status_code=504, detail="Processing timed out")
+        except JobError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except BrokenProcessPool:
+            if self._pool is pool:
+                self._pool = None
+            raise HTTPException(status_code=503, detail="Worker process crashed, please retry")
+        finally:
+            self._free_slots.append(slot)
+            self.pending -= 1
+            self._wake_waiter()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+executor = ComparisonExecutor(initializer=_preload_worker)
@@ -0,0 +1,141 @@
+"""
+Grouping of comparison results.
+
+The unit of grouping is a change record: a removed or added line of a diff
+hunk, or a key of a keyed comparison. The group key of a record is computed
+once, by searching the group_by pattern in its text (without the diff
+prefix); hunk headers, file headers and context lines are never searched,
+nor even visited one by one: changed lines are located by scanning the line
+prefixes of a whole diff at once.
+
+Every capturing group of the pattern is one grouping level, so
+``(\\w+)\\.(\\w+)`` groups by block, then by register; a pattern without groups
+groups by the whole match. Groups that take no part in a match, such as the
+other branch of ``(a)|(b)``, are skipped, and a match without any group falls
+back to the whole match. Each group counts its records per kind (added and
+removed lines, or missing, extra and different keys). Records the pattern
+does not match are counted under the key None rather than dropped.
+
+A Grouper is fed one hunk at a time, so it runs alongside a streamed diff, or
+a whole diff at once. It keeps flat counts per key path, plus optionally the
+lines of each top-level group (the ``grouped_diff`` of compare_texts), and
+only builds the nested groups when asked for them.
+"""
+
+import operator
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+KINDS = {'-': "removed", '+': "added"}
+
+_CHANGED = re.compile(r'[-+]')
+_first_char = operator.itemgetter(0)
+
+Path = Tuple[Optional[str], ...]
+
+# The key path of records the pattern does not match
+UNMATCHED: Path = (None,)
+
+
+def _match_path(match: re.Match) -> Path:
+    """The key path of a match whose pattern has groups, without the groups it skipped"""
+    path = match.groups()
+    if None in path:
+        path = tuple(key for key in path if key is not None) or (match.group(0),)
+    return path
+
+
+def _prefixes(lines: List[str]) -> str:
+    """The first character of every diff line, as one string to search in"""
+    return ''.join(map(_first_char, lines))
+
+
+class Grouper:
+    def __init__(self, pattern: re.Pattern, collect_lines: bool = True):
+        self._search = pattern.search
+        self._whole_match = pattern.groups == 0
+        self.collect_lines = collect_lines
+        # Diff lines of every matched top-level key, in diff order
+        self.lines: Dict[str, List[str]] = {}
+        # Record counts per kind and key path
+        self._counts: Dict[str, Dict[Path, int]] = {}
+
+    def key(self, text: str) -> Path:
+        """The key path of a record, one key per level"""
+        match = self._search(text)
+        if match is None:
+            return UNMATCHED
+        return (match.group(0),) if self._whole_match else _match_path(match)
+
+    def _add_changes(self, lines: List[str], start: int, grouped: Dict[str, List[str]]):
+        """Group the removed and added lines of a diff, from lines[start] on"""
+        search, whole_match = self._search, self._whole_match
+        counts = {prefix: self._counts.setdefault(kind, {}) for prefix, kind in KINDS.items()}
+        prefixes = _prefixes(lines)
+        for changed in _CHANGED.finditer(prefixes, start):
+            line = lines[changed.start()]
+            match = search(line[1:])
+            if match is None:
+                path = UNMATCHED
+            else:
+                path = (match.group(0),) if whole_match else _match_path(match)
+            kind_counts = counts[changed.group()]
+            kind_counts[path] = kind_counts.get(path, 0) + 1
+            top = path[0]
+            if top is not None:
+                entries = grouped.get(top)
+                if entries is None:
+                    entries = grouped[top] = []
+                entries.append(line)
+
+    def add_hunk(self, lines: List[str]) -> Dict[str, List[str]]:
+        """Group the changed lines of one formatted hunk; returns its lines per top-level key"""
+        grouped: Dict[str, List[str]] = {}
+        self._add_changes(lines, 0, grouped)
+        if self.collect_lines:
+            for key, entries in grouped.items():
+                collected = self.lines.get(key)
+                if collected is None:
+                    self.lines[key] = list(entries)
+                else:
+                    collected.extend(entries)
+        return grouped
+
+    def add_diff(self, diff: List[str]):
+        """Group a complete unified diff"""
+        # The file header lines come first and are not changes
+        start = 2 if diff and diff[0].startswith('--- ') else 0
+        self._add_changes(diff, start, self.lines if self.collect_lines else {})
+
+    def add_records(self, records: Iterable[str], kind: str):
+        """Count records that are not part of a diff, such as the keys of a keyed comparison"""
+        counts = self._counts.setdefault(kind, {})
+        for text in records:
+            path = self.key(text)
+            counts[path] = counts.get(path, 0) + 1
+
+    def groups(self) -> List[dict]:
+        """Nested group counts: key, count, a count per kind and the next level as groups"""
+        nodes: Dict[Path, dict] = {}
+        roots: List[dict] = []
+        for kind, counts in self._counts.items():
+            for path, count in counts.items():
+                for level in range(1, len(path) + 1):
+                    prefix = path[:level]
+                    node = nodes.get(prefix)
+                    if node is None:
+                        node = nodes[prefix] = {"key": prefix[-1], "count": 0}
+                        siblings = roots if level == 1 else nodes[prefix[:-1]].setdefault("groups", [])
+                        siblings.append(node)
+                    node["count"] += count
+                    node[kind] = node.get(kind, 0) + count
+        _sort(roots)
+        return roots
+
+
+def _sort(groups: List[dict]):
+    # Most changed groups first
+    groups.sort(key=lambda group: -group["count"])
+    for group in groups:
+        if "groups" in group:
+            _sort(group["groups"])
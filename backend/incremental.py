@@ -0,0 +1,464 @@
+"""
+Incremental re-comparison of slightly edited inputs.
+
+Comparisons started through /compare/incremental keep their prepared lines
+as line tables (the line bytes, their offsets and their 64-bit hashes, see
+line_table.py) together with their matching blocks, shared by every backend
+process (see IncrementalStore) and cached in memory by the processes using
+them. When one side changes, either as a full new revision or as an edit
+delta (replace lines start..end), the edited range is located on the line
+hashes, matching blocks outside of it are kept (shifted past the edit) and
+only the region between the nearest unaffected blocks is diffed again, on
+hashes as well. The cost of a re-comparison therefore follows the size of
+the edit rather than the size of the files.
+
+Patched results are valid diffs of the new revision, but anchors are only
+searched inside the re-diffed region, so they can differ slightly from what
+a full comparison would pick.
+"""
+
+import asyncio
+import json
+import os
+import pickle
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+from fastapi import HTTPException
+
+import blob_store
+import db
+import diff_engine
+import metrics
+import patterns
+from blob_store import BlobRef
+from comparison import build_result, matching_blocks, prepare_table
+from diff_engine import Block
+from executor import executor
+from line_table import LineTable, join_tables, verified_blocks
+
+INCREMENTAL_ENTRIES = int(os.getenv("INCREMENTAL_ENTRIES", "64"))
+INCREMENTAL_MAX_LINES = int(os.getenv("INCREMENTAL_MAX_LINES", "4000000"))
+# Edited regions up to this many lines are re-diffed inline, larger ones in the worker pool;
+# the same goes for rendering whole comparisons
+INCREMENTAL_INLINE_LINES = int(os.getenv("INCREMENTAL_INLINE_LINES", "50000"))
+# Snapshots of the shared comparisons; defaults to BLOB_DIR/incremental
+INCREMENTAL_DIR = os.getenv("INCREMENTAL_DIR")
+# Journaled edits after which a comparison is snapshotted again
+INCREMENTAL_SNAPSHOT_EDITS = int(os.getenv("INCREMENTAL_SNAPSHOT_EDITS", "32"))
+
+Region = Tuple[int, int, int, int]
+
+
+class ComparisonState:
+    """Prepared line tables and matching blocks of one incremental comparison"""
+
+    def __init__(self, owner_id: int, lines1: LineTable, lines2: LineTable, blocks: List[Block],
+                 regex_pattern: Optional[str] = None, filter_pattern: Optional[str] = None,
+                 group_by: Optional[str] = None):
+        self.owner_id = owner_id
+        self.lines1 = lines1
+        self.lines2 = lines2
+        self.blocks = blocks
+        self.regex_pattern = regex_pattern
+        self.filter_pattern = filter_pattern
+        self.group_by = group_by
+        self.revision = 0
+        self.snapshot_revision = 0
+        self.lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return len(self.lines1) + len(self.lines2)
+
+
+def full_state(text1: Union[str, BlobRef], text2: Union[str, BlobRef], regex_pattern: Optional[str] = None,
+               filter_pattern: Optional[str] = None) -> tuple:
+    """Prepare both inputs and diff them completely; runs in a worker"""
+    regex, line_filter, _ = patterns.compile_patterns(regex_pattern, filter_pattern, None)
+    # Compacted, so that no mapped blob or filtered-out line outlives the worker
+    table1 = prepare_table(text1, regex, line_filter).compact()
+    table2 = prepare_table(text2, regex, line_filter).compact()
+    with metrics.stage("diff", lines=len(table1) + len(table2)):
+        return table1, table2, list(matching_blocks(table1, table2))
+
+
+def prepare_side(text: str, regex_pattern: Optional[str] = None, filter_pattern: Optional[str] = None) -> LineTable:
+    """Prepare a new revision of one input the same way as full_state"""
+    regex, line_filter, _ = patterns.compile_patterns(regex_pattern, filter_pattern, None)
+    return prepare_table(text, regex, line_filter).compact()
+
+
+def diff_region(a: LineTable, b: LineTable) -> List[Block]:
+    """Matching blocks of two region tables, without the sentinel"""
+    with metrics.stage("diff", lines=len(a) + len(b)):
+        return list(matching_blocks(a, b))[:-1]
+
+
+def _common_run(old: LineTable, new: LineTable, i: int, j: int, n: int, from_end: bool = False) -> int:
+    """Length of the verified run of equal lines at the start (or end) of a hash-matched range"""
+    blocks = [block for block in verified_blocks(old, new, [(i, j, n)]) if block[2]]
+    if from_end:
+        return blocks[-1][2] if blocks and blocks[-1][0] + blocks[-1][2] == i + n else 0
+    return blocks[0][2] if blocks and blocks[0][0] == i else 0
+
+
+def find_edit(old: LineTable, new: LineTable) -> Tuple[int, int, List[str]]:
+    """Locate the single edit turning old into new as (start, end, replacement lines)"""
+    limit = min(len(old), len(new))
+    differs = np.flatnonzero(old.hashes[:limit] != new.hashes[:limit])
+    start = _common_run(old, new, 0, 0, int(differs[0]) if len(differs) else limit)
+    tail = limit - start
+    differs = np.flatnonzero(old.hashes[len(old) - tail:][::-1] != new.hashes[len(new) - tail:][::-1])
+    end = int(differs[0]) if len(differs) else tail
+    end = _common_run(old, new, len(old) - end, len(new) - end, end, from_end=True)
+    return start, len(old) - end, new[start:len(new) - end]
+
+
+def splice_blocks(blocks: List[Block], start: int, end: int, inserted: int) -> Tuple[List[Block], List[Block], Region]:
+    """Split blocks around an edit of a[start:end] that now holds `inserted` lines
+
+    Returns the blocks before the edit, the blocks after it (already shifted
+    to the new numbering of a, sentinel included) and the (alo, ahi, blo, bhi)
+    region of the new a and of b that has to be diffed again.
+    """
+    delta = inserted - (end - start)
+    before: List[Block] = []
+    after: List[Block] = []
+    for i, j, n in blocks[:-1]:
+        if i < start:
+            before.append((i, j, min(n, start - i)))
+        if i + n > end:
+            skip = max(0, end - i)
+            after.append((i + skip + delta, j + skip, n - skip))
+    sentinel_a, sentinel_b, _ = blocks[-1]
+    after.append((sentinel_a + delta, sentinel_b, 0))
+
+    alo, blo = (before[-1][0] + before[-1][2], before[-1][1] + before[-1][2]) if before else (0, 0)
+    return before, after, (alo, after[0][0], blo, after[0][1])
+
+
+def merge_blocks(blocks: List[Block]) -> List[Block]:
+    """Join adjacent blocks, as iter_matching_blocks reports them; the sentinel is kept last"""
+    merged: List[Block] = []
+    for block in blocks[:-1]:
+        if merged:
+            i, j, n = merged[-1]
+            if i + n == block[0] and j + n == block[1]:
+                merged[-1] = (i, j, n + block[2])
+                continue
+        merged.append(block)
+    merged.append(blocks[-1])
+    return merged
+
+
+def transpose(blocks: List[Block]) -> List[Block]:
+    return [(j, i, n) for i, j, n in blocks]
+
+
+async def diff_edit(state: ComparisonState, side: int, start: int, end: int, replacement: List[str]) -> List[Block]:
+    """Matching blocks of the region an edit of lines start..end of one side affects
+
+    Only the region between the nearest blocks unaffected by the edit is
+    diffed again, inline when it is small and in the worker pool otherwise.
+    The state is left unchanged; the blocks are relative to the region.
+    """
+    if side == 1:
+        a, b, blocks = state.lines1, state.lines2, state.blocks
+    else:
+        a, b, blocks = state.lines2, state.lines1, transpose(state.blocks)
+    if not 0 <= start <= end <= len(a):
+        raise HTTPException(status_code=400, detail=f"Edit range {start}..{end} is outside of file{side}")
+
+    _, _, (alo, ahi, blo, bhi) = splice_blocks(blocks, start, end, len(replacement))
+    # Compact copies of the region, small enough to hand to a worker
+    region_a = join_tables([a.view(alo, start), _replacement_table(replacement),
+                            a.view(end, ahi - len(replacement) + end - start)])
+    region_b = b.view(blo, bhi).compact()
+    if len(region_a) + len(region_b) <= INCREMENTAL_INLINE_LINES:
+        return diff_region(region_a, region_b)
+    return await executor.run(diff_region, region_a, region_b)
+
+
+def _replacement_table(replacement: List[str]) -> LineTable:
+    return LineTable.from_text(''.join(replacement))
+
+
+def splice_table(table: LineTable, start: int, end: int, replacement: List[str]) -> LineTable:
+    """Replace lines start..end of a table
+
+    The replacement bytes are appended to the data, which is turned into a
+    bytearray on the first edit, and only the offset and hash buffers are
+    rebuilt; the bytes of replaced lines are dropped when the table is
+    compacted (see IncrementalStore.commit).
+    """
+    inserted = _replacement_table(replacement)
+    data = table.data if isinstance(table.data, bytearray) else bytearray(table.data)
+    offset = len(data)
+    data += inserted.data
+    return LineTable(
+        data,
+        np.concatenate((table.starts[:start], inserted.starts + offset, table.starts[end:])),
+        np.concatenate((table.ends[:start], inserted.ends + offset, table.ends[end:])),
+        np.concatenate((table.hashes[:start], inserted.hashes, table.hashes[end:])),
+        contiguous=False
+    )
+
+
+def patch(state: ComparisonState, side: int, start: int, end: int, replacement: List[str], region: List[Block]):
+    """Apply an edit and the re-diffed blocks of its region, as returned by diff_edit"""
+    if side == 1:
+        a, blocks = state.lines1, state.blocks
+    else:
+        a, blocks = state.lines2, transpose(state.blocks)
+    before, after, (alo, _, blo, _) = splice_blocks(blocks, start, end, len(replacement))
+    blocks = merge_blocks(before + [(i + alo, j + blo, n) for i, j, n in region] + after)
+
+    if side == 1:
+        state.lines1 = splice_table(a, start, end, replacement)
+        state.blocks = blocks
+    else:
+        state.lines2 = splice_table(a, start, end, replacement)
+        state.blocks = transpose(blocks)
+    state.revision += 1
+
+
+def render_tables(lines1: LineTable, lines2: LineTable, blocks: List[Block], group_by: Optional[str] = None,
+                  include_default_group: bool = True) -> dict:
+    """Build the compare_texts result of two tables and their matching blocks; runs in a worker"""
+    _, _, grouping = patterns.compile_patterns(None, None, group_by)
+    diff = list(diff_engine.unified_diff(lines1, lines2, fromfile='file1', tofile='file2', blocks=blocks))
+    return build_result(diff, grouping, include_default_group)
+
+
+async def render(state: ComparisonState, include_default_group: bool = True) -> dict:
+    """Build the compare_texts result for the current revision of a comparison
+
+    Like the regions of diff_edit, small comparisons are rendered inline and
+    larger ones in the worker pool.
+    """
+    args = (state.lines1, state.lines2, state.blocks, state.group_by, include_default_group)
+    if state.size <= INCREMENTAL_INLINE_LINES:
+        return render_tables(*args)
+    return await executor.run(render_tables, *args)
+
+
+def init_incremental_tables(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS incremental_comparisons (
+            id TEXT PRIMARY KEY,
+            owner_id INTEGER,
+            regex_pattern TEXT,
+            filter_pattern TEXT,
+            group_by TEXT,
+            revision INTEGER NOT NULL,
+            snapshot_revision INTEGER NOT NULL,
+            lines INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS incremental_edits (
+            comparison_id TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            edit TEXT NOT NULL,
+            PRIMARY KEY (comparison_id, revision)
+        )
+    ''')
+
+
+def register_comparison(conn: sqlite3.Connection, comparison_id: str, state: ComparisonState,
+                        max_entries: int, max_lines: int) -> List[Tuple[str, int]]:
+    """Record a new comparison and evict the least recently used ones over the limits
+
+    Returns the ids and snapshot revisions of the evicted comparisons.
+    """
+    conn.execute(
+        "INSERT INTO incremental_comparisons (id, owner_id, regex_pattern, filter_pattern, group_by, revision, "
+        "snapshot_revision, lines, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (comparison_id, state.owner_id, state.regex_pattern, state.filter_pattern, state.group_by,
+         state.revision, state.revision, state.size, time.time())
+    )
+    evicted = []
+    count = total = 0
+    rows = conn.execute("SELECT id, snapshot_revision, lines FROM incremental_comparisons ORDER BY updated_at DESC")
+    for row_id, snapshot_revision, lines in rows.fetchall():
+        count += 1
+        total += lines
+        if row_id != comparison_id and (count > max_entries or total > max_lines):
+            evicted.append((row_id, snapshot_revision))
+    for row_id, _ in evicted:
+        conn.execute("DELETE FROM incremental_comparisons WHERE id = ?", (row_id,))
+        conn.execute("DELETE FROM incremental_edits WHERE comparison_id = ?", (row_id,))
+    return evicted
+
+
+def load_comparison(conn: sqlite3.Connection, comparison_id: str, owner_id: Optional[int]) -> Optional[tuple]:
+    return conn.execute(
+        "SELECT regex_pattern, filter_pattern, group_by, revision, snapshot_revision FROM incremental_comparisons "
+        "WHERE id = ? AND owner_id IS ?",
+        (comparison_id, owner_id)
+    ).fetchone()
+
+
+def load_edits(conn: sqlite3.Connection, comparison_id: str, after_revision: int) -> List[tuple]:
+    return conn.execute(
+        "SELECT revision, edit FROM incremental_edits WHERE comparison_id = ? AND revision > ? ORDER BY revision",
+        (comparison_id, after_revision)
+    ).fetchall()
+
+
+def record_edit(conn: sqlite3.Connection, comparison_id: str, revision: int, edit: str, lines: int) -> bool:
+    """Append the edit producing revision, unless another process got there first"""
+    updated = conn.execute(
+        "UPDATE incremental_comparisons SET revision = ?, lines = ?, updated_at = ? WHERE id = ? AND revision = ?",
+        (revision, lines, time.time(), comparison_id, revision - 1)
+    )
+    if not updated.rowcount:
+        return False
+    conn.execute("INSERT INTO incremental_edits (comparison_id, revision, edit) VALUES (?, ?, ?)",
+                 (comparison_id, revision, edit))
+    return True
+
+
+def advance_snapshot(conn: sqlite3.Connection, comparison_id: str, revision: int) -> Optional[int]:
+    """Point a comparison at a newer snapshot and drop the edits it contains
+
+    Returns the revision of the replaced snapshot, or None if a newer one was
+    recorded meanwhile.
+    """
+    row = conn.execute("SELECT snapshot_revision FROM incremental_comparisons WHERE id = ?",
+                       (comparison_id,)).fetchone()
+    if row is None or row[0] >= revision:
+        return None
+    conn.execute("UPDATE incremental_comparisons SET snapshot_revision = ? WHERE id = ?", (revision, comparison_id))
+    conn.execute("DELETE FROM incremental_edits WHERE comparison_id = ? AND revision <= ?", (comparison_id, revision))
+    return row[0]
+
+
+def write_snapshot(path: str, state: ComparisonState):
+    """Store both line tables (bytes, offsets and hashes) and the matching blocks"""
+    blob_store._write_atomic(path, pickle.dumps((state.lines1, state.lines2, state.blocks), pickle.HIGHEST_PROTOCOL))
+
+
+def read_snapshot(path: str) -> tuple:
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class IncrementalStore:
+    """Incremental comparisons shared by every backend process
+
+    Comparisons live in the database as a snapshot file plus a journal of
+    the edits made since, each with the re-diffed blocks of its region, so
+    replaying an edit costs no diff. A process keeps recently used
+    comparisons in memory and only replays the edits other processes made.
+    """
+
+    def __init__(self, max_entries: int = INCREMENTAL_ENTRIES, max_lines: int = INCREMENTAL_MAX_LINES,
+                 directory: Optional[str] = INCREMENTAL_DIR, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.max_lines = max_lines
+        self.directory = directory
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, ComparisonState]" = OrderedDict()
+
+    def _snapshot_path(self, comparison_id: str, revision: int) -> str:
+        directory = self.directory or os.path.join(blob_store.BLOB_DIR, "incremental")
+        return os.path.join(directory, f"{comparison_id}-{revision}.pickle")
+
+    async def _in_thread(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def add(self, state: ComparisonState) -> str:
+        comparison_id = uuid.uuid4().hex
+        await self._in_thread(write_snapshot, self._snapshot_path(comparison_id, state.revision), state)
+        evicted = await db.run(register_comparison, comparison_id, state, self.max_entries, self.max_lines,
+                               db_path=self.db_path)
+        for evicted_id, revision in evicted:
+            self._entries.pop(evicted_id, None)
+            _remove(self._snapshot_path(evicted_id, revision))
+        self._entries[comparison_id] = state
+        self.evict()
+        return comparison_id
+
+    def get(self, comparison_id: str, owner_id: int) -> ComparisonState:
+        """The comparison as last seen by this process; sync it before use"""
+        state = self._entries.get(comparison_id)
+        if state is not None and state.owner_id == owner_id:
+            self._entries.move_to_end(comparison_id)
+            return state
+        # Filled in from the shared store by sync
+        empty = LineTable.from_text("")
+        placeholder = ComparisonState(owner_id, empty, empty, [(0, 0, 0)])
+        placeholder.revision = -1
+        if state is None:
+            self._entries[comparison_id] = placeholder
+        return placeholder
+
+    async def sync(self, comparison_id: str, state: ComparisonState) -> bool:
+        """Bring the comparison up to date with the edits of every process; False if it is gone"""
+        while True:
+            row = await db.run(load_comparison, comparison_id, state.owner_id, db_path=self.db_path)
+            if row is None:
+                if self._entries.get(comparison_id) is state:
+                    del self._entries[comparison_id]
+                return False
+            state.regex_pattern, state.filter_pattern, state.group_by, revision, snapshot_revision = row
+            if state.revision >= snapshot_revision:
+                break
+            try:
+                snapshot = await self._in_thread(read_snapshot, self._snapshot_path(comparison_id, snapshot_revision))
+            except FileNotFoundError:
+                # Replaced by a newer snapshot meanwhile
+                continue
+            state.lines1, state.lines2, state.blocks = snapshot
+            state.revision = state.snapshot_revision = snapshot_revision
+            break
+
+        if state.revision < revision:
+            for edit_revision, edit in await db.run(load_edits, comparison_id, state.revision, db_path=self.db_path):
+                edit = json.loads(edit)
+                patch(state, edit["side"], edit["start"], edit["end"], edit["replacement"],
+                      [tuple(block) for block in edit["region"]])
+        return True
+
+    async def commit(self, comparison_id: str, state: ComparisonState, side: int, start: int, end: int,
+                     replacement: List[str], region: List[Block]) -> bool:
+        """Record an edit made with diff_edit and apply it; False if another process edited first"""
+        edit = json.dumps({"side": side, "start": start, "end": end, "replacement": replacement, "region": region})
+        lines = state.size + len(replacement) - (end - start)
+        if not await db.run(record_edit, comparison_id, state.revision + 1, edit, lines, db_path=self.db_path):
+            return False
+        patch(state, side, start, end, replacement, region)
+
+        if state.revision - state.snapshot_revision >= INCREMENTAL_SNAPSHOT_EDITS:
+            # Drops the bytes of replaced lines, both in memory and in the snapshot
+            state.lines1, state.lines2 = state.lines1.compact(), state.lines2.compact()
+            await self._in_thread(write_snapshot, self._snapshot_path(comparison_id, state.revision), state)
+            replaced = await db.run(advance_snapshot, comparison_id, state.revision, db_path=self.db_path)
+            state.snapshot_revision = state.revision
+            if replaced is not None:
+                _remove(self._snapshot_path(comparison_id, replaced))
+        return True
+
+    def evict(self):
+        """Keep this process's copies within the limits; the shared store is evicted on add"""
+        total = sum(state.size for state in self._entries.values())
+        while self._entries and (len(self._entries) > self.max_entries or total > self.max_lines):
+            _, state = self._entries.popitem(last=False)
+            total -= state.size
+
+
+incremental_store = IncrementalStore()
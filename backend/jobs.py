@@ -0,0 +1,135 @@
+"""
+Background comparison jobs.
+
+Jobs are stored in the ``jobs`` table of the main SQLite database. The
+worker process running a job writes its progress and final result straight
+into the table, so job state survives the HTTP request that created it and
+can be polled from any backend process. Finished jobs are evicted once their
+TTL has passed.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Optional, Union
+
+import db
+from blob_store import BlobRef
+from comparison import compare_texts
+
+JOB_TTL = int(os.getenv("JOB_TTL", "86400"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "3600"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "2"))
+
+# Minimum delay between two progress writes from a running job
+PROGRESS_INTERVAL = 0.5
+
+
+def init_jobs_table(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            owner_id INTEGER,
+            state TEXT NOT NULL,
+            progress REAL DEFAULT 0,
+            lines_scanned INTEGER DEFAULT 0,
+            hunks_found INTEGER DEFAULT 0,
+            error TEXT,
+            result TEXT,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY (owner_id) REFERENCES users (id)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_expires_at ON jobs (expires_at)")
+
+
+def create_job(conn: sqlite3.Connection, owner_id: Optional[int]) -> str:
+    """Register a new queued job and evict expired ones"""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn.execute("DELETE FROM jobs WHERE expires_at < ?", (now,))
+    conn.execute(
+        "INSERT INTO jobs (id, owner_id, state, created_at, expires_at) VALUES (?, ?, 'queued', ?, ?)",
+        (job_id, owner_id, now, now + JOB_TTL)
+    )
+    return job_id
+
+
+def get_job(conn: sqlite3.Connection, job_id: str, owner_id: Optional[int]) -> Optional[dict]:
+    row = conn.execute(
+        "SELECT id, state, progress, lines_scanned, hunks_found, error, created_at, finished_at "
+        "FROM jobs WHERE id = ? AND owner_id = ? AND expires_at >= ?",
+        (job_id, owner_id, time.time())
+    ).fetchone()
+
+    if not row:
+        return None
+
+    return {
+        "id": row[0],
+        "state": row[1],
+        "progress": row[2],
+        "lines_scanned": row[3],
+        "hunks_found": row[4],
+        "error": row[5],
+        "created_at": row[6],
+        "finished_at": row[7]
+    }
+
+
+def get_job_result(conn: sqlite3.Connection, job_id: str, owner_id: Optional[int]) -> Optional[tuple]:
+    """Return (state, result JSON string) for a job, or None if unknown"""
+    return conn.execute(
+        "SELECT state, result FROM jobs WHERE id = ? AND owner_id = ? AND expires_at >= ?",
+        (job_id, owner_id, time.time())
+    ).fetchone()
+
+
+def update_job(conn: sqlite3.Connection, job_id: str, **fields):
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def fail_job(conn: sqlite3.Connection, job_id: str, error: str):
+    now = time.time()
+    update_job(conn, job_id, state='failed', error=error, finished_at=now, expires_at=now + JOB_TTL)
+
+
+def run_comparison_job(db_path: str, job_id: str, text1: Union[str, BlobRef], text2: Union[str, BlobRef],
+                       regex_pattern: Optional[str] = None, filter_pattern: Optional[str] = None,
+                       group_by: Optional[str] = None):
+    """Run a comparison job; executed inside a worker process"""
+    with db.connection(db_path) as conn:
+        update_job(conn, job_id, state='running')
+    last_write = 0.0
+    counters = {"lines_scanned": 0, "hunks_found": 0}
+
+    def report(scanned: int, total: int, hunks: int):
+        nonlocal last_write
+        counters["lines_scanned"], counters["hunks_found"] = scanned, hunks
+        now = time.monotonic()
+        if now - last_write < PROGRESS_INTERVAL:
+            return
+        last_write = now
+        percent = 100.0 * scanned / total if total else 100.0
+        with db.connection(db_path) as conn:
+            update_job(conn, job_id, progress=percent, lines_scanned=scanned, hunks_found=hunks)
+
+    result = compare_texts(text1, text2, regex_pattern, filter_pattern, group_by, progress=report)
+
+    serialized = json.dumps(result)
+    now = time.time()
+    with db.connection(db_path) as conn:
+        update_job(
+            conn, job_id,
+            state='completed',
+            progress=100.0,
+            **counters,
+            result=serialized,
+            finished_at=now,
+            expires_at=now + JOB_TTL
+        )
@@ -0,0 +1,177 @@
+"""
+Structured key/value comparison.
+
+Instead of diffing lines, both inputs are turned into key/value maps and
+compared with a hash join, which is linear in the number of entries and
+ignores reordered keys. Maps are extracted either with a regex whose first
+two groups (or named groups "key" and "value") capture the key and value,
+or with column rules on the tab-delimited text produced for Excel workbooks.
+This is the API counterpart of compare_configs/compare_mif_with_config in
+the example scripts.
+"""
+
+import json
+from typing import Dict, List, Optional, Union
+
+from fastapi import HTTPException
+
+import blob_store
+import patterns
+from blob_store import BlobRef
+from grouping import Grouper
+
+# Matches "key = value", "key: value" and "key value" lines
+DEFAULT_KEY_PATTERN = r'^([A-Za-z_][\w.\-/]*)\s*[=:]?\s*(.+)$'
+
+
+def _clean_value(value: str) -> str:
+    """Strip whitespace and surrounding quotes from a value"""
+    return value.strip().strip('"\'')
+
+
+def extract_pairs_regex(text: Union[str, BlobRef], key_pattern: Optional[str] = None,
+                        filter_pattern: Optional[str] = None) -> Dict[str, str]:
+    """Extract a key/value map from text, matching the pattern on every line"""
+    match_line = patterns.compile_pattern(key_pattern or DEFAULT_KEY_PATTERN, "key").search
+    line_filter = patterns.compile_pattern(filter_pattern, "filter")
+    skip = line_filter.search if line_filter else None
+
+    data = {}
+    for line in blob_store.iter_lines(text):
+        line = line.strip()
+        # Skip empty lines and comments
+        if not line or line.startswith('#'):
+            continue
+        if skip and skip(line):
+            continue
+
+        match = match_line(line)
+        if not match:
+            continue
+        groups = match.groupdict()
+        if 'key' in groups and 'value' in groups:
+            key, value = groups['key'], groups['value']
+        elif match.re.groups >= 2:
+            key, value = match.group(1), match.group(2)
+        else:
+            raise HTTPException(status_code=400, detail="Key pattern must capture a key and a value")
+        data[key] = _clean_value(value or '')
+    return data
+
+
+def extract_pairs_columns(text: Union[str, BlobRef], key_column: int = 0, value_column: Optional[int] = None,
+                          sheet: Optional[str] = None, filter_pattern: Optional[str] = None) -> Dict[str, str]:
+    """Extract a key/value map from the tab-delimited rows of an Excel workbook, skipping rows the filter matches"""
+    if value_column is None:
+        value_column = key_column + 1
+    line_filter = patterns.compile_pattern(filter_pattern, "filter")
+    skip = line_filter.search if line_filter else None
+
+    data = {}
+    current_sheet = None
+    for line in blob_store.iter_lines(text):
+        # Sheets are introduced by a "[name]" header line
+        if line.startswith('[') and line.endswith(']') and '\t' not in line:
+            current_sheet = line[1:-1]
+            continue
+        if sheet is not None and current_sheet != sheet:
+            continue
+        if skip and skip(line):
+            continue
+
+        cells = line.split('\t')
+        if key_column >= len(cells) or not cells[key_column]:
+            continue
+        value = cells[value_column] if value_column < len(cells) else ''
+        data[cells[key_column]] = _clean_value(value)
+    return data
+
+
+def compare_maps(data_a: Dict[str, str], data_b: Dict[str, str], include_matching: bool = False) -> dict:
+    """Hash join two key/value maps into only_in_a/only_in_b/different_values buckets"""
+    only_in_a = {}
+    different_values = {}
+    matching = {}
+    for key, value in data_a.items():
+        other = data_b.get(key)
+        if other is None:
+            only_in_a[key] = value
+        elif other != value:
+            different_values[key] = {"a": value, "b": other}
+        else:
+            matching[key] = value
+    only_in_b = {key: value for key, value in data_b.items() if key not in data_a}
+
+    result = {
+        "only_in_a": only_in_a,
+        "only_in_b": only_in_b,
+        "different_values": different_values,
+        "stats": {
+            "keys_a": len(data_a),
+            "keys_b": len(data_b),
+            "matching": len(matching),
+            "only_in_a": len(only_in_a),
+            "only_in_b": len(only_in_b),
+            "different_values": len(different_values),
+        }
+    }
+    if include_matching:
+        result["matching"] = matching
+    return result
+
+
+def extract_pairs(text: Union[str, BlobRef], key_pattern: Optional[str] = None,
+                  filter_pattern: Optional[str] = None, key_column: Optional[int] = None,
+                  value_column: Optional[int] = None, sheet: Optional[str] = None) -> Dict[str, str]:
+    """Extract a key/value map with column rules if a key column is given, else with the regex
+
+    The filter applies either way. Blob text is read line by line, so only
+    the map is held in memory.
+    """
+    if key_column is not None:
+        return extract_pairs_columns(text, key_column, value_column, sheet, filter_pattern)
+    return extract_pairs_regex(text, key_pattern, filter_pattern)
+
+
+def group_keys(result: dict, group_by: str) -> List[dict]:
+    """Nested counts of the missing, extra and different keys of a compare_maps result by group_by"""
+    grouper = Grouper(patterns.compile_pattern(group_by, "group_by"), collect_lines=False)
+    for kind in ("only_in_a", "only_in_b", "different_values"):
+        grouper.add_records(result[kind], kind)
+    return grouper.groups()
+
+
+def compare_keyed(text1: Union[str, BlobRef], text2: Union[str, BlobRef], key_pattern: Optional[str] = None,
+                  filter_pattern: Optional[str] = None, rules1: Optional[dict] = None,
+                  rules2: Optional[dict] = None, include_matching: bool = False,
+                  group_by: Optional[str] = None) -> dict:
+    """Compare two inputs as key/value maps; rules1/rules2 hold per-side column rules"""
+    data_a = extract_pairs(text1, key_pattern, filter_pattern, **(rules1 or {}))
+    data_b = extract_pairs(text2, key_pattern, filter_pattern, **(rules2 or {}))
+    result = compare_maps(data_a, data_b, include_matching)
+    if group_by:
+        result["groups"] = group_keys(result, group_by)
+    return result
+
+
+def extract_reference(text: Union[str, BlobRef], key_pattern: Optional[str] = None,
+                      filter_pattern: Optional[str] = None, rules: Optional[dict] = None) -> Dict[str, str]:
+    """Extract the key/value map of a batch reference once, to be compared against every target"""
+    return extract_pairs(text, key_pattern, filter_pattern, **(rules or {}))
+
+
+def compare_target(reference: Dict[str, str], target: Union[str, BlobRef], key_pattern: Optional[str] = None,
+                   filter_pattern: Optional[str] = None, rules: Optional[dict] = None) -> dict:
+    """Compare one batch target against the pre-extracted reference map"""
+    data = extract_pairs(target, key_pattern, filter_pattern, **(rules or {}))
+    return compare_maps(reference, data)
+
+
+def drifted_keys(result: dict) -> List[str]:
+    """Keys that are missing, extra or different in a compare_maps result"""
+    return [*result["only_in_a"], *result["only_in_b"], *result["different_values"]]
+
+
+def compare_keyed_json(*args, **kwargs) -> bytes:
+    """Run compare_keyed and serialize the result inside the worker"""
+    return json.dumps(compare_keyed(*args, **kwargs)).encode('utf-8')
@@ -0,0 +1,235 @@
+"""
+Compact line storage for large comparisons.
+
+A LineTable keeps the UTF-8 bytes of one input once and addresses its lines
+by start/end offsets held in NumPy buffers, next to a buffer of 64-bit line
+hashes. Filtering only rewrites the offset buffers, and the diff works on
+the hashes, so no per-line ``str`` objects are kept around; a line is only
+decoded when it is rendered. That is 24 bytes per line instead of a list
+entry plus a string object (50+ bytes of overhead each) for every
+intermediate copy.
+
+Line boundaries and hashes are computed in bulk with vectorized NumPy
+operations (a polynomial hash over the bytes of each line), evaluated in
+chunks to bound temporary memory. Lines end after "\\n" only, keeping the
+terminator. Blocks matched on hashes are checked against the bytes before
+use, so hash collisions cannot produce wrong diffs.
+"""
+
+import io
+import operator
+from itertools import repeat
+from typing import Callable, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from diff_engine import Block
+
+NEWLINE = ord('\n')
+
+# Bytes scanned or hashed per vectorized step; temporary buffers stay around 16x this size
+HASH_CHUNK = 1 << 20
+
+_BASE = 0x100000001B3
+_LENGTH_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+_powers = np.ones(1, dtype=np.uint64)
+_inverse_powers = np.ones(1, dtype=np.uint64)
+
+
+def _power_tables(size: int):
+    """BASE**k and BASE**-k modulo 2**64 for k < size, grown on demand"""
+    global _powers, _inverse_powers
+    if len(_powers) < size:
+        size = max(size, HASH_CHUNK)
+        tables = []
+        for factor in (_BASE, pow(_BASE, -1, 1 << 64)):
+            table = np.full(size, factor, dtype=np.uint64)
+            table[0] = 1
+            with np.errstate(over='ignore'):
+                tables.append(np.cumprod(table, dtype=np.uint64))
+        _powers, _inverse_powers = tables
+    return _powers, _inverse_powers
+
+
+def hash_lines(data: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Hash every non-empty data[starts[k]:ends[k]] in bulk; starts must be ascending"""
+    hashes = np.empty(len(starts), dtype=np.uint64)
+    first = 0
+    with np.errstate(over='ignore'):
+        while first < len(starts):
+            # A chunk is a run of whole lines spanning about HASH_CHUNK bytes
+            last = int(np.searchsorted(starts, starts[first] + HASH_CHUNK))
+            last = max(last, first + 1)
+            base = int(starts[first])
+            chunk = data[base:int(ends[last - 1])].astype(np.uint64)
+            powers, inverse_powers = _power_tables(len(chunk))
+            chunk *= powers[:len(chunk)]
+            relative = starts[first:last] - base
+            # Sum every line, then rescale it as if it started at power 0
+            line_hashes = np.add.reduceat(chunk, relative) * inverse_powers[relative]
+            line_hashes ^= (ends[first:last] - starts[first:last]).astype(np.uint64) * _LENGTH_MIX
+            hashes[first:last] = line_hashes
+            first = last
+    return hashes
+
+
+def line_bounds(data: np.ndarray):
+    """Start and end offsets of the lines of a byte buffer, scanned in chunks like hash_lines"""
+    chunks = [np.flatnonzero(data[offset:offset + HASH_CHUNK] == NEWLINE) + (offset + 1)
+              for offset in range(0, len(data), HASH_CHUNK)]
+    ends = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.intp)
+    if len(data) and (not len(ends) or ends[-1] != len(data)):
+        ends = np.append(ends, len(data))
+    starts = np.zeros_like(ends)
+    starts[1:] = ends[:-1]
+    return starts, ends
+
+
+class LineTable:
+    __slots__ = ("data", "starts", "ends", "hashes", "contiguous")
+
+    def __init__(self, data: bytes, starts: np.ndarray, ends: np.ndarray, hashes: np.ndarray,
+                 contiguous: bool = True):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self.hashes = hashes
+        # Whether consecutive lines are also adjacent in the data
+        self.contiguous = contiguous
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LineTable":
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        starts, ends = line_bounds(buffer)
+        return cls(data, starts, ends, hash_lines(buffer, starts, ends))
+
+    @classmethod
+    def from_text(cls, text: str) -> "LineTable":
+        return cls.from_bytes(text.encode('utf-8', errors='surrogatepass'))
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def line_bytes(self, index: int) -> bytes:
+        return self.data[self.starts[index]:self.ends[index]]
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            data = self.data
+            bounds = zip(self.starts[index].tolist(), self.ends[index].tolist())
+            return [data[start:end].decode('utf-8', errors='replace') for start, end in bounds]
+        return self.line_bytes(index).decode('utf-8', errors='replace')
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield data[start:end].decode('utf-8', errors='replace')
+
+    def view(self, start: int, stop: int) -> "LineTable":
+        """Lines start..stop - 1 as a table sharing the data"""
+        return LineTable(self.data, self.starts[start:stop], self.ends[start:stop], self.hashes[start:stop],
+                         self.contiguous)
+
+    def compact(self) -> "LineTable":
+        """Copy holding only the bytes of the lines, e.g. of a filtered table over a mapped file"""
+        return join_tables([self])
+
+    def span(self, start: int, stop: int) -> bytes:
+        """Bytes from the start of line start to the end of line stop - 1"""
+        return self.data[self.starts[start]:self.ends[stop - 1]] if stop > start else b''
+
+    def filtered(self, skip: Callable[[str], Optional[object]], binary: bool = False) -> "LineTable":
+        """Drop the lines for which skip(line without its newline) is truthy
+
+        With binary=True, skip is given the undecoded bytes of every line.
+        Mirrors the former split('\\n')/join('\\n') round trip: unless the
+        empty segment after a final newline survives the filter, the last
+        kept line loses its newline.
+        """
+        data = self.data
+        if binary:
+            buffer = np.frombuffer(data, dtype=np.uint8)
+            stops = self.ends - (buffer[self.ends - 1] == NEWLINE) if len(self) else self.ends
+            lines = map(data.__getitem__, map(slice, self.starts.tolist(), stops.tolist()))
+        elif self.contiguous:
+            lines = io.StringIO(str(data, 'utf-8', 'replace'), newline='\n')
+            # Lines hold at most one newline, at their end
+            lines = map(str.rstrip, lines, repeat('\n'))
+        else:
+            lines = map(str.rstrip, self, repeat('\n'))
+        keep = np.frombuffer(bytes(map(operator.not_, map(skip, lines))), dtype=np.bool_)
+        starts, ends, hashes = self.starts[keep], self.ends[keep], self.hashes[keep]
+
+        trailing_kept = not len(data) or (data[-1] == NEWLINE and not skip(b'' if binary else ''))
+        if len(ends) and not trailing_kept and data[ends[-1] - 1] == NEWLINE:
+            ends[-1] -= 1
+            if ends[-1] > starts[-1]:
+                hashes[-1:] = hash_lines(np.frombuffer(data, dtype=np.uint8), starts[-1:], ends[-1:])
+            else:
+                # An empty last line is no line at all, as with splitlines()
+                starts, ends, hashes = starts[:-1], ends[:-1], hashes[:-1]
+        return LineTable(data, starts, ends, hashes, self.contiguous and len(starts) == len(self.starts))
+
+
+def join_tables(tables: Sequence[LineTable]) -> LineTable:
+    """One compact table with the lines of every table in order; hashes are reused, not recomputed"""
+    chunks, starts, ends, hashes = [], [], [], []
+    offset = 0
+    for table in tables:
+        if not len(table):
+            continue
+        # Runs of adjacent lines are copied in one go
+        breaks = np.flatnonzero(table.starts[1:] != table.ends[:-1]) + 1
+        first = np.concatenate(([0], breaks))
+        last = np.concatenate((breaks, [len(table)]))
+        run_starts, run_ends = table.starts[first], table.ends[last - 1]
+        run_offsets = offset + np.cumsum(run_ends - run_starts) - (run_ends - run_starts)
+        shift = np.repeat(run_offsets - run_starts, last - first)
+        starts.append(table.starts + shift)
+        ends.append(table.ends + shift)
+        hashes.append(table.hashes)
+        data = table.data
+        chunks.extend(data[start:end] for start, end in zip(run_starts.tolist(), run_ends.tolist()))
+        offset = int(ends[-1][-1])
+    if not starts:
+        empty = np.zeros(0, dtype=np.intp)
+        return LineTable(b'', empty, empty.copy(), np.zeros(0, dtype=np.uint64))
+
+    data = b''.join(chunks)
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+    # Line bounds follow from the data alone when only the last line may lack its newline
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    contiguous = bool(np.all(buffer[ends[:-1] - 1] == NEWLINE))
+    return LineTable(data, starts, ends, np.concatenate(hashes), contiguous)
+
+
+def is_ascii(data: bytes) -> bool:
+    """Whether a buffer is pure ASCII, checked at memory speed"""
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return not len(buffer) or int(buffer.max()) < 0x80
+
+
+def split_lines(text: str) -> List[str]:
+    """Split text into lines the same way as LineTable"""
+    return list(io.StringIO(text, newline='\n'))
+
+
+def verified_blocks(a: LineTable, b: LineTable, blocks: Iterator[Block]) -> Iterator[Block]:
+    """Check hash-matched blocks against the data, splitting blocks on hash collisions"""
+    # Blocks of adjacent lines are checked with a single comparison of their spans
+    contiguous = a.contiguous and b.contiguous
+    for i, j, n in blocks:
+        if not n or (contiguous and a.span(i, i + n) == b.span(j, j + n)):
+            yield (i, j, n)
+            continue
+        run = 0
+        for k in range(n):
+            if a.line_bytes(i + k) == b.line_bytes(j + k):
+                run += 1
+                continue
+            if run:
+                yield (i + k - run, j + k - run, run)
+            run = 0
+        if run:
+            yield (i + n - run, j + n - run, run)
@@ -1,47 +1,106 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import uvicorn
 import os
 import sqlite3
 import jwt
 import hashlib
 from datetime import datetime, timedelta
 from typing import List, Optional
-import pandas as pd
-import openpyxl
-import re
 import json
-import difflib
 import asyncio
+import tempfile
 import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-# Load environment variables
+# Load environment variables before the modules below read their settings
 load_dotenv()
 
-app = FastAPI(title="FileCompareHub API", description="API for online file comparison and script management")
-
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+import blob_store
+import db
+import metrics
+from blob_store import BlobRef
+from db import DB_PATH
+from comparison import (
+    compare_texts,
+    compare_texts_json,
+    extract_blob_text,
+    extract_with_regex,
+    write_comparison_ndjson,
+)
+from executor import BACKEND_WORKERS, executor
+from jobs import (
+    JOB_CONCURRENCY,
+    JOB_TIMEOUT,
+    create_job,
+    fail_job,
+    get_job,
+    get_job_result,
+    init_jobs_table,
+    run_comparison_job,
+)
+from incremental import (
+    ComparisonState,
+    diff_edit,
+    find_edit,
+    full_state,
+    incremental_store,
+    init_incremental_tables,
+    prepare_side,
+    render,
 )
+from keyed import DEFAULT_KEY_PATTERN, compare_keyed_json, compare_target, drifted_keys, extract_reference
+from line_table import split_lines
+from patterns import compile_patterns
+from result_cache import make_key, result_cache
+from script_runner import script_runner
+from templates import compile_template, template_cache
+from tokens import init_revocations_table, load_revocations, revoke_token, token_cache, token_digest
+from uploads import receive_upload, receive_uploads, request_body_schema
+
+# Start the worker pools with the app, so that the first requests skip process startup
+WARM_WORKERS = int(os.getenv("WARM_WORKERS", "1"))
+
+router = APIRouter()
 
 # Security
 security = HTTPBearer()
 SECRET_KEY = os.getenv("SECRET_KEY", "filecomparehub_secret_key")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = float(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))
+# The default admin user, created on first start and always an admin
+DEFAULT_ADMIN_USERNAME = os.getenv("DEFAULT_ADMIN_USERNAME", "admin")
+DEFAULT_ADMIN_PASSWORD = os.getenv("DEFAULT_ADMIN_PASSWORD", "admin")
 
 # Database setup
-DB_PATH = os.getenv("DB_PATH", "filecomparehub.db")
+# Schema migrations applied on top of the base schema, in order. The number
+# of applied migrations is tracked in PRAGMA user_version.
+MIGRATIONS = [
+    # 1: index for the owner-scoped, keyset-paginated template listing
+    [
+        "CREATE INDEX IF NOT EXISTS idx_comparisons_owner_id ON comparisons (owner_id, id)",
+    ],
+    # 2: template versions, bumped on every config change to retire compiled pipelines
+    [
+        "ALTER TABLE comparisons ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+    ],
+    # 3: admin role, required to register scripts
+    [
+        "ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0",
+    ],
+]
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    with db.connection() as conn:
+        # Serializes concurrent startups, so every migration is applied exactly once
+        conn.execute("BEGIN IMMEDIATE")
+        _create_schema(conn.cursor())
+        db.apply_migrations(conn, MIGRATIONS)
+        conn.execute("UPDATE users SET is_admin = 1 WHERE username = ?", (DEFAULT_ADMIN_USERNAME,))
+
+def _create_schema(cursor: sqlite3.Cursor):
     
     # Create users table
     cursor.execute('''
@@ -79,204 +138,491 @@ def init_db():
         )
     ''')
     
+    # Create jobs table
+    init_jobs_table(cursor)
+    init_revocations_table(cursor)
+    init_incremental_tables(cursor)
+    
     # Create default user if not exists
-    default_username = os.getenv("DEFAULT_ADMIN_USERNAME", "admin")
-    default_password = os.getenv("DEFAULT_ADMIN_PASSWORD", "admin")
-    cursor.execute("SELECT id FROM users WHERE username = ?", (default_username,))
+    cursor.execute("SELECT id FROM users WHERE username = ?", (DEFAULT_ADMIN_USERNAME,))
     if not cursor.fetchone():
-        password_hash = hashlib.sha256(default_password.encode()).hexdigest()
+        password_hash = hashlib.sha256(DEFAULT_ADMIN_PASSWORD.encode()).hexdigest()
         cursor.execute(
             "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (default_username, password_hash)
+            (DEFAULT_ADMIN_USERNAME, password_hash)
         )
-    
-    conn.commit()
-    conn.close()
 
 # JWT functions
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(hours=24)
+    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except jwt.PyJWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-# Helper functions for file processing
-def read_excel_file(file_path: str) -> str:
-    """Read Excel file and convert to text representation"""
-    try:
-        df = pd.read_excel(file_path)
-        return df.to_string()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading Excel file: {str(e)}")
-
-def read_mif_file(file_path: str) -> str:
-    """Read MIF file as text"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading MIF file: {str(e)}")
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # Verified claims are cached per token until they expire, see tokens.py
+    digest = token_digest(credentials.credentials)
+    if token_cache.start_refresh():
+        try:
+            rows = await db.run(load_revocations, token_cache.revocations_seen)
+        except BaseException:
+            token_cache.cancel_refresh()
+            raise
+        token_cache.add_revocations(rows)
+    payload = token_cache.get(digest)
+    if payload is None:
+        try:
+            payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        if token_cache.is_revoked(digest):
+            raise HTTPException(status_code=401, detail="Token has been revoked")
+        token_cache.put(digest, payload)
+    return payload
 
-def read_txt_file(file_path: str) -> str:
-    """Read TXT file as text"""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading TXT file: {str(e)}")
-
-def extract_with_regex(text: str, pattern: str) -> List[str]:
-    """Extract matches using regex pattern"""
-    try:
-        return re.findall(pattern, text)
-    except re.error as e:
-        raise HTTPException(status_code=400, detail=f"Invalid regex pattern: {str(e)}")
-
-def compare_texts(text1: str, text2: str, regex_pattern: Optional[str] = None, 
-                  filter_pattern: Optional[str] = None, group_by: Optional[str] = None) -> dict:
-    """Compare two texts with optional regex processing"""
-    # Apply regex extraction if pattern provided
-    if regex_pattern:
-        matches1 = extract_with_regex(text1, regex_pattern)
-        matches2 = extract_with_regex(text2, regex_pattern)
-        # Handle tuple matches (multiple groups) by joining them
-        if matches1 and isinstance(matches1[0], tuple):
-            matches1 = [' '.join(match) for match in matches1]
-        if matches2 and isinstance(matches2[0], tuple):
-            matches2 = [' '.join(match) for match in matches2]
-        text1 = '\n'.join(matches1) if matches1 else ""
-        text2 = '\n'.join(matches2) if matches2 else ""
-    
-    # Apply filter if pattern provided
-    if filter_pattern:
-        lines1 = [line for line in text1.split('\n') if not re.search(filter_pattern, line)]
-        lines2 = [line for line in text2.split('\n') if not re.search(filter_pattern, line)]
-        text1 = '\n'.join(lines1)
-        text2 = '\n'.join(lines2)
-    
-    # Calculate diff
-    diff = list(difflib.unified_diff(
-        text1.splitlines(keepends=True),
-        text2.splitlines(keepends=True),
-        fromfile='file1',
-        tofile='file2'
-    ))
-    
-    # Group differences if requested
-    grouped_diff = {}
-    if group_by and regex_pattern:
-        # Group by regex groups
-        for line in diff:
-            match = re.search(group_by, line)
-            if match:
-                key = match.group(1) if len(match.groups()) > 0 else match.group(0)
-                if key not in grouped_diff:
-                    grouped_diff[key] = []
-                grouped_diff[key].append(line)
-    else:
-        grouped_diff['default'] = diff
-    
-    return {
-        "diff": diff,
-        "grouped_diff": grouped_diff,
-        "stats": {
-            "lines_added": len([d for d in diff if d.startswith('+') and not d.startswith('+++')]),
-            "lines_removed": len([d for d in diff if d.startswith('-') and not d.startswith('---')]),
-        }
-    }
+async def _is_admin(token: dict) -> bool:
+    row = await db.fetch_one("SELECT is_admin FROM users WHERE id = ?", (token.get("user_id"),))
+    return bool(row and row[0])
 
 # API Endpoints
-@app.post("/auth/login")
+@router.post("/auth/login")
 async def login(username: str, password: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     password_hash = hashlib.sha256(password.encode()).hexdigest()
-    cursor.execute(
+    user = await db.fetch_one(
         "SELECT id, username FROM users WHERE username = ? AND password_hash = ?",
         (username, password_hash)
     )
     
-    user = cursor.fetchone()
-    conn.close()
-    
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     access_token = create_access_token(data={"user_id": user[0], "username": user[1]})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/upload")
-async def upload_file(file: UploadFile = File(...), token: dict = Depends(verify_token)):
-    # Save file temporarily
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    temp_file_path = f"temp_{int(time.time())}{file_extension}"
-    
-    with open(temp_file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
-    
-    # Process based on file type
-    text_content = ""
-    if file_extension in ['.xlsx', '.xls']:
-        text_content = read_excel_file(temp_file_path)
-    elif file_extension == '.mif':
-        text_content = read_mif_file(temp_file_path)
-    elif file_extension == '.txt':
-        text_content = read_txt_file(temp_file_path)
-    else:
-        # For other files, read as text
-        try:
-            with open(temp_file_path, 'r', encoding='utf-8') as f:
-                text_content = f.read()
-        except:
-            text_content = "Binary file content not displayed"
-    
-    # Clean up temp file
-    os.remove(temp_file_path)
-    
-    return {
-        "filename": file.filename,
-        "content": text_content,
-        "size": len(content)
+@router.post("/auth/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    token: dict = Depends(verify_token)
+):
+    # Revoke the presented token until it would have expired anyway
+    digest = token_digest(credentials.credentials)
+    expires_at = float(token.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60))
+    await db.run(revoke_token, digest, expires_at)
+    token_cache.revoke(digest, expires_at)
+    return {"message": "Logged out"}
+
+@router.post("/upload", openapi_extra=request_body_schema("file"))
+async def upload_file(
+    request: Request,
+    include_content: bool = True,
+    token: dict = Depends(verify_token)
+):
+    # Stream the file into the content-addressed blob store; re-uploads are deduplicated
+    upload = await receive_upload(request)
+    
+    # Process based on file type in a worker process, unless the text is cached already
+    text_content = None
+    if include_content or blob_store.get_text_path(upload.blob_id) is None:
+        text_content = await executor.run(extract_blob_text, upload.blob_id, include_content)
+    
+    response = {
+        "filename": upload.filename,
+        "blob_id": upload.blob_id,
+        "size": upload.size
     }
+    if include_content:
+        response["content"] = text_content
+    return response
+
+def _comparison_input(content: Optional[str], blob_id: Optional[str], name: str):
+    """Pick the inline text or blob reference given for one side of a comparison"""
+    if blob_id:
+        if blob_store.get_text_path(blob_id) is None:
+            raise HTTPException(status_code=404, detail=f"Blob not found: {blob_id}")
+        return BlobRef(blob_id)
+    if content is None:
+        raise HTTPException(status_code=400, detail=f"Either {name}_content or {name}_blob is required")
+    return content
+
+# Delay between two reads of a streamed comparison that has no new records yet
+STREAM_POLL_INTERVAL = 0.05
+# Keeps nginx from buffering NDJSON responses, so records reach clients as they are produced
+NDJSON_HEADERS = {"X-Accel-Buffering": "no"}
 
-@app.post("/compare")
+def _stream_comparison(text1, text2, *options) -> StreamingResponse:
+    """Stream comparison records as NDJSON while a worker is still producing them
+
+    The worker writes one record per line into a spool file, flushing after
+    each record; the response tails that file, so neither process holds the
+    whole diff in memory and clients see the first hunks right away.
+    """
+    executor.check_capacity()
+    fd, spool_path = tempfile.mkstemp(prefix="compare-", suffix=".ndjson")
+    os.close(fd)
+    task = asyncio.create_task(executor.run(write_comparison_ndjson, spool_path, text1, text2, *options))
+    
+    async def records():
+        try:
+            with open(spool_path, 'rb') as spool:
+                pending = b''
+                while True:
+                    finished = task.done()
+                    chunk = spool.read(65536)
+                    if chunk:
+                        complete, newline, pending = (pending + chunk).rpartition(b'\n')
+                        if newline:
+                            yield complete + newline
+                    elif finished:
+                        break
+                    else:
+                        await asyncio.sleep(STREAM_POLL_INTERVAL)
+            
+            error = task.exception()
+            if error is not None:
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                yield (json.dumps({"type": "error", "detail": detail}) + '\n').encode('utf-8')
+        finally:
+            if not task.done():
+                task.cancel()
+            os.remove(spool_path)
+    
+    return StreamingResponse(records(), media_type="application/x-ndjson", headers=NDJSON_HEADERS)
+
+@router.post("/compare")
 async def compare_files(
-    file1_content: str,
-    file2_content: str,
+    file1_content: Optional[str] = None,
+    file2_content: Optional[str] = None,
+    file1_blob: Optional[str] = None,
+    file2_blob: Optional[str] = None,
     regex_pattern: Optional[str] = None,
     filter_pattern: Optional[str] = None,
     group_by: Optional[str] = None,
+    stream: bool = False,
+    include_default_group: bool = True,
     token: dict = Depends(verify_token)
 ):
+    compile_patterns(regex_pattern, filter_pattern, group_by)
+    text1 = _comparison_input(file1_content, file1_blob, "file1")
+    text2 = _comparison_input(file2_content, file2_blob, "file2")
+    
+    if stream:
+        return _stream_comparison(text1, text2, regex_pattern, filter_pattern, group_by, include_default_group)
+    
+    # Identical inputs and patterns are served from the result cache
+    cache_key = make_key(text1, text2, regex_pattern, filter_pattern, group_by, include_default_group)
+    result = await result_cache.get(cache_key)
+    if result is not None:
+        return Response(content=result, media_type="application/json")
+    
     try:
-        result = compare_texts(file1_content, file2_content, regex_pattern, filter_pattern, group_by)
-        return result
+        result = await executor.run(
+            compare_texts_json, text1, text2, regex_pattern, filter_pattern, group_by,
+            include_default_group=include_default_group
+        )
+        await result_cache.put(cache_key, result)
+        return Response(content=result, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/scripts")
-async def list_scripts(skip: int = 0, limit: int = 100, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+@router.post("/compare/keyed")
+async def compare_keyed_files(
+    file1_content: Optional[str] = None,
+    file2_content: Optional[str] = None,
+    file1_blob: Optional[str] = None,
+    file2_blob: Optional[str] = None,
+    key_pattern: Optional[str] = None,
+    filter_pattern: Optional[str] = None,
+    group_by: Optional[str] = None,
+    file1_key_column: Optional[int] = None,
+    file1_value_column: Optional[int] = None,
+    file2_key_column: Optional[int] = None,
+    file2_value_column: Optional[int] = None,
+    sheet: Optional[str] = None,
+    include_matching: bool = False,
+    token: dict = Depends(verify_token)
+):
+    compile_patterns(key_pattern or DEFAULT_KEY_PATTERN, filter_pattern, group_by)
+    text1 = _comparison_input(file1_content, file1_blob, "file1")
+    text2 = _comparison_input(file2_content, file2_blob, "file2")
+    
+    # Excel-column rules per side; sides without a key column use the key pattern
+    rules1 = rules2 = None
+    if file1_key_column is not None:
+        rules1 = {"key_column": file1_key_column, "value_column": file1_value_column, "sheet": sheet}
+    if file2_key_column is not None:
+        rules2 = {"key_column": file2_key_column, "value_column": file2_value_column, "sheet": sheet}
+    
+    cache_key = make_key(text1, text2, "keyed", key_pattern, filter_pattern, rules1, rules2, include_matching, group_by)
+    result = await result_cache.get(cache_key)
+    if result is None:
+        result = await executor.run(
+            compare_keyed_json, text1, text2, key_pattern, filter_pattern, rules1, rules2, include_matching, group_by
+        )
+        await result_cache.put(cache_key, result)
+    return Response(content=result, media_type="application/json")
+
+@router.post("/compare/incremental")
+async def start_incremental_comparison(
+    file1_content: Optional[str] = None,
+    file2_content: Optional[str] = None,
+    file1_blob: Optional[str] = None,
+    file2_blob: Optional[str] = None,
+    regex_pattern: Optional[str] = None,
+    filter_pattern: Optional[str] = None,
+    group_by: Optional[str] = None,
+    include_default_group: bool = True,
+    token: dict = Depends(verify_token)
+):
+    """Compare two inputs and keep the comparison for incremental updates"""
+    compile_patterns(regex_pattern, filter_pattern, group_by)
+    text1 = _comparison_input(file1_content, file1_blob, "file1")
+    text2 = _comparison_input(file2_content, file2_blob, "file2")
+    
+    lines1, lines2, blocks = await executor.run(full_state, text1, text2, regex_pattern, filter_pattern)
+    state = ComparisonState(token.get("user_id"), lines1, lines2, blocks, regex_pattern, filter_pattern, group_by)
+    comparison_id = await incremental_store.add(state)
+    result = await render(state, include_default_group)
+    return {"comparison_id": comparison_id, "revision": state.revision, **result}
+
+@router.post("/compare/incremental/{comparison_id}")
+async def update_incremental_comparison(
+    comparison_id: str,
+    side: int,
+    content: Optional[str] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    include_default_group: bool = True,
+    token: dict = Depends(verify_token)
+):
+    """Re-compare after one side changed, given as a new revision or as lines start..end replaced by content"""
+    if side not in (1, 2):
+        raise HTTPException(status_code=400, detail="side must be 1 or 2")
+    
+    state = incremental_store.get(comparison_id, token.get("user_id"))
+    async with state.lock:
+        # Other backend processes may have edited the comparison since
+        if not await incremental_store.sync(comparison_id, state):
+            raise HTTPException(status_code=404, detail="Comparison not found or expired")
+        if start is not None:
+            # Deltas address prepared lines, which only equal the raw lines without patterns
+            if state.regex_pattern or state.filter_pattern:
+                raise HTTPException(status_code=400, detail="Edit deltas require a comparison without regex or filter patterns")
+            replacement = split_lines(content or "")
+            end = start if end is None else end
+        elif content is None:
+            raise HTTPException(status_code=400, detail="Either content or an edit range is required")
+        else:
+            lines = await executor.run(prepare_side, content, state.regex_pattern, state.filter_pattern)
+            start, end, replacement = find_edit(state.lines1 if side == 1 else state.lines2, lines)
+        
+        region = await diff_edit(state, side, start, end, replacement)
+        if not await incremental_store.commit(comparison_id, state, side, start, end, replacement, region):
+            raise HTTPException(status_code=409, detail="Comparison was updated concurrently, retry against the latest revision")
+        incremental_store.evict()
+        result = await render(state, include_default_group)
+    return {"comparison_id": comparison_id, "revision": state.revision, **result}
+
+# Upper bound on the number of targets of a single batch comparison
+MAX_BATCH_TARGETS = int(os.getenv("MAX_BATCH_TARGETS", "1000"))
+
+async def _run_when_free(fn, *args, **kwargs):
+    """Run a job in the pool, waiting for capacity instead of failing with 429"""
+    await executor.wait_for_capacity()
+    return await executor.run(fn, *args, **kwargs)
+
+async def _batch_records(reference: dict, targets: List[str], key_pattern, filter_pattern, rules):
+    """Compare every target against the reference, yielding NDJSON records as targets finish
+
+    At most one comparison per worker is in flight, so a large batch neither
+    floods the pool nor starves other requests of it.
+    """
+    pending = {}
+    drift = {}
+    failed = 0
+    queue = iter(enumerate(targets))
+    try:
+        while True:
+            while len(pending) < executor.max_workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                index, blob_id = item
+                task = asyncio.ensure_future(
+                    _run_when_free(compare_target, reference, BlobRef(blob_id), key_pattern, filter_pattern, rules)
+                )
+                pending[task] = (index, blob_id)
+            if not pending:
+                break
+            
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, blob_id = pending.pop(task)
+                record = {"type": "target", "index": index, "target": blob_id}
+                try:
+                    result = task.result()
+                except Exception as e:
+                    # A failed target gets an error record; the stream still ends with the matrix
+                    failed += 1
+                    record["error"] = e.detail if isinstance(e, HTTPException) else str(e) or type(e).__name__
+                else:
+                    record.update(result)
+                    for key in drifted_keys(result):
+                        drift.setdefault(key, []).append(index)
+                yield (json.dumps(record) + '\n').encode('utf-8')
+        
+        for indexes in drift.values():
+            indexes.sort()
+        matrix = {"type": "matrix", "targets": targets, "failed": failed, "drift": drift}
+        yield (json.dumps(matrix) + '\n').encode('utf-8')
+    finally:
+        for task in pending:
+            task.cancel()
+
+@router.post("/compare/batch")
+async def compare_batch(
+    target_blobs: str,  # JSON array of blob ids
+    reference_content: Optional[str] = None,
+    reference_blob: Optional[str] = None,
+    key_pattern: Optional[str] = None,
+    filter_pattern: Optional[str] = None,
+    reference_key_column: Optional[int] = None,
+    reference_value_column: Optional[int] = None,
+    target_key_column: Optional[int] = None,
+    target_value_column: Optional[int] = None,
+    sheet: Optional[str] = None,
+    token: dict = Depends(verify_token)
+):
+    """Compare one reference against many targets as key/value maps, streamed as NDJSON"""
+    compile_patterns(key_pattern or DEFAULT_KEY_PATTERN, filter_pattern)
+    reference = _comparison_input(reference_content, reference_blob, "reference")
     
-    cursor.execute(
-        "SELECT id, name, description, supported_formats, created_at FROM scripts LIMIT ? OFFSET ?",
-        (limit, skip)
+    try:
+        targets = json.loads(target_blobs)
+    except json.JSONDecodeError:
+        targets = None
+    if not isinstance(targets, list) or not all(isinstance(target, str) for target in targets):
+        raise HTTPException(status_code=400, detail="target_blobs must be a JSON array of blob ids")
+    if not targets:
+        raise HTTPException(status_code=400, detail="At least one target is required")
+    if len(targets) > MAX_BATCH_TARGETS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_TARGETS} targets are allowed")
+    for blob_id in targets:
+        _comparison_input(None, blob_id, "target")
+    
+    reference_rules = target_rules = None
+    if reference_key_column is not None:
+        reference_rules = {"key_column": reference_key_column, "value_column": reference_value_column, "sheet": sheet}
+    if target_key_column is not None:
+        target_rules = {"key_column": target_key_column, "value_column": target_value_column, "sheet": sheet}
+    
+    # The reference is parsed and extracted once; workers only receive its key/value map
+    reference_map = await executor.run(extract_reference, reference, key_pattern, filter_pattern, reference_rules)
+    return StreamingResponse(
+        _batch_records(reference_map, targets, key_pattern, filter_pattern, target_rules),
+        media_type="application/x-ndjson",
+        headers=NDJSON_HEADERS
     )
+
+@router.get("/compare/cache")
+async def compare_cache_stats(token: dict = Depends(verify_token)):
+    return result_cache.stats()
+
+# Background comparison jobs
+_job_tasks = set()
+_job_slots = None
+
+async def _run_job(job_id: str, *args):
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(JOB_CONCURRENCY)
+    
+    # Jobs wait for a free slot, and then for pool capacity, instead of being rejected
+    async with _job_slots:
+        try:
+            await _run_when_free(run_comparison_job, DB_PATH, job_id, *args, timeout=JOB_TIMEOUT)
+        except HTTPException as e:
+            await db.run(fail_job, job_id, str(e.detail))
+        except Exception as e:
+            await db.run(fail_job, job_id, str(e))
+
+@router.post("/jobs/compare")
+async def create_compare_job(
+    file1_content: Optional[str] = None,
+    file2_content: Optional[str] = None,
+    file1_blob: Optional[str] = None,
+    file2_blob: Optional[str] = None,
+    regex_pattern: Optional[str] = None,
+    filter_pattern: Optional[str] = None,
+    group_by: Optional[str] = None,
+    token: dict = Depends(verify_token)
+):
+    compile_patterns(regex_pattern, filter_pattern, group_by)
+    text1 = _comparison_input(file1_content, file1_blob, "file1")
+    text2 = _comparison_input(file2_content, file2_blob, "file2")
+    job_id = await db.run(create_job, token.get("user_id"))
+    task = asyncio.create_task(_run_job(job_id, text1, text2, regex_pattern, filter_pattern, group_by))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    
+    return {"id": job_id, "state": "queued"}
+
+@router.get("/jobs/{job_id}")
+async def get_compare_job(job_id: str, token: dict = Depends(verify_token)):
+    job = await db.run(get_job, job_id, token.get("user_id"))
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+async def get_compare_job_result(job_id: str, token: dict = Depends(verify_token)):
+    row = await db.run(get_job_result, job_id, token.get("user_id"))
+    if not row:
+        raise HTTPException(status_code=404, detail="Job not found")
     
-    scripts = cursor.fetchall()
-    conn.close()
+    state, result = row
+    if state != 'completed':
+        raise HTTPException(status_code=409, detail=f"Job is {state}")
+    
+    # The result is stored as serialized JSON already
+    return Response(content=result, media_type="application/json")
+
+def _page_query(base: str, where: List[str], params: list, skip: int, after: Optional[int], limit: int):
+    """Build a listing query; keyset pagination on id unless only a legacy offset is given"""
+    if after is not None or not skip:
+        where = where + ["id > ?"]
+        params = params + [after or 0]
+    query = base
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY id LIMIT ?"
+    params = params + [limit]
+    if after is None and skip:
+        query += " OFFSET ?"
+        params.append(skip)
+    return query, tuple(params)
+
+def _set_next_cursor(response: Response, rows: list, limit: int):
+    """Expose the id to pass as after= for the next page, if there may be one"""
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1][0])
+
+@router.get("/scripts")
+async def list_scripts(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+    token: dict = Depends(verify_token)
+):
+    query, params = _page_query(
+        "SELECT id, name, description, supported_formats, created_at FROM scripts",
+        [], [], skip, after, limit
+    )
+    scripts = await db.fetch_all(query, params)
+    _set_next_cursor(response, scripts, limit)
     
     return [
         {
@@ -289,7 +635,7 @@ async def list_scripts(skip: int = 0, limit: int = 100, token: dict = Depends(ve
         for row in scripts
     ]
 
-@app.post("/scripts")
+@router.post("/scripts")
 async def create_script(
     name: str,
     content: str,
@@ -297,36 +643,28 @@ async def create_script(
     supported_formats: Optional[str] = None,  # JSON array string
     token: dict = Depends(verify_token)
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    # Scripts run arbitrary code on the server, so only admins may register them
+    if not await _is_admin(token):
+        raise HTTPException(status_code=403, detail="Only admins can register scripts")
     
     try:
-        cursor.execute(
+        cursor = await db.execute(
             "INSERT INTO scripts (name, description, content, supported_formats, owner_id) VALUES (?, ?, ?, ?, ?)",
             (name, description, content, supported_formats, token.get("user_id"))
         )
-        conn.commit()
         script_id = cursor.lastrowid
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Script name already exists")
-    finally:
-        conn.close()
     
     return {"id": script_id, "message": "Script created successfully"}
 
-@app.get("/scripts/{script_id}")
+@router.get("/scripts/{script_id}")
 async def get_script(script_id: int, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
+    row = await db.fetch_one(
         "SELECT id, name, description, content, supported_formats, created_at FROM scripts WHERE id = ?",
         (script_id,)
     )
     
-    row = cursor.fetchone()
-    conn.close()
-    
     if not row:
         raise HTTPException(status_code=404, detail="Script not found")
     
@@ -339,7 +677,7 @@ async def get_script(script_id: int, token: dict = Depends(verify_token)):
         "created_at": row[5]
     }
 
-@app.put("/scripts/{script_id}")
+@router.put("/scripts/{script_id}")
 async def update_script(
     script_id: int,
     name: Optional[str] = None,
@@ -348,13 +686,8 @@ async def update_script(
     supported_formats: Optional[str] = None,  # JSON array string
     token: dict = Depends(verify_token)
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Check if script exists and belongs to user
-    cursor.execute("SELECT id FROM scripts WHERE id = ? AND owner_id = ?", (script_id, token.get("user_id")))
-    if not cursor.fetchone():
-        conn.close()
+    if not await db.fetch_one("SELECT id FROM scripts WHERE id = ? AND owner_id = ?", (script_id, token.get("user_id"))):
         raise HTTPException(status_code=404, detail="Script not found or unauthorized")
     
     # Build update query dynamically
@@ -366,6 +699,8 @@ async def update_script(
         params.append(name)
     
     if content is not None:
+        if not await _is_admin(token):
+            raise HTTPException(status_code=403, detail="Only admins can change script code")
         update_fields.append("content = ?")
         params.append(content)
     
@@ -378,94 +713,105 @@ async def update_script(
         params.append(supported_formats)
     
     if not update_fields:
-        conn.close()
         raise HTTPException(status_code=400, detail="No fields to update")
     
     params.append(script_id)
     query = f"UPDATE scripts SET {', '.join(update_fields)} WHERE id = ?"
     
-    cursor.execute(query, params)
-    conn.commit()
-    conn.close()
+    await db.execute(query, tuple(params))
     
     return {"message": "Script updated successfully"}
 
-@app.delete("/scripts/{script_id}")
+@router.delete("/scripts/{script_id}")
 async def delete_script(script_id: int, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Check if script exists and belongs to user
-    cursor.execute("SELECT id FROM scripts WHERE id = ? AND owner_id = ?", (script_id, token.get("user_id")))
-    if not cursor.fetchone():
-        conn.close()
+    if not await db.fetch_one("SELECT id FROM scripts WHERE id = ? AND owner_id = ?", (script_id, token.get("user_id"))):
         raise HTTPException(status_code=404, detail="Script not found or unauthorized")
     
-    cursor.execute("DELETE FROM scripts WHERE id = ?", (script_id,))
-    conn.commit()
-    conn.close()
+    await db.execute("DELETE FROM scripts WHERE id = ?", (script_id,))
     
     return {"message": "Script deleted successfully"}
 
-@app.get("/comparisons")
-async def list_comparisons(skip: int = 0, limit: int = 100, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _script_input(blob_id: str) -> str:
+    """Absolute path of an uploaded file, handed to scripts without copying it"""
+    path = os.path.abspath(blob_store.raw_path(blob_id))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Blob not found: {blob_id}")
+    return path
+
+@router.post("/scripts/{script_id}/run")
+async def run_script(
+    script_id: int,
+    file1_blob: str,
+    file2_blob: str,
+    params: Optional[str] = None,  # JSON object passed as keyword arguments
+    token: dict = Depends(verify_token)
+):
+    row = await db.fetch_one("SELECT content, owner_id FROM scripts WHERE id = ?", (script_id,))
+    if not row or (row[1] != token.get("user_id") and not await _is_admin(token)):
+        raise HTTPException(status_code=404, detail="Script not found or unauthorized")
     
-    cursor.execute(
-        "SELECT id, name, config, created_at FROM comparisons WHERE owner_id = ? LIMIT ? OFFSET ?",
-        (token.get("user_id"), limit, skip)
+    try:
+        kwargs = json.loads(params) if params else {}
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    if not isinstance(kwargs, dict):
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    
+    result = await script_runner.run(row[0], _script_input(file1_blob), _script_input(file2_blob), kwargs)
+    return Response(content=result, media_type="application/json")
+
+@router.get("/comparisons")
+async def list_comparisons(
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    after: Optional[int] = None,
+    include_config: bool = True,
+    token: dict = Depends(verify_token)
+):
+    # Skip the heavy config column entirely when only names are needed
+    columns = "id, name, created_at, config" if include_config else "id, name, created_at"
+    query, params = _page_query(
+        f"SELECT {columns} FROM comparisons",
+        ["owner_id = ?"], [token.get("user_id")], skip, after, limit
     )
-    
-    comparisons = cursor.fetchall()
-    conn.close()
-    
-    return [
-        {
-            "id": row[0],
-            "name": row[1],
-            "config": json.loads(row[2]) if row[2] else {},
-            "created_at": row[3]
-        }
-        for row in comparisons
-    ]
+    comparisons = await db.fetch_all(query, params)
+    _set_next_cursor(response, comparisons, limit)
+    
+    items = []
+    for row in comparisons:
+        item = {"id": row[0], "name": row[1]}
+        if include_config:
+            item["config"] = json.loads(row[3]) if row[3] else {}
+        item["created_at"] = row[2]
+        items.append(item)
+    return items
 
-@app.post("/comparisons")
+@router.post("/comparisons")
 async def create_comparison(
     name: str,
     config: str,  # JSON string
     token: dict = Depends(verify_token)
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute(
+        cursor = await db.execute(
             "INSERT INTO comparisons (name, config, owner_id) VALUES (?, ?, ?)",
             (name, config, token.get("user_id"))
         )
-        conn.commit()
         comparison_id = cursor.lastrowid
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error creating comparison: {str(e)}")
-    finally:
-        conn.close()
     
     return {"id": comparison_id, "message": "Comparison template created successfully"}
 
-@app.get("/comparisons/{comparison_id}")
+@router.get("/comparisons/{comparison_id}")
 async def get_comparison(comparison_id: int, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT id, name, config, created_at FROM comparisons WHERE id = ? AND owner_id = ?",
+    row = await db.fetch_one(
+        "SELECT id, name, config, created_at, version FROM comparisons WHERE id = ? AND owner_id = ?",
         (comparison_id, token.get("user_id"))
     )
     
-    row = cursor.fetchone()
-    conn.close()
-    
     if not row:
         raise HTTPException(status_code=404, detail="Comparison template not found or unauthorized")
     
@@ -473,23 +819,19 @@ async def get_comparison(comparison_id: int, token: dict = Depends(verify_token)
         "id": row[0],
         "name": row[1],
         "config": json.loads(row[2]) if row[2] else {},
+        "version": row[4],
         "created_at": row[3]
     }
 
-@app.put("/comparisons/{comparison_id}")
+@router.put("/comparisons/{comparison_id}")
 async def update_comparison(
     comparison_id: int,
     name: Optional[str] = None,
     config: Optional[str] = None,  # JSON string
     token: dict = Depends(verify_token)
 ):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Check if comparison exists and belongs to user
-    cursor.execute("SELECT id FROM comparisons WHERE id = ? AND owner_id = ?", (comparison_id, token.get("user_id")))
-    if not cursor.fetchone():
-        conn.close()
+    if not await db.fetch_one("SELECT id FROM comparisons WHERE id = ? AND owner_id = ?", (comparison_id, token.get("user_id"))):
         raise HTTPException(status_code=404, detail="Comparison template not found or unauthorized")
     
     # Build update query dynamically
@@ -503,41 +845,143 @@ async def update_comparison(
     if config is not None:
         update_fields.append("config = ?")
         params.append(config)
+        update_fields.append("version = version + 1")
     
     if not update_fields:
-        conn.close()
         raise HTTPException(status_code=400, detail="No fields to update")
     
     params.append(comparison_id)
     query = f"UPDATE comparisons SET {', '.join(update_fields)} WHERE id = ?"
     
-    cursor.execute(query, params)
-    conn.commit()
-    conn.close()
+    await db.execute(query, tuple(params))
     
     return {"message": "Comparison template updated successfully"}
 
-@app.delete("/comparisons/{comparison_id}")
+@router.delete("/comparisons/{comparison_id}")
 async def delete_comparison(comparison_id: int, token: dict = Depends(verify_token)):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     # Check if comparison exists and belongs to user
-    cursor.execute("SELECT id FROM comparisons WHERE id = ? AND owner_id = ?", (comparison_id, token.get("user_id")))
-    if not cursor.fetchone():
-        conn.close()
+    if not await db.fetch_one("SELECT id FROM comparisons WHERE id = ? AND owner_id = ?", (comparison_id, token.get("user_id"))):
         raise HTTPException(status_code=404, detail="Comparison template not found or unauthorized")
     
-    cursor.execute("DELETE FROM comparisons WHERE id = ?", (comparison_id,))
-    conn.commit()
-    conn.close()
+    await db.execute("DELETE FROM comparisons WHERE id = ?", (comparison_id,))
     
     return {"message": "Comparison template deleted successfully"}
 
-@app.get("/")
+async def _template_pipeline(comparison_id: int, user_id):
+    """The compiled pipeline of a template, compiled only once per template version"""
+    row = await db.fetch_one(
+        "SELECT config, version FROM comparisons WHERE id = ? AND owner_id = ?", (comparison_id, user_id)
+    )
+    if not row:
+        raise HTTPException(status_code=404, detail="Comparison template not found or unauthorized")
+    config, version = row
+    pipeline = template_cache.get(comparison_id, version)
+    if pipeline is None:
+        # The config is only parsed when this version has not been compiled yet
+        pipeline = compile_template(config)
+        template_cache.put(comparison_id, version, pipeline)
+    return pipeline
+
+async def _uploaded_inputs(request: Request, fields: List[str]) -> dict:
+    """Blob references of the files uploaded with the request, with their text extracted"""
+    uploads = await receive_uploads(request, fields)
+    inputs = {}
+    for field, upload in uploads.items():
+        if blob_store.get_text_path(upload.blob_id) is None:
+            await executor.run(extract_blob_text, upload.blob_id, False)
+        inputs[field] = BlobRef(upload.blob_id)
+    return inputs
+
+@router.post("/comparisons/{comparison_id}/run")
+async def run_comparison(
+    comparison_id: int,
+    request: Request,
+    file1_blob: Optional[str] = None,
+    file2_blob: Optional[str] = None,
+    stream: bool = False,
+    token: dict = Depends(verify_token)
+):
+    # Resolved before the upload is read, so unusable templates fail fast
+    pipeline = await _template_pipeline(comparison_id, token.get("user_id"))
+    
+    inputs = {}
+    for name, blob_id in (("file1", file1_blob), ("file2", file2_blob)):
+        if blob_id:
+            inputs[name] = _comparison_input(None, blob_id, name)
+    missing = [name for name in ("file1", "file2") if name not in inputs]
+    if missing:
+        inputs.update(await _uploaded_inputs(request, missing))
+    text1, text2 = inputs["file1"], inputs["file2"]
+    
+    if stream:
+        return _stream_comparison(text1, text2, *pipeline.options)
+    
+    # Shares its entries with /compare for the same inputs and patterns
+    cache_key = make_key(text1, text2, *pipeline.options)
+    result = await result_cache.get(cache_key)
+    if result is not None:
+        return Response(content=result, media_type="application/json")
+    
+    try:
+        result = await executor.run(
+            compare_texts_json, text1, text2, pipeline.regex_pattern, pipeline.filter_pattern, pipeline.group_by,
+            include_default_group=pipeline.include_default_group
+        )
+        await result_cache.put(cache_key, result)
+        return Response(content=result, media_type="application/json")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/")
 async def root():
     return {"message": "Welcome to FileCompareHub API"}
 
-if __name__ == "__main__":
+@router.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is created and migrated before the first request is served
     init_db()
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if WARM_WORKERS:
+        executor.warm()
+        script_runner.warm()
+    flusher = asyncio.create_task(metrics.flush_periodically()) if metrics.METRICS_DIR else None
+    try:
+        yield
+    finally:
+        if flusher is not None:
+            flusher.cancel()
+        executor.shutdown()
+        script_runner.shutdown()
+        db.close_pools()
+        if metrics.METRICS_DIR:
+            metrics.flush()
+
+def create_app() -> FastAPI:
+    app = FastAPI(title="FileCompareHub API", description="API for online file comparison and script management")
+    app.router.lifespan_context = lifespan
+    app.include_router(router)
+    
+    # Add CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor"],
+    )
+    # Request, pipeline stage and database timings, served on /metrics
+    app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    # Several workers need the app as an import string
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=BACKEND_WORKERS)
@@ -0,0 +1,317 @@
+"""
+Request and pipeline metrics in the Prometheus text format.
+
+Histograms are kept per process and served on /metrics:
+
+- request duration per method, route and status, and request size;
+- duration of the comparison stages (parse, extract, filter, diff, group,
+  serialize) per route, by request size and line count classes;
+- time spent on database queries per route.
+
+Stages mostly run in worker processes. The executor collects their timings
+there and replays them here along with the job result, so they are
+attributed to the request that submitted the job.
+
+When the backend runs several processes (uvicorn --workers), set METRICS_DIR
+to a directory they share: every process then writes its histograms there,
+every METRICS_FLUSH_INTERVAL seconds, and /metrics serves the sum
+over all of them instead of the numbers of whichever process answered.
+
+Setting SLOW_REQUEST_SECONDS logs every request that takes longer, with its
+stage breakdown, pattern set and input sizes (never the inputs themselves).
+"""
+
+import asyncio
+import bisect
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.routing import Match
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))  # 0 disables slow-request logging
+METRICS_DIR = os.getenv("METRICS_DIR")  # shared by the backend processes, unset for a single process
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1 << 10, 1 << 13, 1 << 16, 1 << 19, 1 << 22, 1 << 25, 1 << 28, 1 << 31)
+
+# Upper bounds and names of the request size and line count label classes
+SIZE_CLASSES = ((1 << 16, "64KB"), (1 << 20, "1MB"), (1 << 24, "16MB"), (1 << 28, "256MB"))
+LINE_CLASSES = ((1000, "1k"), (10000, "10k"), (100000, "100k"), (1000000, "1M"), (10000000, "10M"))
+
+# Query parameters logged with slow requests
+PATTERN_PARAMS = ("regex_pattern", "filter_pattern", "group_by", "key_pattern")
+
+logger = logging.getLogger("filecomparehub.slow_requests")
+
+
+def _label_class(value: Optional[int], classes: Sequence[Tuple[int, str]]) -> str:
+    if value is None:
+        return "unknown"
+    for bound, name in classes:
+        if value <= bound:
+            return name
+    return "more"
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label values: bucket counts (the last one is +Inf), sum
+        self._series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def snapshot(self) -> Dict[tuple, list]:
+        with self._lock:
+            return {labels: [list(counts), total] for labels, (counts, total) in self._series.items()}
+
+    def render(self, series: Optional[Dict[tuple, list]] = None) -> Iterator[str]:
+        """Render the given series, by default the ones of this process"""
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        if series is None:
+            series = self.snapshot()
+        for labels, (counts, total) in sorted(series.items()):
+            base = ''.join(f'{name}="{_escape(value)}",' for name, value in zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(float(bound))
+                yield f'{self.name}_bucket{{{base}le="{le}"}} {cumulative}'
+            yield f"{self.name}_sum{{{base.rstrip(',')}}} {total}"
+            yield f"{self.name}_count{{{base.rstrip(',')}}} {cumulative}"
+
+
+REQUEST_SECONDS = Histogram("filecomparehub_request_duration_seconds", "Time to serve a request, including streaming",
+                            ("method", "endpoint", "status"), TIME_BUCKETS)
+REQUEST_SIZE = Histogram("filecomparehub_request_size_bytes", "Request body plus query string size",
+                         ("method", "endpoint"), SIZE_BUCKETS)
+STAGE_SECONDS = Histogram("filecomparehub_stage_duration_seconds", "Time spent in one stage of the comparison pipeline",
+                          ("stage", "endpoint", "size", "lines"), TIME_BUCKETS)
+DB_SECONDS = Histogram("filecomparehub_db_query_duration_seconds", "Time spent waiting for database queries",
+                       ("endpoint",), TIME_BUCKETS)
+
+HISTOGRAMS = (REQUEST_SECONDS, REQUEST_SIZE, STAGE_SECONDS, DB_SECONDS)
+
+
+def render() -> str:
+    if METRICS_DIR:
+        flush()
+        merged = _load_all(METRICS_DIR)
+        lines = (line for histogram in HISTOGRAMS for line in histogram.render(merged.get(histogram.name, {})))
+    else:
+        lines = (line for histogram in HISTOGRAMS for line in histogram.render())
+    return '\n'.join(lines) + '\n'
+
+
+def flush(directory: Optional[str] = None):
+    """Write the histograms of this process to the shared metrics directory"""
+    directory = directory or METRICS_DIR
+    data = {histogram.name: [[list(labels), counts, total] for labels, (counts, total) in histogram.snapshot().items()]
+            for histogram in HISTOGRAMS}
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, os.path.join(directory, f"metrics-{os.getpid()}.json"))
+
+
+async def flush_periodically():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+def _load_all(directory: str) -> Dict[str, Dict[tuple, list]]:
+    """Histogram series summed over the files of every process"""
+    merged: Dict[str, Dict[tuple, list]] = {}
+    for entry in os.scandir(directory):
+        if not (entry.name.startswith("metrics-") and entry.name.endswith(".json")):
+            continue
+        try:
+            with open(entry.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        for name, rows in data.items():
+            series = merged.setdefault(name, {})
+            for labels, counts, total in rows:
+                current = series.setdefault(tuple(labels), [[0] * len(counts), 0.0])
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+    return merged
+
+
+class RequestContext:
+    """What the metrics of one request are labelled with, and its stage breakdown"""
+
+    def __init__(self, scope: dict, size: int):
+        self.scope = scope
+        self._endpoint: Optional[str] = None
+        self.size = size
+        self.size_class = _label_class(size, SIZE_CLASSES)
+        self.stages: List[Tuple[str, float, Optional[int]]] = []
+        self.db_seconds = 0.0
+
+    @property
+    def endpoint(self) -> str:
+        # Resolved on first use, which is after routing
+        if self._endpoint is None:
+            self._endpoint = _route_template(self.scope)
+        return self._endpoint
+
+
+_request: "contextvars.ContextVar[Optional[RequestContext]]" = contextvars.ContextVar("metrics_request", default=None)
+# Stage timings of the job running in this worker process, shipped back by the executor
+_collected: Optional[list] = None
+
+
+def observe_stage(stage: str, seconds: float, lines: Optional[int] = None):
+    if _collected is not None:
+        _collected.append((stage, seconds, lines))
+        return
+    context = _request.get()
+    if context is None:
+        STAGE_SECONDS.observe(seconds, stage, "none", "unknown", _label_class(lines, LINE_CLASSES))
+        return
+    STAGE_SECONDS.observe(seconds, stage, context.endpoint, context.size_class, _label_class(lines, LINE_CLASSES))
+    context.stages.append((stage, seconds, lines))
+
+
+class StageTimer:
+    __slots__ = ("lines",)
+
+    def __init__(self, lines: Optional[int] = None):
+        self.lines = lines
+
+
+@contextmanager
+def stage(name: str, lines: Optional[int] = None) -> Iterator[StageTimer]:
+    """Time the enclosed block as one pipeline stage; set .lines on the timer once known"""
+    timer = StageTimer(lines)
+    start = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        observe_stage(name, time.perf_counter() - start, timer.lines)
+
+
+@contextmanager
+def collecting_stages() -> Iterator[list]:
+    """Collect stage timings instead of recording them, for jobs running in a worker"""
+    global _collected
+    previous, _collected = _collected, []
+    try:
+        yield _collected
+    finally:
+        _collected = previous
+
+
+def replay_stages(samples: List[tuple]):
+    for sample in samples:
+        observe_stage(*sample)
+
+
+def observe_db(seconds: float):
+    context = _request.get()
+    DB_SECONDS.observe(seconds, context.endpoint if context else "none")
+    if context is not None:
+        context.db_seconds += seconds
+
+
+def _route_template(scope) -> str:
+    """The path template of the matching route, to keep the endpoint label bounded"""
+    route = scope.get("route")
+    if getattr(route, "path", None):
+        return route.path
+    # Frameworks that do not record the route in the scope
+    router = getattr(scope.get("app"), "router", None)
+    for route in getattr(router, "routes", ()):
+        path = getattr(route, "path", None)
+        if path is not None and route.matches(scope)[0] == Match.FULL:
+            return path
+    return "unmatched"
+
+
+def _request_size(scope) -> int:
+    size = len(scope.get("query_string", b""))
+    for name, value in scope.get("headers", ()):
+        if name == b"content-length" and value.isdigit():
+            size += int(value)
+    return size
+
+
+def _log_slow_request(scope, status: int, seconds: float, context: RequestContext):
+    params = parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+    logger.warning("slow request %s", json.dumps({
+        "method": scope["method"],
+        "endpoint": context.endpoint,
+        "status": status,
+        "seconds": round(seconds, 4),
+        "request_bytes": context.size,
+        "patterns": {name: value for name, value in params if name in PATTERN_PARAMS},
+        "inline_chars": {name: len(value) for name, value in params
+                         if name.endswith("_content") and name != "include_content"},
+        "blobs": {name: value for name, value in params if name.endswith("_blob")},
+        "db_seconds": round(context.db_seconds, 4),
+        "stages": [{"stage": name, "seconds": round(elapsed, 4), "lines": lines}
+                   for name, elapsed, lines in context.stages],
+    }))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request until its last byte is sent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = RequestContext(scope, _request_size(scope))
+        token = _request.set(context)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            _request.reset(token)
+            REQUEST_SECONDS.observe(seconds, scope["method"], context.endpoint, str(status))
+            REQUEST_SIZE.observe(context.size, scope["method"], context.endpoint)
+            if SLOW_REQUEST_SECONDS and seconds >= SLOW_REQUEST_SECONDS:
+                _log_slow_request(scope, status, seconds, context)
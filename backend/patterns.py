@@ -0,0 +1,82 @@
+"""
+Compiled regex registry.
+
+Patterns coming from requests and saved templates are compiled once and kept
+in a bounded, thread-safe LRU. This replaces the small internal cache of the
+re module, which thrashes as soon as more patterns are in use than it can
+hold, and lets handlers validate every pattern before any work is queued.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import HTTPException
+
+PATTERN_CACHE_SIZE = int(os.getenv("PATTERN_CACHE_SIZE", "1024"))
+
+
+class PatternRegistry:
+    def __init__(self, max_size: int = PATTERN_CACHE_SIZE):
+        self.max_size = max_size
+        self._patterns: "OrderedDict[tuple, re.Pattern]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compile(self, pattern: str, flags: int = 0, name: str = "regex") -> re.Pattern:
+        """Return the compiled pattern, raising a 400 error if it is invalid"""
+        key = (pattern, flags)
+        with self._lock:
+            compiled = self._patterns.get(key)
+            if compiled is not None:
+                self._patterns.move_to_end(key)
+                return compiled
+
+        try:
+            compiled = re.compile(pattern, flags)
+        except re.error as e:
+            label = "regex pattern" if name == "regex" else f"{name} pattern"
+            raise HTTPException(status_code=400, detail=f"Invalid {label}: {str(e)}")
+
+        with self._lock:
+            self._patterns[key] = compiled
+            if len(self._patterns) > self.max_size:
+                self._patterns.popitem(last=False)
+        return compiled
+
+    def __len__(self):
+        return len(self._patterns)
+
+
+registry = PatternRegistry()
+
+
+def compile_pattern(pattern: Optional[str], name: str = "regex") -> Optional[re.Pattern]:
+    if not pattern:
+        return None
+    return registry.compile(pattern, name=name)
+
+
+def as_bytes(compiled: re.Pattern, name: str = "regex") -> Optional[re.Pattern]:
+    """Bytes version of a str pattern, or None if it cannot be expressed on bytes
+
+    Only valid for ASCII input: on bytes, classes such as \\w and \\s do not
+    cover non-ASCII characters.
+    """
+    if not compiled.pattern.isascii():
+        return None
+    try:
+        return registry.compile(compiled.pattern.encode('ascii'), compiled.flags & ~re.UNICODE, name)
+    except HTTPException:
+        return None
+
+
+def compile_patterns(regex_pattern: Optional[str] = None, filter_pattern: Optional[str] = None,
+                     group_by: Optional[str] = None) -> tuple:
+    """Validate and compile the pattern set of a comparison in one go"""
+    return (
+        compile_pattern(regex_pattern),
+        compile_pattern(filter_pattern, "filter"),
+        compile_pattern(group_by, "group_by"),
+    )
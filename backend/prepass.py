@@ -0,0 +1,149 @@
+"""
+Vectorized equality pre-pass for the diff engine.
+
+Most comparisons share almost all of their lines. Before any line goes
+through the Python-level diff engine, the line hashes of both sides are
+compared with NumPy:
+
+1. the common prefix and suffix are stripped;
+2. lines occurring exactly once on both sides are paired up (np.unique),
+   and consecutive pairs on the same diagonal whose in-between lines are
+   equal too form identical blocks;
+3. the longest ascending chain of those blocks (patience sorting over the
+   blocks, not over lines) is kept.
+
+Only the windows between the identical blocks are handed to the
+fine-grained diff engine, so near-identical files are matched at close to
+memory speed while divergent regions still get a full patience diff.
+"""
+
+from bisect import bisect_left
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+import diff_engine
+from diff_engine import Block
+
+
+def _common_prefix(a: np.ndarray, b: np.ndarray) -> int:
+    n = min(len(a), len(b))
+    differ = np.flatnonzero(a[:n] != b[:n])
+    return int(differ[0]) if len(differ) else n
+
+
+def _unique_pairs(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions (ascending in a) of the values occurring exactly once on both sides"""
+    values_a, index_a, counts_a = np.unique(a, return_index=True, return_counts=True)
+    values_b, index_b, counts_b = np.unique(b, return_index=True, return_counts=True)
+    once_a, once_b = counts_a == 1, counts_b == 1
+    _, in_a, in_b = np.intersect1d(values_a[once_a], values_b[once_b], assume_unique=True, return_indices=True)
+    pairs_a, pairs_b = index_a[once_a][in_a], index_b[once_b][in_b]
+    order = np.argsort(pairs_a, kind='stable')
+    return pairs_a[order], pairs_b[order]
+
+
+def _diagonal_blocks(a: np.ndarray, b: np.ndarray) -> List[Block]:
+    """Runs of equal lines spanned by unique pairs on a shared diagonal, ascending in a"""
+    pairs_a, pairs_b = _unique_pairs(a, b)
+    if not len(pairs_a):
+        return []
+    diagonals = pairs_b - pairs_a
+    # A new candidate run starts wherever the diagonal changes
+    breaks = np.flatnonzero(np.diff(diagonals)) + 1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks, [len(pairs_a)])) - 1
+
+    blocks = []
+    for first, last in zip(firsts.tolist(), lasts.tolist()):
+        i0, i1 = int(pairs_a[first]), int(pairs_a[last]) + 1
+        j0 = int(pairs_b[first])
+        equal = a[i0:i1] == b[j0:j0 + i1 - i0]
+        if equal.all():
+            blocks.append((i0, j0, i1 - i0))
+            continue
+        # Split the run around the lines that differ
+        edges = np.diff(np.concatenate(([False], equal, [False])).astype(np.int8))
+        for start, stop in zip(np.flatnonzero(edges == 1).tolist(), np.flatnonzero(edges == -1).tolist()):
+            blocks.append((i0 + start, j0 + start, stop - start))
+    return blocks
+
+
+def _ascending_chain(blocks: List[Block]) -> List[Block]:
+    """Longest chain of blocks ascending on both sides, trimmed so they do not overlap"""
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    prev = [-1] * len(blocks)
+    for k, (_, j, _) in enumerate(blocks):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+        prev[k] = tail_idx[pos - 1] if pos > 0 else -1
+
+    chain = []
+    k = tail_idx[-1] if tail_idx else -1
+    while k != -1:
+        chain.append(blocks[k])
+        k = prev[k]
+    chain.reverse()
+
+    trimmed = []
+    end_b = 0
+    for i, j, n in chain:
+        skip = max(0, end_b - j)
+        if n > skip:
+            trimmed.append((i + skip, j + skip, n - skip))
+            end_b = j + n
+    return trimmed
+
+
+def identical_blocks(a: np.ndarray, b: np.ndarray) -> List[Block]:
+    """Blocks of equal lines found without the Python-level diff, ascending and disjoint"""
+    prefix = _common_prefix(a, b)
+    suffix = _common_prefix(a[prefix:][::-1], b[prefix:][::-1])
+    ahi, bhi = len(a) - suffix, len(b) - suffix
+
+    blocks = [(0, 0, prefix)] if prefix else []
+    blocks.extend((i + prefix, j + prefix, n) for i, j, n in
+                  _ascending_chain(_diagonal_blocks(a[prefix:ahi], b[prefix:bhi])))
+    if suffix:
+        blocks.append((ahi, bhi, suffix))
+    return blocks
+
+
+def _merge(blocks: Iterator[Block]) -> Iterator[Block]:
+    pending = None
+    for block in blocks:
+        if pending is not None and pending[0] + pending[2] == block[0] and pending[1] + pending[2] == block[1]:
+            pending = (pending[0], pending[1], pending[2] + block[2])
+            continue
+        if pending is not None:
+            yield pending
+        pending = block
+    if pending is not None:
+        yield pending
+
+
+def _iter_blocks(a: np.ndarray, b: np.ndarray) -> Iterator[Block]:
+    i = j = 0
+    for block in identical_blocks(a, b) + [(len(a), len(b), 0)]:
+        ai, bj, _ = block
+        if i < ai and j < bj:
+            # Only the divergent window goes through the fine-grained engine
+            window = diff_engine.iter_matching_blocks(a[i:ai].tolist(), b[j:bj].tolist())
+            for wi, wj, n in window:
+                if n:
+                    yield (i + wi, j + wj, n)
+        if block[2]:
+            yield block
+        i, j = ai + block[2], bj + block[2]
+
+
+def iter_matching_blocks(a: np.ndarray, b: np.ndarray) -> Iterator[Block]:
+    """Matching blocks of two hash arrays, sentinel included, like diff_engine.iter_matching_blocks"""
+    yield from _merge(_iter_blocks(a, b))
+    yield (len(a), len(b), 0)
@@ -0,0 +1,107 @@
+"""
+Streaming readers for uploaded files.
+
+Excel workbooks are read with openpyxl in read-only mode, one row at a time,
+and rendered as normalized tab-delimited lines. Unlike DataFrame.to_string()
+the output does not depend on column widths, so changing a single cell only
+changes a single line, and memory use does not grow with the number of rows.
+
+openpyxl and pandas are imported on first use, so processes that never read
+a workbook do not pay for them.
+"""
+
+import codecs
+import datetime
+import io
+from typing import Iterator, Optional, Sequence, Tuple
+
+ZIP_MAGIC = b'PK\x03\x04'
+
+# Characters decoded per step when streaming text files
+TEXT_CHUNK = 1 << 20
+
+
+def is_xlsx(file_path: str) -> bool:
+    """Tell OOXML workbooks (zip archives) apart from legacy .xls files"""
+    with open(file_path, 'rb') as f:
+        return f.read(4) == ZIP_MAGIC
+
+
+def normalize_cell(value) -> str:
+    """Render a cell value independently of its formatting"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return ' '.join(str(value).split())
+
+
+def _normalize_row(row) -> list:
+    cells = [normalize_cell(value) for value in row]
+    while cells and not cells[-1]:
+        cells.pop()
+    return cells
+
+
+def _iter_xls_rows(file_path: str, sheet_names: Optional[Sequence[str]]) -> Iterator[Tuple[str, list]]:
+    """Fallback for legacy .xls workbooks, which openpyxl cannot read"""
+    import pandas as pd
+
+    sheets = pd.read_excel(file_path, sheet_name=list(sheet_names) if sheet_names else None, header=None)
+    for title, df in sheets.items():
+        for row in df.itertuples(index=False, name=None):
+            cells = _normalize_row(None if value != value else value for value in row)
+            if cells:
+                yield str(title), cells
+
+
+def iter_excel_rows(file_path: str, sheet_names: Optional[Sequence[str]] = None) -> Iterator[Tuple[str, list]]:
+    """Yield (sheet name, normalized cells) for every non-empty row of a workbook"""
+    if not is_xlsx(file_path):
+        yield from _iter_xls_rows(file_path, sheet_names)
+        return
+
+    import openpyxl
+
+    # Passing a file object lets openpyxl read blobs stored without an extension
+    with open(file_path, 'rb') as f:
+        workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                if sheet_names and worksheet.title not in sheet_names:
+                    continue
+                for row in worksheet.iter_rows(values_only=True):
+                    cells = _normalize_row(row)
+                    if cells:
+                        yield worksheet.title, cells
+        finally:
+            workbook.close()
+
+
+def iter_text_chunks(file_path: str, encoding: str = 'utf-8') -> Iterator[str]:
+    """Decode a text file chunk by chunk, translating newlines like open(...).read()"""
+    with open(file_path, 'r', encoding=encoding) as f:
+        while True:
+            chunk = f.read(TEXT_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def text_decoder(encoding: str = 'utf-8') -> io.IncrementalNewlineDecoder:
+    """Incremental decoder producing the same text as iter_text_chunks, for data pushed in pieces"""
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+
+
+def iter_excel_lines(file_path: str, sheet_names: Optional[Sequence[str]] = None) -> Iterator[str]:
+    """Yield a "[sheet]" header per sheet followed by its rows as tab-delimited lines"""
+    current = None
+    for sheet, cells in iter_excel_rows(file_path, sheet_names):
+        if sheet != current:
+            current = sheet
+            yield f"[{sheet}]"
+        yield '\t'.join(cells)
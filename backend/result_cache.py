@@ -0,0 +1,166 @@
+"""
+Memoized comparison results.
+
+Results are keyed by the digests of both inputs, the pattern set and the diff
+engine version, and stored as serialized JSON. The first tier is an
+in-process LRU bounded by entry count and total size; the optional second
+tier lives on disk (RESULT_CACHE_DIR) and is trimmed to RESULT_CACHE_DISK_BYTES
+by evicting the least recently used files. Disk reads, writes and eviction
+sweeps run on a thread, so a large cached result never blocks the event loop.
+"""
+
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+
+from blob_store import BlobRef
+from diff_engine import ENGINE_VERSION
+
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "256"))
+RESULT_CACHE_BYTES = int(os.getenv("RESULT_CACHE_BYTES", str(256 * 1024 * 1024)))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_BYTES = int(os.getenv("RESULT_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+
+def _input_digest(value: Union[str, BlobRef]) -> str:
+    if isinstance(value, BlobRef):
+        return "blob:" + value.blob_id
+    return "text:" + hashlib.sha256(value.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def make_key(text1: Union[str, BlobRef], text2: Union[str, BlobRef], *options) -> str:
+    """Build the cache key of a comparison from its inputs and options"""
+    digest = hashlib.sha256()
+    for part in (ENGINE_VERSION, _input_digest(text1), _input_digest(text2), *options):
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = RESULT_CACHE_ENTRIES, max_bytes: int = RESULT_CACHE_BYTES,
+                 directory: Optional[str] = RESULT_CACHE_DIR, max_disk_bytes: int = RESULT_CACHE_DISK_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._disk_size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    async def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = await asyncio.to_thread(self._disk_get, key) if self.directory else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_put(key, value)
+        return value
+
+    async def put(self, key: str, value: bytes):
+        with self._lock:
+            self._memory_put(key, value)
+        if self.directory:
+            await asyncio.to_thread(self._disk_put, key, value)
+
+    def _memory_put(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = value
+        self._size += len(value)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            # Refresh the modification time so that eviction is LRU
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+
+    def _disk_put(self, key: str, value: bytes):
+        if not self.directory or len(value) > self.max_disk_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(os.path.getsize(entry.path) for entry in self._disk_entries())
+            else:
+                self._disk_size += len(value)
+            if self._disk_size > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+
+    def _evict_disk(self):
+        entries = []
+        for entry in self._disk_entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_size = total
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "disk_bytes": self._disk_size
+            }
+
+
+result_cache = ResultCache()
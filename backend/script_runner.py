@@ -0,0 +1,190 @@
+"""
+Execution of registered comparison scripts.
+
+Scripts run in a dedicated pool of warm worker processes. Each worker
+imports the heavy libraries (pandas, openpyxl) once at startup and keeps the
+compiled code of recently used scripts keyed by the SHA-256 of their
+content, so a run only pays for executing the script itself.
+
+A script must define an entry point
+
+    def compare(file1, file2, **params):
+        ...
+        return {...}  # anything JSON-serializable
+
+``file1``/``file2`` are paths to the stored uploads, read in place rather
+than copied into the worker. The return value is serialized inside the
+worker and returned together with whatever the script printed.
+
+Workers are spawned rather than forked, so they start from a fresh
+interpreter and share no memory, database connections or sockets with the
+API process, and their environment is cut down to SCRIPT_ENV_ALLOWLIST, so
+secrets such as SECRET_KEY never reach a script. They run with an
+address-space limit, a CPU time limit per run and the executor's wall-clock
+deadline, and every run gets a fresh namespace and a scratch working
+directory. Scripts still see the files of the backend user, so registering
+or changing them is reserved for admins (see main.py).
+"""
+
+import builtins
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import tempfile
+import threading
+import traceback
+from collections import OrderedDict
+from types import CodeType
+from typing import Optional
+
+from fastapi import HTTPException
+
+from executor import ComparisonExecutor
+
+SCRIPT_WORKERS = int(os.getenv("SCRIPT_WORKERS", "2"))
+SCRIPT_QUEUE_SIZE = int(os.getenv("SCRIPT_QUEUE_SIZE", "8"))
+SCRIPT_TIMEOUT = float(os.getenv("SCRIPT_TIMEOUT", "60"))
+SCRIPT_CPU_SECONDS = int(os.getenv("SCRIPT_CPU_SECONDS", "30"))
+SCRIPT_MEMORY_MB = int(os.getenv("SCRIPT_MEMORY_MB", "2048"))  # 0 disables the limit
+SCRIPT_CACHE_SIZE = int(os.getenv("SCRIPT_CACHE_SIZE", "64"))
+SCRIPT_OUTPUT_LIMIT = int(os.getenv("SCRIPT_OUTPUT_LIMIT", "65536"))  # characters
+# The only environment variables scripts get to see
+SCRIPT_ENV_ALLOWLIST = ("PATH", "LANG", "LC_ALL", "TZ", "TMPDIR")
+
+ENTRY_POINT = "compare"
+
+# Compiled scripts of the current worker, keyed by content hash
+_compiled: "OrderedDict[str, CodeType]" = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+class CpuLimitExceeded(BaseException):
+    """Raised inside a worker when a run uses up its CPU time; not an Exception, like JobTimeout"""
+
+
+def _on_cpu_limit(signum, frame):
+    raise CpuLimitExceeded()
+
+
+def script_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _scrub_environment():
+    """Drop every environment variable not on the allowlist, secrets included"""
+    kept = {name: os.environ[name] for name in SCRIPT_ENV_ALLOWLIST if name in os.environ}
+    os.environ.clear()
+    os.environ.update(kept)
+
+
+def _init_worker():
+    """Scrub the environment, apply the memory limit and preload the libraries scripts commonly use"""
+    _scrub_environment()
+    if SCRIPT_MEMORY_MB > 0:
+        limit = SCRIPT_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    for module in ("pandas", "openpyxl"):
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+
+def _compile(content: str, digest: str) -> CodeType:
+    with _compiled_lock:
+        code = _compiled.get(digest)
+        if code is not None:
+            _compiled.move_to_end(digest)
+            return code
+    try:
+        code = compile(content, f"<script {digest[:12]}>", "exec")
+    except SyntaxError as e:
+        raise HTTPException(status_code=400, detail=f"Script has a syntax error: {e}")
+    with _compiled_lock:
+        _compiled[digest] = code
+        while len(_compiled) > SCRIPT_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return code
+
+
+@contextlib.contextmanager
+def _cpu_limit(seconds: int):
+    """Limit the CPU time of the enclosed block via the soft RLIMIT_CPU"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(usage.ru_utime + usage.ru_stime) + seconds + 1
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _truncate(output: str) -> str:
+    if len(output) <= SCRIPT_OUTPUT_LIMIT:
+        return output
+    return output[:SCRIPT_OUTPUT_LIMIT] + "\n... output truncated"
+
+
+def run_script(content: str, digest: str, file1: str, file2: str, params: Optional[dict] = None) -> bytes:
+    """Run a script's entry point on two files and return the JSON-encoded result"""
+    code = _compile(content, digest)
+    namespace = {"__name__": "__script__", "__builtins__": builtins}
+    stdout = io.StringIO()
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory(prefix="script-") as scratch:
+        os.chdir(scratch)
+        try:
+            with _cpu_limit(SCRIPT_CPU_SECONDS), contextlib.redirect_stdout(stdout):
+                exec(code, namespace)
+                entry = namespace.get(ENTRY_POINT)
+                if not callable(entry):
+                    raise HTTPException(status_code=400, detail=f"Script does not define {ENTRY_POINT}(file1, file2)")
+                result = entry(file1, file2, **(params or {}))
+        except HTTPException:
+            raise
+        except CpuLimitExceeded:
+            raise HTTPException(status_code=504, detail="Script exceeded its CPU time limit")
+        except MemoryError:
+            raise HTTPException(status_code=422, detail="Script exceeded its memory limit")
+        except Exception as e:
+            raise HTTPException(status_code=422, detail={
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": traceback.format_exc(limit=-5),
+                "output": _truncate(stdout.getvalue()),
+            })
+        finally:
+            os.chdir(cwd)
+
+    try:
+        return json.dumps({"result": result, "output": _truncate(stdout.getvalue())}, default=str).encode('utf-8')
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Script result is not JSON-serializable: {e}")
+
+
+class ScriptRunner:
+    def __init__(self, max_workers: int = SCRIPT_WORKERS, max_queue: int = SCRIPT_QUEUE_SIZE,
+                 timeout: float = SCRIPT_TIMEOUT):
+        self.executor = ComparisonExecutor(max_workers, max_queue, timeout, initializer=_init_worker,
+                                           mp_context=multiprocessing.get_context("spawn"))
+
+    async def run(self, content: str, file1: str, file2: str, params: Optional[dict] = None) -> bytes:
+        return await self.executor.run(run_script, content, script_hash(content), file1, file2, params)
+
+    def warm(self):
+        self.executor.warm()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+script_runner = ScriptRunner()
@@ -0,0 +1,103 @@
+"""
+Compiled comparison templates.
+
+A saved comparison template (a row of the comparisons table) holds the
+pattern set of a comparison in its JSON config. Running a template parses
+that config and validates its patterns once; the resulting Pipeline is kept
+in a bounded LRU keyed by template id and version, so repeated runs go
+straight to the comparison. The comparison runs in a worker process, which
+compiles the patterns into its own pattern registry and keeps them there
+for later runs. Every change of a template's config bumps its version,
+which retires the cached pipeline in every backend process without any
+coordination between them.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+from patterns import compile_patterns
+
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "1024"))
+
+PATTERN_FIELDS = ("regex_pattern", "filter_pattern", "group_by")
+
+
+class Pipeline(NamedTuple):
+    regex_pattern: Optional[str]
+    filter_pattern: Optional[str]
+    group_by: Optional[str]
+    include_default_group: bool
+
+    @property
+    def options(self) -> tuple:
+        """The positional options of compare_texts, in order"""
+        return tuple(self)
+
+
+def compile_template(config: Optional[str]) -> Pipeline:
+    """Parse a template config and compile its patterns, raising a 400 error if it is unusable"""
+    try:
+        values = json.loads(config) if config else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Comparison template config is not valid JSON")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Comparison template config must be a JSON object")
+
+    patterns = []
+    for field in PATTERN_FIELDS:
+        value = values.get(field) or None
+        if value is not None and not isinstance(value, str):
+            raise HTTPException(status_code=400, detail=f"Comparison template {field} must be a string")
+        patterns.append(value)
+    # Validated here, so that a broken template fails before any work is queued;
+    # the workers running the comparison compile the patterns in their own registry
+    compile_patterns(*patterns)
+    return Pipeline(*patterns, bool(values.get("include_default_group", True)))
+
+
+class TemplateCache:
+    def __init__(self, max_entries: int = TEMPLATE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._pipelines: "OrderedDict[Tuple[int, int], Pipeline]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, template_id: int, version: int) -> Optional[Pipeline]:
+        key = (template_id, version)
+        with self._lock:
+            pipeline = self._pipelines.get(key)
+            if pipeline is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._pipelines.move_to_end(key)
+            return pipeline
+
+    def put(self, template_id: int, version: int, pipeline: Pipeline):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            # Older versions of the template are never asked for again
+            for key in [key for key in self._pipelines if key[0] == template_id]:
+                del self._pipelines[key]
+            self._pipelines[(template_id, version)] = pipeline
+            while len(self._pipelines) > self.max_entries:
+                self._pipelines.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._pipelines), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._pipelines.clear()
+            self.hits = self.misses = 0
+
+
+template_cache = TemplateCache()
@@ -1,16 +1,26 @@
 import unittest
 import sys
 import os
+import hashlib
+import json
+import asyncio
+from unittest import mock
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
 # Add the parent directory to the path so we can import the main module
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import db
+import main
 from main import app
 
 class TestAPI(unittest.TestCase):
     def setUp(self):
+        # Entering the client runs the app's lifespan, which initializes the database
         self.client = TestClient(app)
+        self.client.__enter__()
+        self.addCleanup(self.client.__exit__, None, None, None)
     
     def test_root_endpoint(self):
         """Test the root endpoint"""
@@ -56,5 +66,96 @@ class TestAPI(unittest.TestCase):
         self.assertIn("content", response.json())
         self.assertEqual(response.json()["content"], test_content)
 
+    def test_run_comparison_template(self):
+        """Saved templates should run on blobs or uploads and pick up config changes"""
+        token = self.client.post("/auth/login?username=admin&password=admin").json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        config = '{"filter_pattern": "^#", "group_by": "^(\\\\w+)\\\\."}'
+        response = self.client.post("/comparisons", params={"name": "run", "config": config}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        comparison_id = response.json()["id"]
+        
+        files = {"file1": ("a.txt", b"# old\nunit.a = 1\n", "text/plain"),
+                 "file2": ("b.txt", b"# new\nunit.a = 2\n", "text/plain")}
+        response = self.client.post(f"/comparisons/{comparison_id}/run", files=files, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result["groups"][0]["key"], "unit")
+        self.assertNotIn("-# old\n", result["diff"])
+        
+        blobs = [self.client.post("/upload?include_content=false", files={"file": file}, headers=headers)
+                 .json()["blob_id"] for file in files.values()]
+        response = self.client.post(f"/comparisons/{comparison_id}/run",
+                                    params={"file1_blob": blobs[0], "file2_blob": blobs[1]}, headers=headers)
+        self.assertEqual(response.json(), result)
+        
+        self.client.put(f"/comparisons/{comparison_id}", params={"config": "{}"}, headers=headers)
+        self.assertEqual(self.client.get(f"/comparisons/{comparison_id}", headers=headers).json()["version"], 2)
+        response = self.client.post(f"/comparisons/{comparison_id}/run",
+                                    params={"file1_blob": blobs[0], "file2_blob": blobs[1]}, headers=headers)
+        self.assertNotIn("groups", response.json())
+        self.assertIn("-# old\n", response.json()["diff"])
+        
+        response = self.client.post("/comparisons/999999/run",
+                                    params={"file1_blob": blobs[0], "file2_blob": blobs[1]}, headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_scripts_are_reserved_for_admins(self):
+        """Only admins should register scripts, and only owners or admins should run them"""
+        password_hash = hashlib.sha256(b"secret").hexdigest()
+        with db.connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (username, password_hash) VALUES ('plain', ?)", (password_hash,))
+        user = {"Authorization": "Bearer " + self.client.post("/auth/login?username=plain&password=secret").json()["access_token"]}
+        admin = {"Authorization": "Bearer " + self.client.post("/auth/login?username=admin&password=admin").json()["access_token"]}
+        content = "def compare(file1, file2):\n    return 1"
+        
+        response = self.client.post("/scripts", params={"name": "user script", "content": content}, headers=user)
+        self.assertEqual(response.status_code, 403)
+        
+        response = self.client.post("/scripts", params={"name": f"admin script {os.getpid()}", "content": content}, headers=admin)
+        self.assertEqual(response.status_code, 200)
+        blob_id = self.client.post("/upload?include_content=false", files={"file": ("a.txt", b"a", "text/plain")},
+                                   headers=admin).json()["blob_id"]
+        response = self.client.post(f"/scripts/{response.json()['id']}/run",
+                                    params={"file1_blob": blob_id, "file2_blob": blob_id}, headers=user)
+        self.assertEqual(response.status_code, 404)
+
+    def test_streamed_comparison(self):
+        """Streamed comparisons should be NDJSON that proxies pass on unbuffered"""
+        token = self.client.post("/auth/login?username=admin&password=admin").json()["access_token"]
+        response = self.client.post("/compare", params={"file1_content": "a\nb\n", "file2_content": "a\nc\n",
+                                                        "stream": True},
+                                    headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["x-accel-buffering"], "no")
+        records = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(records[-1]["type"], "stats")
+
+    def test_jobs_wait_for_pool_capacity(self):
+        """Background jobs should wait for the pool to have room instead of failing"""
+        with mock.patch.object(main.executor, "wait_for_capacity", mock.AsyncMock()) as wait, \
+                mock.patch.object(main.executor, "run", mock.AsyncMock()) as run, \
+                mock.patch.object(main.db, "run", mock.AsyncMock()) as db_run:
+            asyncio.run(main._run_job("job", "a", "b"))
+        wait.assert_awaited_once()
+        self.assertIs(run.call_args.args[0], main.run_comparison_job)
+        db_run.assert_not_called()
+
+    def test_batch_target_errors_keep_the_matrix(self):
+        """A target failing with any error should get an error record, followed by the matrix"""
+        async def compare(fn, reference, target, *args):
+            if target.blob_id == "bad":
+                raise ValueError("worker failed")
+            return {"only_in_a": {}, "only_in_b": {"k": "v"}, "different_values": {}}
+
+        async def collect():
+            return [json.loads(record) async for record in main._batch_records({}, ["good", "bad"], None, None, None)]
+
+        with mock.patch.object(main, "_run_when_free", side_effect=compare):
+            records = asyncio.run(collect())
+        errors = {record["target"]: record.get("error") for record in records[:-1]}
+        self.assertEqual(errors, {"good": None, "bad": "worker failed"})
+        self.assertEqual(records[-1], {"type": "matrix", "targets": ["good", "bad"], "failed": 1, "drift": {"k": [0]}})
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+
+# Add the parent directory to the path so we can import the benchmark module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import benchmark
+from benchmark import drift, generate_mif, generate_txt, main, regressions, run
+
+class TestBenchmark(unittest.TestCase):
+    def test_generators(self):
+        """Generated inputs should be deterministic and of the requested size"""
+        self.assertEqual(len(generate_txt(500)), 500)
+        self.assertEqual(generate_txt(500, seed=1), generate_txt(500, seed=1))
+        mif = generate_mif(100)
+        self.assertEqual(len(mif), 100)
+        self.assertEqual(mif[-1], "END;")
+
+    def test_drift(self):
+        """Drift should touch about the requested share of lines"""
+        lines = generate_txt(10000)
+        self.assertEqual(drift(lines, 0), lines)
+        changed = set(drift(lines, 0.05)).symmetric_difference(lines)
+        self.assertGreater(len(changed), 250)
+        self.assertLess(len(changed), 1000)
+
+    def test_regressions(self):
+        """Only cases slower than the threshold allows should be reported"""
+        baseline = {"a": {"lines_per_second": 1000}, "b": {"lines_per_second": 1000}}
+        results = {"a": {"lines_per_second": 850}, "b": {"lines_per_second": 700}, "new": {"lines_per_second": 1}}
+        self.assertEqual(regressions(results, baseline, threshold=0.2), [("b", 0.7)])
+
+    def test_run_selected_cases(self):
+        """A run should measure the selected cases only"""
+        report = run("quick", only="compare_texts/txt/1000/*", repeat=1)
+        self.assertEqual(list(report["results"]), ["compare_texts/txt/1000/drift=0.01"])
+        self.assertGreater(report["results"]["compare_texts/txt/1000/drift=0.01"]["lines_per_second"], 0)
+
+    def test_unselected_inputs_are_not_generated(self):
+        """Inputs should only be generated for the selected cases"""
+        with mock.patch.object(benchmark, "generate_mif", side_effect=AssertionError("generated")):
+            report = run("full", only="extract_with_regex/txt/1000", repeat=1)
+        self.assertEqual(list(report["results"]), ["extract_with_regex/txt/1000"])
+
+    def test_missing_baseline_is_skipped(self):
+        """Comparing against a baseline that was never saved should not fail the run"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            argv = ["--profile", "quick", "--only", "compare_texts/txt/1000/*", "--repeat", "1",
+                    "--compare", os.path.join(tmpdir, "baseline.json")]
+            self.assertEqual(main(argv), 0)
+
+if __name__ == '__main__':
+    unittest.main()
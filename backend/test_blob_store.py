@@ -0,0 +1,111 @@
+import unittest
+import sys
+import os
+import io
+import tempfile
+
+import openpyxl
+
+# Add the parent directory to the path so we can import the blob store
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+import blob_store
+from blob_store import BlobRef
+from comparison import compare_texts, extract_blob_text
+
+def put_bytes(content: bytes) -> str:
+    """Store raw bytes the way an upload does and return their blob id"""
+    writer = blob_store.BlobWriter()
+    writer.write(content)
+    return writer.commit()
+
+class TestBlobStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = blob_store.BLOB_DIR
+        blob_store.BLOB_DIR = self.tmpdir.name
+
+    def tearDown(self):
+        blob_store.BLOB_DIR = self.original_dir
+        self.tmpdir.cleanup()
+
+    def test_identical_uploads_are_deduplicated(self):
+        """Storing the same bytes twice should return the same blob id"""
+        first = put_bytes(b"line1\nline2")
+        second = put_bytes(b"line1\nline2")
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 64)
+
+    def test_extracted_text_is_cached(self):
+        """Text should be extracted once and then served from the cache"""
+        blob_id = put_bytes(b"line1\nline2")
+        self.assertIsNone(blob_store.get_text_path(blob_id))
+
+        self.assertEqual(extract_blob_text(blob_id), "line1\nline2")
+        self.assertIsNotNone(blob_store.get_text_path(blob_id))
+
+        os.remove(blob_store.raw_path(blob_id))
+        self.assertEqual(extract_blob_text(blob_id), "line1\nline2")
+
+    def test_compare_blob_references(self):
+        """compare_texts should accept blob references"""
+        blob1 = put_bytes(b"a\nb")
+        blob2 = put_bytes(b"a\nc")
+        extract_blob_text(blob1)
+        extract_blob_text(blob2)
+
+        result = compare_texts(BlobRef(blob1), BlobRef(blob2))
+        self.assertEqual(result, compare_texts("a\nb", "a\nc"))
+
+    def test_mapped_blobs_match_inline_text(self):
+        """Mapped blob inputs should compare like the same text passed inline"""
+        text1 = "id=1 name=a\r\nid=2 name=b\n# note\nid=3 name=c\n"
+        text2 = "id=1 name=a\nid=2 name=x\n# note\nid=4 name=c\n"
+        blob1 = put_bytes(text1.encode('utf-8'))
+        blob2 = put_bytes(text2.replace("name=x", "name=\u00e9").encode('utf-8'))
+        self.assertIsNone(extract_blob_text(blob1, return_text=False))
+        extract_blob_text(blob2)
+        self.assertEqual(bytes(blob_store.map_text(blob1)), text1.replace('\r\n', '\n').encode('utf-8'))
+
+        inline2 = blob_store.get_text(blob2)
+        for options in ({}, {"regex_pattern": r"id=(\d+) name=(\w+)"}, {"filter_pattern": "^#"},
+                        {"regex_pattern": r"id=\d+", "filter_pattern": "3"}):
+            self.assertEqual(compare_texts(BlobRef(blob1), BlobRef(blob2), **options),
+                             compare_texts(text1.replace('\r\n', '\n'), inline2, **options))
+
+    def test_text_is_cached_per_kind(self):
+        """The same bytes uploaded as different kinds of file should each get their own text"""
+        workbook = openpyxl.Workbook()
+        workbook.active.append(["key", "value"])
+        buffer = io.BytesIO()
+        workbook.save(buffer)
+        digest = put_bytes(buffer.getvalue())
+
+        binary = blob_store.blob_id_for(digest, '.bin')
+        self.assertEqual(extract_blob_text(binary), "Binary file content not displayed")
+        excel = blob_store.blob_id_for(digest, '.XLSX')
+        self.assertEqual(excel, digest + '.excel')
+        self.assertEqual(extract_blob_text(excel), "[Sheet]\nkey\tvalue")
+        with self.assertRaises(HTTPException) as ctx:
+            extract_blob_text(blob_store.blob_id_for(digest, '.txt'))
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.assertEqual(blob_store.raw_path(excel), blob_store.raw_path(digest))
+
+    def test_blob_lines_are_streamed(self):
+        """Blob text should be split into the lines that splitlines() gives"""
+        text = "a=1\r\nb=2\rc=3\n\nd=4\x0ce=5\n"
+        blob_id = put_bytes(text.encode('utf-8'))
+        blob_store.put_text(blob_id, text)
+        self.assertEqual(list(blob_store.iter_lines(BlobRef(blob_id))), text.splitlines())
+        self.assertEqual(list(blob_store.iter_lines(text)), text.splitlines())
+
+    def test_invalid_blob_id(self):
+        """Blob ids that are not SHA-256 digests should be rejected"""
+        with self.assertRaises(HTTPException) as ctx:
+            blob_store.get_text("../../etc/passwd")
+        self.assertEqual(ctx.exception.status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
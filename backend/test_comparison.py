@@ -6,6 +6,7 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from main import compare_texts, extract_with_regex
+from comparison import iter_comparison_records
 
 class TestComparison(unittest.TestCase):
     
@@ -63,6 +64,41 @@ class TestComparison(unittest.TestCase):
         
         with self.assertRaises(Exception):
             extract_with_regex(text, invalid_pattern)
+    
+    def test_streamed_records(self):
+        """Streamed records should add up to the buffered result"""
+        text1 = "a\nb\nc\n" + "x\n" * 20 + "d\ne"
+        text2 = "a\nB\nc\n" + "x\n" * 20 + "d\nE"
+        
+        result = compare_texts(text1, text2)
+        records = list(iter_comparison_records(text1, text2))
+        
+        self.assertEqual(records[0]['type'], 'header')
+        self.assertEqual(records[-1]['type'], 'stats')
+        diff = [line for record in records if record['type'] in ('header', 'hunk') for line in record['lines']]
+        self.assertEqual(diff, result['diff'])
+        self.assertEqual(sum(1 for record in records if record['type'] == 'hunk'), 2)
+        self.assertEqual(records[-1]['lines_added'], result['stats']['lines_added'])
+    
+    def test_grouping_without_regex(self):
+        """group_by should group the changed lines even without a regex pattern"""
+        text1 = "eth0 mtu 1500\neth1 mtu 1500\nlo mtu 65536\n"
+        text2 = "eth0 mtu 9000\neth1 mtu 1500\nlo mtu 1500\n"
+        
+        result = compare_texts(text1, text2, group_by=r'^(\w+)')
+        self.assertEqual(result['grouped_diff'], {
+            'eth0': ['-eth0 mtu 1500\n', '+eth0 mtu 9000\n'],
+            'lo': ['-lo mtu 65536\n', '+lo mtu 1500\n'],
+        })
+        self.assertEqual([(group['key'], group['count']) for group in result['groups']], [('eth0', 2), ('lo', 2)])
+        
+        records = list(iter_comparison_records(text1, text2, group_by=r'^(\w+)'))
+        self.assertEqual(records[-2], {'type': 'groups', 'groups': result['groups']})
+    
+    def test_without_default_group(self):
+        """The 'default' group should be optional when no grouping is used"""
+        result = compare_texts("a", "b", include_default_group=False)
+        self.assertEqual(result['grouped_diff'], {})
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
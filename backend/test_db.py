@@ -1,4 +1,9 @@
+import asyncio
+import os
 import sqlite3
+import tempfile
+
+import db
 
 def test_db_init():
     conn = sqlite3.connect("test.db")
@@ -17,5 +22,61 @@ def test_db_init():
     print("Database initialized successfully")
     conn.close()
 
+def test_connection_pool():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = db.ConnectionPool(os.path.join(tmpdir, "pool.db"), size=2)
+        
+        with pool.connection() as conn:
+            first = conn
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            conn.execute("CREATE TABLE items (name TEXT)")
+            conn.execute("INSERT INTO items VALUES ('a')")
+        
+        # Connections are reused and the previous transaction was committed
+        with pool.connection() as conn:
+            assert conn is first
+            assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+        
+        # Failed transactions are rolled back
+        try:
+            with pool.connection() as conn:
+                conn.execute("INSERT INTO items VALUES ('b')")
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 1
+        
+        pool.close()
+
+def test_async_helpers():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = os.path.join(tmpdir, "async.db")
+        
+        async def scenario():
+            await db.run(lambda conn: conn.execute("CREATE TABLE items (name TEXT)"), db_path=db_path)
+            await db.run(lambda conn: conn.execute("INSERT INTO items VALUES ('a')"), db_path=db_path)
+            return await db.run(lambda conn: conn.execute("SELECT name FROM items").fetchall(), db_path=db_path)
+        
+        assert asyncio.run(scenario()) == [("a",)]
+        db.get_pool(db_path).close()
+
+def test_migrations():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pool = db.ConnectionPool(os.path.join(tmpdir, "migrations.db"))
+        migrations = [
+            ["CREATE TABLE items (name TEXT)"],
+            ["CREATE INDEX idx_items_name ON items (name)"],
+        ]
+        
+        with pool.connection() as conn:
+            db.apply_migrations(conn, migrations[:1])
+            db.apply_migrations(conn, migrations)
+            # Already applied migrations are skipped
+            db.apply_migrations(conn, migrations)
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+        
+        pool.close()
+
 if __name__ == "__main__":
-    test_db_init()
\ No newline at end of file
+    test_db_init()
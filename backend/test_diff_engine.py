@@ -0,0 +1,54 @@
+import unittest
+import sys
+import os
+import difflib
+
+# Add the parent directory to the path so we can import the diff engine
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from diff_engine import iter_opcodes, unified_diff
+
+class TestDiffEngine(unittest.TestCase):
+
+    def test_identical_inputs_produce_no_diff(self):
+        """Identical inputs should not produce any output"""
+        lines = ["a\n", "b\n", "c\n"]
+        self.assertEqual(list(unified_diff(lines, lines, 'file1', 'file2')), [])
+
+    def test_matches_difflib_on_sparse_changes(self):
+        """Output format should match difflib.unified_diff"""
+        a = [f"line {i}\n" for i in range(500)]
+        b = list(a)
+        b[10] = "changed 10\n"
+        b.insert(250, "inserted\n")
+        del b[400]
+
+        expected = list(difflib.unified_diff(a, b, fromfile='file1', tofile='file2'))
+        self.assertEqual(list(unified_diff(a, b, 'file1', 'file2')), expected)
+
+    def test_opcodes_reconstruct_target(self):
+        """Applying the opcodes to the first input should yield the second"""
+        a = ["x\n", "y\n", "x\n", "z\n", "x\n"]
+        b = ["y\n", "x\n", "x\n", "w\n", "z\n"]
+
+        result = []
+        for tag, i1, i2, j1, j2 in iter_opcodes(a, b):
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+            result.extend(b[j1:j2])
+        self.assertEqual(result, b)
+
+    def test_output_is_lazy(self):
+        """The first hunk should be available without consuming the rest"""
+        a = [f"line {i}\n" for i in range(1000)]
+        b = list(a)
+        b[5] = "changed\n"
+        b[900] = "changed\n"
+
+        diff = unified_diff(a, b, 'file1', 'file2')
+        self.assertEqual(next(diff), "--- file1\n")
+        self.assertEqual(next(diff), "+++ file2\n")
+        self.assertTrue(next(diff).startswith("@@ -3,7 +3,7 @@"))
+
+if __name__ == '__main__':
+    unittest.main()
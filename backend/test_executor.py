@@ -0,0 +1,110 @@
+import unittest
+import sys
+import os
+import asyncio
+import time
+
+# Add the parent directory to the path so we can import the executor module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+from comparison import compare_texts, extract_with_regex
+from executor import ComparisonExecutor
+
+def stubborn_sleep(seconds: float) -> int:
+    """Sleep while swallowing every exception, the deadline included"""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try:
+            time.sleep(0.05)
+        except BaseException:
+            pass
+    return os.getpid()
+
+def swallow_errors(seconds: float) -> str:
+    try:
+        time.sleep(seconds)
+    except Exception:
+        return "swallowed"
+    return "slept"
+
+class TestExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = ComparisonExecutor(max_workers=1, max_queue=0, timeout=30)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_runs_comparison_in_worker(self):
+        """Results computed in the pool should match inline results"""
+        result = asyncio.run(self.executor.run(compare_texts, "a\nb", "a\nc"))
+        self.assertEqual(result, compare_texts("a\nb", "a\nc"))
+
+    def test_http_errors_are_propagated(self):
+        """HTTPExceptions raised in a worker should surface unchanged"""
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.executor.run(extract_with_regex, "text", "["))
+        self.assertEqual(ctx.exception.status_code, 400)
+
+    def test_timeout(self):
+        """Jobs running past their deadline should fail with 504"""
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.executor.run(time.sleep, 5, timeout=0.5))
+        self.assertEqual(ctx.exception.status_code, 504)
+
+    def test_deadline_is_not_an_exception(self):
+        """Handlers for Exception should not swallow the deadline"""
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.executor.run(swallow_errors, 5, timeout=0.3))
+        self.assertEqual(ctx.exception.status_code, 504)
+
+    def test_stuck_worker_is_killed(self):
+        """A worker that ignores its deadline should be killed and replaced"""
+        pid = asyncio.run(self.executor.run(os.getpid))
+        started = time.monotonic()
+        with self.assertRaises(HTTPException) as ctx:
+            asyncio.run(self.executor.run(stubborn_sleep, 30, timeout=0.3))
+        self.assertEqual(ctx.exception.status_code, 504)
+        self.assertLess(time.monotonic() - started, 5)
+
+        self.assertNotEqual(asyncio.run(self.executor.run(os.getpid)), pid)
+        time.sleep(0.2)
+        with self.assertRaises(ProcessLookupError):
+            os.kill(pid, 0)
+
+    def test_backpressure(self):
+        """Jobs beyond workers + queue size should be rejected with 429"""
+        async def submit_two():
+            return await asyncio.gather(
+                self.executor.run(time.sleep, 0.5),
+                self.executor.run(time.sleep, 0.5),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(submit_two())
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], HTTPException)
+        self.assertEqual(results[1].status_code, 429)
+
+    def test_waiting_for_capacity(self):
+        """Callers waiting for capacity should run as soon as a job finishes"""
+        async def wait_and_run():
+            await self.executor.wait_for_capacity()
+            return await self.executor.run(os.getpid)
+
+        async def scenario():
+            first = asyncio.ensure_future(self.executor.run(time.sleep, 0.3))
+            await asyncio.sleep(0)
+            waiting = [asyncio.ensure_future(wait_and_run()) for _ in range(3)]
+            await asyncio.sleep(0.1)
+            self.assertFalse(any(task.done() for task in waiting))
+            # A cancelled waiter must not swallow the wake-up of the others
+            waiting[0].cancel()
+            await first
+            return await asyncio.gather(*waiting[1:])
+
+        self.assertEqual(len(asyncio.run(scenario())), 2)
+
+if __name__ == '__main__':
+    unittest.main()
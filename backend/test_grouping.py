@@ -0,0 +1,75 @@
+import unittest
+import sys
+import os
+import re
+
+# Add the parent directory to the path so we can import the grouping module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from grouping import Grouper
+
+DIFF = [
+    '--- file1\n', '+++ file2\n',
+    '@@ -1,3 +1,4 @@\n', ' if1.reg1 = 0\n', '-if1.reg2 = 1\n', '+if1.reg2 = 2\n', '+junk\n',
+    '@@ -9 +10 @@\n', '-if2.reg1 = 3\n', '+if1.reg3 = 4\n',
+]
+
+class TestGrouping(unittest.TestCase):
+
+    def test_multi_level_counts(self):
+        """Every capturing group should be one level with per-kind counts"""
+        grouper = Grouper(re.compile(r'(if\d+)\.(reg\d+)'))
+        grouper.add_diff(DIFF)
+        groups = grouper.groups()
+
+        self.assertEqual([group["key"] for group in groups], ["if1", "if2", None])
+        self.assertEqual({k: groups[0][k] for k in ("count", "added", "removed")},
+                         {"count": 3, "added": 2, "removed": 1})
+        self.assertEqual([(group["key"], group["count"]) for group in groups[0]["groups"]],
+                         [("reg2", 2), ("reg3", 1)])
+        self.assertEqual(groups[2], {"key": None, "count": 1, "added": 1})
+
+    def test_only_changed_lines_are_grouped(self):
+        """Headers and context lines should never end up in a group"""
+        grouper = Grouper(re.compile(r'^(\S+?)\.'))
+        grouper.add_diff(DIFF)
+        self.assertEqual(grouper.lines, {
+            "if1": ['-if1.reg2 = 1\n', '+if1.reg2 = 2\n', '+if1.reg3 = 4\n'],
+            "if2": ['-if2.reg1 = 3\n'],
+        })
+
+    def test_hunks_match_whole_diff(self):
+        """Grouping hunk by hunk should give the same result as a whole diff"""
+        pattern = re.compile(r'if\d+')
+        whole, streamed = Grouper(pattern), Grouper(pattern)
+        whole.add_diff(DIFF)
+        per_hunk = [streamed.add_hunk(DIFF[2:7]), streamed.add_hunk(DIFF[7:])]
+
+        self.assertEqual(per_hunk[1], {"if2": ['-if2.reg1 = 3\n'], "if1": ['+if1.reg3 = 4\n']})
+        self.assertEqual(streamed.lines, whole.lines)
+        self.assertEqual(streamed.groups(), whole.groups())
+
+    def test_records(self):
+        """Records outside of a diff should be counted by kind"""
+        grouper = Grouper(re.compile(r'^(\w+)\.'), collect_lines=False)
+        grouper.add_records(["eth0.mtu", "eth0.speed", "lo.mtu"], "only_in_a")
+        grouper.add_records(["eth0.duplex", "hostname"], "only_in_b")
+        self.assertEqual(grouper.groups(), [
+            {"key": "eth0", "count": 3, "only_in_a": 2, "only_in_b": 1},
+            {"key": "lo", "count": 1, "only_in_a": 1},
+            {"key": None, "count": 1, "only_in_b": 1},
+        ])
+        self.assertEqual(grouper.lines, {})
+
+    def test_alternation_keys(self):
+        """Groups that take no part in a match should not make it unmatched"""
+        grouper = Grouper(re.compile(r'^(if\d+)\.|^(junk)|(?:reg(x))?= \d'))
+        grouper.add_diff(DIFF)
+        self.assertEqual([(group["key"], group["count"]) for group in grouper.groups()],
+                         [("if1", 3), ("if2", 1), ("junk", 1)])
+        self.assertEqual(grouper.lines["junk"], ['+junk\n'])
+        self.assertEqual(grouper.key("x = 1"), ("= 1",))
+        self.assertEqual(grouper.key("none"), (None,))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+import unittest
+import sys
+import os
+import asyncio
+import random
+import tempfile
+from unittest import mock
+
+# Add the parent directory to the path so we can import the incremental module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import db
+import diff_engine
+import incremental
+from incremental import ComparisonState, IncrementalStore, diff_edit, find_edit, full_state, patch, render
+from line_table import LineTable
+
+def apply_edit(state, side, start, end, replacement):
+    """Re-diff and apply an edit the way the update endpoint does"""
+    region = asyncio.run(diff_edit(state, side, start, end, replacement))
+    patch(state, side, start, end, replacement, region)
+
+class TestIncremental(unittest.TestCase):
+
+    def assertValidBlocks(self, state):
+        i0 = j0 = 0
+        for i, j, n in state.blocks[:-1]:
+            self.assertTrue(i >= i0 and j >= j0 and n > 0)
+            self.assertEqual(state.lines1[i:i + n], state.lines2[j:j + n])
+            i0, j0 = i + n, j + n
+        self.assertEqual(state.blocks[-1], (len(state.lines1), len(state.lines2), 0))
+
+    def test_find_edit(self):
+        """The edited range should be located between common prefix and suffix"""
+        table = LineTable.from_text
+        self.assertEqual(find_edit(table("a\nb\nc"), table("a\nx\ny\nc")), (1, 2, ["x\n", "y\n"]))
+        self.assertEqual(find_edit(table("a\na\n"), table("a\na\na\n")), (2, 2, ["a\n"]))
+        self.assertEqual(find_edit(table("a"), table("a")), (1, 1, []))
+        self.assertEqual(find_edit(table("a\nb"), table("a\nb\n")), (1, 2, ["b\n"]))
+
+    def test_find_edit_checks_hash_matches(self):
+        """Lines whose hashes collide should still be part of the edit"""
+        old, new = LineTable.from_text("a\nb\nc\n"), LineTable.from_text("a\nX\nc\n")
+        new.hashes = old.hashes.copy()
+        self.assertEqual(find_edit(old, new), (1, 2, ["X\n"]))
+
+    def test_single_edit_matches_full_comparison(self):
+        """A local edit should give the same diff as comparing from scratch"""
+        text = "".join(f"line {i}\n" for i in range(1000))
+        state = ComparisonState(1, *full_state(text, text.replace("line 10\n", "line ten\n")))
+
+        apply_edit(state, 2, 500, 501, ["changed\n"])
+
+        expected = list(diff_engine.unified_diff(state.lines1, state.lines2, fromfile='file1', tofile='file2'))
+        self.assertEqual(asyncio.run(render(state))["diff"], expected)
+        self.assertEqual(state.revision, 1)
+        # Rendered in a worker, as large comparisons are
+        with mock.patch.object(incremental, "INCREMENTAL_INLINE_LINES", 0):
+            self.assertEqual(asyncio.run(render(state))["diff"], expected)
+
+    def test_random_edits_keep_blocks_valid(self):
+        """Patched matching blocks should always describe the edited inputs"""
+        rng = random.Random(7)
+        for _ in range(50):
+            lines = "".join(f"l{rng.randint(0, 20)}\n" for _ in range(rng.randint(0, 40)))
+            state = ComparisonState(1, *full_state(lines, lines))
+            for _ in range(5):
+                side = rng.choice((1, 2))
+                size = len(state.lines1 if side == 1 else state.lines2)
+                start = rng.randint(0, size)
+                end = rng.randint(start, min(size, start + 3))
+                replacement = [f"x{rng.randint(0, 30)}\n" for _ in range(rng.randint(0, 3))]
+                apply_edit(state, side, start, end, replacement)
+                self.assertValidBlocks(state)
+            self.assertEqual(list(state.lines1.hashes), list(LineTable.from_text("".join(state.lines1)).hashes))
+
+class TestSharedStore(unittest.TestCase):
+    """Two stores on one database stand in for two backend processes"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmpdir.name, "incremental.db")
+        with db.connection(db_path) as conn:
+            incremental.init_incremental_tables(conn.cursor())
+        directory = os.path.join(self.tmpdir.name, "snapshots")
+        self.stores = [IncrementalStore(directory=directory, db_path=db_path) for _ in range(2)]
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(db.get_pool(db_path).close)
+
+    def edit(self, store, comparison_id, side, start, end, replacement):
+        async def run():
+            state = store.get(comparison_id, 1)
+            self.assertTrue(await store.sync(comparison_id, state))
+            region = await diff_edit(state, side, start, end, replacement)
+            self.assertTrue(await store.commit(comparison_id, state, side, start, end, replacement, region))
+            return state
+        return asyncio.run(run())
+
+    def synced(self, store, comparison_id, owner_id=1):
+        async def run():
+            state = store.get(comparison_id, owner_id)
+            return state if await store.sync(comparison_id, state) else None
+        return asyncio.run(run())
+
+    def test_edits_are_seen_by_every_process(self):
+        """Edits made through one store should be replayed by the other"""
+        text = "".join(f"line {i}\n" for i in range(200))
+        first, second = self.stores
+        comparison_id = asyncio.run(first.add(ComparisonState(1, *full_state(text, text))))
+
+        self.edit(first, comparison_id, 2, 10, 11, ["changed\n"])
+        state = self.edit(second, comparison_id, 1, 50, 50, ["inserted\n"])
+        self.assertEqual(state.revision, 2)
+
+        replayed = self.synced(first, comparison_id)
+        self.assertEqual(replayed.revision, 2)
+        self.assertEqual(list(replayed.lines1), list(state.lines1))
+        self.assertEqual(list(replayed.lines2), list(state.lines2))
+        self.assertEqual(replayed.blocks, state.blocks)
+        self.assertIsNone(self.synced(second, comparison_id, owner_id=2))
+
+    def test_stale_commit_is_rejected(self):
+        """An edit based on an outdated revision should not be recorded"""
+        text = "a\nb\nc\n"
+        first, second = self.stores
+        comparison_id = asyncio.run(first.add(ComparisonState(1, *full_state(text, text))))
+        stale = self.synced(second, comparison_id)
+        self.edit(first, comparison_id, 1, 0, 1, ["x\n"])
+
+        async def commit():
+            region = await diff_edit(stale, 1, 1, 2, ["y\n"])
+            return await second.commit(comparison_id, stale, 1, 1, 2, ["y\n"], region)
+        self.assertFalse(asyncio.run(commit()))
+        self.assertEqual(stale.revision, 0)
+
+    def test_snapshots_compact_the_journal(self):
+        """Long edit histories should be folded into a new snapshot"""
+        text = "".join(f"line {i}\n" for i in range(100))
+        first, second = self.stores
+        comparison_id = asyncio.run(first.add(ComparisonState(1, *full_state(text, text))))
+        for k in range(incremental.INCREMENTAL_SNAPSHOT_EDITS + 1):
+            state = self.edit(first, comparison_id, 2, k, k + 1, [f"edit {k}\n"])
+
+        with db.connection(first.db_path) as conn:
+            self.assertEqual(len(incremental.load_edits(conn, comparison_id, 0)), 1)
+        self.assertEqual(os.listdir(first.directory),
+                         [f"{comparison_id}-{incremental.INCREMENTAL_SNAPSHOT_EDITS}.pickle"])
+        replayed = self.synced(second, comparison_id)
+        self.assertEqual((list(replayed.lines2), replayed.blocks), (list(state.lines2), state.blocks))
+        # Snapshots hold only the bytes of current lines
+        _, lines2, _ = incremental.read_snapshot(os.path.join(first.directory, os.listdir(first.directory)[0]))
+        self.assertEqual(lines2.data, b"".join(line.encode() for line in lines2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+# Add the parent directory to the path so we can import the jobs module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import db
+import jobs
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, "jobs.db")
+        with db.connection(self.db_path) as conn:
+            jobs.init_jobs_table(conn.cursor())
+
+    def tearDown(self):
+        db.get_pool(self.db_path).close()
+        self.tmpdir.cleanup()
+
+    def call(self, fn, *args, **kwargs):
+        with db.connection(self.db_path) as conn:
+            return fn(conn, *args, **kwargs)
+
+    def test_job_lifecycle(self):
+        """A job should go from queued to completed and expose its result"""
+        job_id = self.call(jobs.create_job, 1)
+        self.assertEqual(self.call(jobs.get_job, job_id, 1)["state"], "queued")
+
+        jobs.run_comparison_job(self.db_path, job_id, "a\nb\nc", "a\nx\nc")
+
+        job = self.call(jobs.get_job, job_id, 1)
+        self.assertEqual(job["state"], "completed")
+        self.assertEqual(job["progress"], 100.0)
+        self.assertEqual(job["lines_scanned"], 3)
+        self.assertEqual(job["hunks_found"], 1)
+
+        state, result = self.call(jobs.get_job_result, job_id, 1)
+        self.assertEqual(state, "completed")
+        self.assertEqual(json.loads(result)["stats"]["lines_added"], 1)
+
+    def test_jobs_are_scoped_to_owner(self):
+        """Other users should not see a job"""
+        job_id = self.call(jobs.create_job, 1)
+        self.assertIsNone(self.call(jobs.get_job, job_id, 2))
+
+    def test_expired_jobs_are_evicted(self):
+        """Jobs past their TTL should disappear"""
+        job_id = self.call(jobs.create_job, 1)
+        self.call(jobs.update_job, job_id, expires_at=0)
+        self.assertIsNone(self.call(jobs.get_job, job_id, 1))
+
+        self.call(jobs.create_job, 1)
+        with db.connection(self.db_path) as conn:
+            remaining = conn.execute("SELECT COUNT(*) FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+        self.assertEqual(remaining, 0)
+
+if __name__ == '__main__':
+    unittest.main()
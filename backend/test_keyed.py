@@ -0,0 +1,88 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the keyed module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from keyed import (
+    compare_keyed,
+    compare_maps,
+    compare_target,
+    drifted_keys,
+    extract_pairs_columns,
+    extract_pairs_regex,
+    extract_reference,
+)
+
+class TestKeyedComparison(unittest.TestCase):
+
+    def test_compare_maps_buckets(self):
+        """Keys should be sorted into only_in_a/only_in_b/different_values"""
+        result = compare_maps(
+            {"setting1": "value1", "setting2": "value2", "setting4": "value4"},
+            {"setting1": "value1", "setting2": "different", "setting5": "value5"},
+        )
+        self.assertEqual(result["only_in_a"], {"setting4": "value4"})
+        self.assertEqual(result["only_in_b"], {"setting5": "value5"})
+        self.assertEqual(result["different_values"], {"setting2": {"a": "value2", "b": "different"}})
+        self.assertEqual(result["stats"]["matching"], 1)
+        self.assertNotIn("matching", result)
+
+    def test_regex_extraction(self):
+        """Key/value pairs should be extracted per line, skipping comments"""
+        text = "# comment\nPageSize = A4\nFont \"Times New Roman\"\nignored line!\n"
+        self.assertEqual(
+            extract_pairs_regex(text, filter_pattern=r'^ignored'),
+            {"PageSize": "A4", "Font": "Times New Roman"}
+        )
+        self.assertEqual(
+            extract_pairs_regex("a=1\nb=2", r'^(?P<value>\w+)=(?P<key>\w+)$'),
+            {"1": "a", "2": "b"}
+        )
+
+    def test_column_extraction(self):
+        """Column rules should apply to the tab-delimited Excel text"""
+        text = "[Settings]\nkey\tvalue\ntimeout\t30\n[Other]\ntimeout\t60"
+        self.assertEqual(
+            extract_pairs_columns(text, 0, 1, sheet="Settings"),
+            {"key": "value", "timeout": "30"}
+        )
+        self.assertEqual(
+            extract_pairs_columns(text, 0, 1, sheet="Settings", filter_pattern=r'^key\t'),
+            {"timeout": "30"}
+        )
+
+    def test_reordered_keys_are_not_reported(self):
+        """Reordering keys should not produce differences"""
+        result = compare_keyed("a=1\nb=2\nc=3", "c=3\na=1\nb=2")
+        self.assertEqual(result["stats"]["matching"], 3)
+        self.assertEqual(result["stats"]["different_values"], 0)
+
+    def test_excel_against_text(self):
+        """An Excel column rule on one side should compare against a regex on the other"""
+        result = compare_keyed(
+            "[Sheet1]\ntimeout\t30\nmtu\t1500",
+            "timeout=30\nmtu=9000",
+            rules1={"key_column": 0},
+        )
+        self.assertEqual(result["different_values"], {"mtu": {"a": "1500", "b": "9000"}})
+
+    def test_batch_target(self):
+        """Targets should be compared against a reference extracted once"""
+        reference = extract_reference("a=1\nb=2\nc=3")
+        result = compare_target(reference, "a=1\nb=5\nd=4")
+        self.assertEqual(sorted(drifted_keys(result)), ["b", "c", "d"])
+        self.assertEqual(drifted_keys(compare_target(reference, "c=3\nb=2\na=1")), [])
+
+    def test_grouped_keys(self):
+        """Drifted keys should be counted per group_by key"""
+        result = compare_keyed("eth0.mtu = 1500\neth0.speed = 1000\nlo.mtu = 65536",
+                               "eth0.mtu = 9000\nlo.mtu = 65536\nlo.up = yes", group_by=r'^(\w+)\.')
+        self.assertEqual(result["groups"], [
+            {"key": "eth0", "count": 2, "only_in_a": 1, "different_values": 1},
+            {"key": "lo", "count": 1, "only_in_b": 1},
+        ])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import sys
+import os
+from unittest import mock
+
+# Add the parent directory to the path so we can import the line_table module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import line_table
+from line_table import LineTable, split_lines, verified_blocks
+
+class TestLineTable(unittest.TestCase):
+
+    def test_lines_are_addressed_by_offsets(self):
+        """Lines should keep their newline and come out of the shared text"""
+        table = LineTable.from_text("a\nbb\n\nc")
+        self.assertEqual(list(table), ["a\n", "bb\n", "\n", "c"])
+        self.assertEqual(table[1:3], ["bb\n", "\n"])
+        self.assertEqual(list(table.ends), [2, 5, 6, 7])
+        self.assertEqual(table.hashes[0], LineTable.from_text("b\na\n").hashes[1])
+        self.assertEqual(split_lines("x\r\ny"), ["x\r\n", "y"])
+        self.assertEqual(len(LineTable.from_text("")), 0)
+
+    def test_lines_span_scan_chunks(self):
+        """Lines should be found the same way when they cross the chunks newlines are scanned in"""
+        text = "ab\n\ncdefg\nh\n\n\nijklmnop\nq"
+        with mock.patch.object(line_table, "HASH_CHUNK", 4):
+            table = LineTable.from_text(text)
+        self.assertEqual(list(table), text.splitlines(keepends=True))
+        self.assertEqual(list(table.hashes), list(LineTable.from_text(text).hashes))
+
+    def test_filter_matches_split_join(self):
+        """Filtering should give the lines of the former split/join round trip"""
+        for text in ["a\nskip\nb", "a\nb\nskip", "a\nb\n", "skip\n", "", "a\nskip\n",
+                     "a\n\nskip", "a\nskip\n\nskip"]:
+            kept = '\n'.join(line for line in text.split('\n') if 'skip' not in line)
+            table = LineTable.from_text(text).filtered(lambda line: 'skip' in line)
+            self.assertEqual(list(table), kept.splitlines(keepends=True), text)
+            self.assertEqual(list(table.hashes), [LineTable.from_text(line).hashes[0] for line in table], text)
+
+    def test_hash_collisions_are_split(self):
+        """Blocks matched on colliding hashes should be checked against the text"""
+        a = LineTable.from_text("x\ny\nz\n")
+        b = LineTable.from_text("x\nY\nz\n")
+        b.hashes = a.hashes.copy()
+        self.assertEqual(list(verified_blocks(a, b, [(0, 0, 3), (3, 3, 0)])), [(0, 0, 1), (2, 2, 1), (3, 3, 0)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import sys
+import os
+import asyncio
+import json
+import tempfile
+
+# Add the parent directory to the path so we can import the metrics module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+
+import metrics
+from comparison import compare_texts_json
+from executor import ComparisonExecutor
+
+app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.post("/items/{item_id}")
+async def compare_item(item_id: int, regex_pattern: str = None, file1_content: str = None):
+    with metrics.stage("diff", lines=5000):
+        pass
+    return {"item_id": item_id}
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_rendering(self):
+        """Histograms should render cumulative Prometheus buckets"""
+        histogram = metrics.Histogram("test_seconds", "Test", ("stage",), (0.1, 1))
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5, 'quo"te')
+        lines = list(histogram.render())
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 2', lines)
+        self.assertIn('test_seconds_count{stage="a"} 2', lines)
+        self.assertIn('test_seconds_sum{stage="a"} 0.55', lines)
+        self.assertIn('test_seconds_bucket{stage="quo\\"te",le="+Inf"} 1', lines)
+
+    def test_request_metrics(self):
+        """Requests should be recorded per route template with their stages"""
+        client = TestClient(app)
+        self.assertEqual(client.post("/items/1?regex_pattern=x").status_code, 200)
+        self.assertEqual(client.post("/items/2").status_code, 200)
+        text = client.get("/metrics").text
+        self.assertIn('filecomparehub_request_duration_seconds_count{method="POST",endpoint="/items/{item_id}",status="200"} 2', text)
+        self.assertIn('filecomparehub_stage_duration_seconds_count{stage="diff",endpoint="/items/{item_id}",size="64KB",lines="10k"} 2', text)
+
+    def test_slow_request_log(self):
+        """Slow requests should be logged with patterns and input sizes, not contents"""
+        client = TestClient(app)
+        original = metrics.SLOW_REQUEST_SECONDS
+        metrics.SLOW_REQUEST_SECONDS = 1e-9
+        try:
+            with self.assertLogs("filecomparehub.slow_requests", level="WARNING") as logs:
+                client.post("/items/3?regex_pattern=a(b)&file1_content=secret")
+        finally:
+            metrics.SLOW_REQUEST_SECONDS = original
+        self.assertIn('"regex_pattern": "a(b)"', logs.output[0])
+        self.assertIn('"file1_content": 6', logs.output[0])
+        self.assertIn('"stage": "diff"', logs.output[0])
+        self.assertNotIn("secret", logs.output[0])
+
+    def test_worker_stages_are_replayed(self):
+        """Stage timings recorded in a worker should reach the API process"""
+        executor = ComparisonExecutor(max_workers=1)
+        context = metrics.RequestContext({"path": "/compare"}, 100)
+        token = metrics._request.set(context)
+        try:
+            asyncio.run(executor.run(compare_texts_json, "a\nb", "a\nc", regex_pattern=r"\w", filter_pattern="x"))
+        finally:
+            metrics._request.reset(token)
+            executor.shutdown()
+        self.assertEqual([stage for stage, _, _ in context.stages], ["extract", "filter", "extract", "filter",
+                                                                      "diff", "group", "serialize"])
+
+    def test_shared_directory_sums_processes(self):
+        """With METRICS_DIR, /metrics should add up the files of every process"""
+        with tempfile.TemporaryDirectory() as directory:
+            other = {metrics.DB_SECONDS.name: [[["/other"], [1] + [0] * len(metrics.TIME_BUCKETS), 0.0005]]}
+            with open(os.path.join(directory, "metrics-1.json"), 'w') as f:
+                json.dump(other, f)
+            original = metrics.METRICS_DIR
+            metrics.METRICS_DIR = directory
+            try:
+                metrics.observe_db(0.0005)
+                text = metrics.render()
+            finally:
+                metrics.METRICS_DIR = original
+            self.assertIn(f"metrics-{os.getpid()}.json", os.listdir(directory))
+        self.assertIn('filecomparehub_db_query_duration_seconds_count{endpoint="/other"} 1', text)
+        self.assertIn('filecomparehub_db_query_duration_seconds_count{endpoint="none"}', text)
+
+if __name__ == '__main__':
+    unittest.main()
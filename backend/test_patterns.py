@@ -0,0 +1,38 @@
+import unittest
+import sys
+import os
+
+# Add the parent directory to the path so we can import the patterns module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+from patterns import PatternRegistry, compile_patterns
+
+class TestPatterns(unittest.TestCase):
+
+    def test_patterns_are_compiled_once(self):
+        """Compiling the same pattern twice should return the cached object"""
+        registry = PatternRegistry()
+        self.assertIs(registry.compile(r'(\w+)=(\w+)'), registry.compile(r'(\w+)=(\w+)'))
+
+    def test_registry_is_bounded(self):
+        """The registry should evict the least recently used pattern"""
+        registry = PatternRegistry(max_size=2)
+        first = registry.compile('a')
+        registry.compile('b')
+        registry.compile('a')
+        registry.compile('c')
+
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.compile('a'), first)
+
+    def test_invalid_patterns_are_reported_up_front(self):
+        """Errors should name the pattern that failed to compile"""
+        with self.assertRaises(HTTPException) as ctx:
+            compile_patterns(r'(\w+)', r'[', None)
+        self.assertEqual(ctx.exception.status_code, 400)
+        self.assertIn("filter pattern", ctx.exception.detail)
+
+if __name__ == '__main__':
+    unittest.main()
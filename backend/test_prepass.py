@@ -0,0 +1,48 @@
+import unittest
+import sys
+import os
+import random
+
+# Add the parent directory to the path so we can import the prepass module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import prepass
+
+class TestPrepass(unittest.TestCase):
+
+    def assertValidBlocks(self, a, b, blocks):
+        i0 = j0 = 0
+        for i, j, n in blocks[:-1]:
+            self.assertTrue(i >= i0 and j >= j0 and n > 0)
+            self.assertEqual(list(a[i:i + n]), list(b[j:j + n]))
+            i0, j0 = i + n, j + n
+        self.assertEqual(blocks[-1], (len(a), len(b), 0))
+
+    def test_near_identical_inputs(self):
+        """Identical stretches should be found by the pre-pass alone"""
+        a = np.arange(1000, dtype=np.uint64)
+        b = np.concatenate((a[:300], [5000], a[301:700], a[705:]))
+        self.assertEqual(prepass.identical_blocks(a, b), [(0, 0, 300), (301, 301, 399), (705, 700, 295)])
+        self.assertValidBlocks(a, b, list(prepass.iter_matching_blocks(a, b)))
+
+    def test_random_edits(self):
+        """Matching blocks should stay valid for edits, duplicates and moved lines"""
+        rng = random.Random(5)
+        for _ in range(300):
+            a = [rng.randint(0, rng.choice((5, 50, 500))) for _ in range(rng.randint(0, 60))]
+            b = list(a)
+            for _ in range(rng.randint(0, 5)):
+                k, m = rng.randint(0, len(b)), rng.randint(0, 4)
+                segment = b[k:k + m]
+                del b[k:k + m]
+                if rng.random() < 0.5:
+                    segment = [1000 + x for x in segment]
+                position = rng.randint(0, len(b))
+                b[position:position] = segment
+            a, b = np.array(a, dtype=np.uint64), np.array(b, dtype=np.uint64)
+            self.assertValidBlocks(a, b, list(prepass.iter_matching_blocks(a, b)))
+
+if __name__ == '__main__':
+    unittest.main()
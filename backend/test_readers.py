@@ -0,0 +1,57 @@
+import unittest
+import sys
+import os
+import tempfile
+
+import openpyxl
+
+# Add the parent directory to the path so we can import the readers module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from comparison import _iter_excel_text
+from readers import iter_excel_rows
+
+class TestReaders(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Stored blobs have no file extension
+        self.path = os.path.join(self.tmpdir.name, "workbook")
+
+        workbook = openpyxl.Workbook()
+        settings = workbook.active
+        settings.title = "Settings"
+        settings.append(["key", "value", None])
+        settings.append(["timeout", 30.0, None])
+        settings.append([None, None, None])
+        settings.append(["name", "  core   router ", None])
+        ports = workbook.create_sheet("Ports")
+        ports.append(["eth0", True])
+        workbook.save(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rows_are_normalized(self):
+        """Cells should be rendered independently of their formatting"""
+        rows = list(iter_excel_rows(self.path))
+        self.assertEqual(rows, [
+            ("Settings", ["key", "value"]),
+            ("Settings", ["timeout", "30"]),
+            ("Settings", ["name", "core router"]),
+            ("Ports", ["eth0", "TRUE"]),
+        ])
+
+    def test_sheet_selection(self):
+        """Only the requested sheets should be read"""
+        rows = list(iter_excel_rows(self.path, ["Ports"]))
+        self.assertEqual(rows, [("Ports", ["eth0", "TRUE"])])
+
+    def test_excel_text_representation(self):
+        """Every sheet should be rendered as tab-delimited lines"""
+        self.assertEqual(
+            ''.join(_iter_excel_text(self.path)),
+            "[Settings]\nkey\tvalue\ntimeout\t30\nname\tcore router\n[Ports]\neth0\tTRUE"
+        )
+
+if __name__ == '__main__':
+    unittest.main()
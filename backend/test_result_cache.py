@@ -0,0 +1,60 @@
+import unittest
+import sys
+import os
+import asyncio
+import tempfile
+
+# Add the parent directory to the path so we can import the result cache
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from blob_store import BlobRef
+from result_cache import ResultCache, make_key
+
+class TestResultCache(unittest.TestCase):
+
+    def test_key_depends_on_inputs_and_patterns(self):
+        """Keys should change with any input or pattern"""
+        key = make_key("a", "b", r"(\w+)", None, None)
+        self.assertEqual(key, make_key("a", "b", r"(\w+)", None, None))
+        self.assertNotEqual(key, make_key("a", "c", r"(\w+)", None, None))
+        self.assertNotEqual(key, make_key("a", "b", r"(\w+)", "x", None))
+        self.assertNotEqual(make_key(BlobRef("0" * 64), "b"), make_key("0" * 64, "b"))
+
+    def test_lru_eviction_and_counters(self):
+        """The memory tier should evict the least recently used entry"""
+        cache = ResultCache(max_entries=2, directory=None)
+        asyncio.run(cache.put("a", b"1"))
+        asyncio.run(cache.put("b", b"2"))
+        self.assertEqual(asyncio.run(cache.get("a")), b"1")
+        asyncio.run(cache.put("c", b"3"))
+
+        self.assertIsNone(asyncio.run(cache.get("b")))
+        self.assertEqual(asyncio.run(cache.get("c")), b"3")
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 2)
+
+    def test_disk_tier(self):
+        """Entries evicted from memory should still be served from disk"""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_entries=1, directory=directory, max_disk_bytes=1024)
+            asyncio.run(cache.put("a", b"1"))
+            asyncio.run(cache.put("b", b"2"))
+
+            self.assertEqual(asyncio.run(cache.get("a")), b"1")
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_disk_size_limit(self):
+        """The disk tier should stay below its size limit"""
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResultCache(max_entries=1, directory=directory, max_disk_bytes=25)
+            for key in "abcd":
+                asyncio.run(cache.put(key, b"x" * 10))
+
+            total = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+            self.assertLessEqual(total, 25)
+            self.assertEqual(asyncio.run(cache.get("d")), b"x" * 10)
+
+if __name__ == '__main__':
+    unittest.main()
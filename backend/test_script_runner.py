@@ -0,0 +1,98 @@
+import unittest
+import sys
+import os
+import asyncio
+import json
+import tempfile
+
+# Add the parent directory to the path so we can import the script_runner module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+import script_runner
+from script_runner import ScriptRunner, run_script, script_hash
+
+SCRIPT = '''
+def compare(file1, file2, prefix=""):
+    print("comparing")
+    with open(file1) as a, open(file2) as b:
+        return {"equal": a.read() == b.read(), "prefix": prefix}
+'''
+
+class TestScriptRunner(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.file1 = os.path.join(self.tmpdir.name, "a.txt")
+        self.file2 = os.path.join(self.tmpdir.name, "b.txt")
+        for path, text in ((self.file1, "a=1"), (self.file2, "a=2")):
+            with open(path, "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def run_inline(self, content, params=None):
+        return json.loads(run_script(content, script_hash(content), self.file1, self.file2, params))
+
+    def test_runs_entry_point(self):
+        """The entry point's result and printed output should be returned"""
+        result = self.run_inline(SCRIPT, {"prefix": "x"})
+        self.assertEqual(result["result"], {"equal": False, "prefix": "x"})
+        self.assertEqual(result["output"], "comparing\n")
+
+    def test_compiled_scripts_are_cached(self):
+        """Scripts should be compiled once per content hash"""
+        self.run_inline(SCRIPT)
+        code = script_runner._compiled[script_hash(SCRIPT)]
+        self.run_inline(SCRIPT)
+        self.assertIs(script_runner._compiled[script_hash(SCRIPT)], code)
+
+    def test_script_errors(self):
+        """Broken scripts should fail with client errors"""
+        with self.assertRaises(HTTPException) as ctx:
+            self.run_inline("x = 1")
+        self.assertEqual(ctx.exception.status_code, 400)
+
+        with self.assertRaises(HTTPException) as ctx:
+            self.run_inline("def compare(a, b):\n    raise ValueError('bad input')")
+        self.assertEqual(ctx.exception.status_code, 422)
+        self.assertEqual(ctx.exception.detail["error"], "ValueError: bad input")
+
+    def test_worker_pool(self):
+        """Scripts should run in the warm worker pool"""
+        runner = ScriptRunner(max_workers=1, max_queue=0, timeout=30)
+        try:
+            runner.warm()
+            result = asyncio.run(runner.run(SCRIPT, self.file1, self.file1))
+            self.assertTrue(json.loads(result)["result"]["equal"])
+        finally:
+            runner.shutdown()
+
+    def test_worker_environment_is_scrubbed(self):
+        """Scripts should not see the secrets in the backend's environment"""
+        script = "import os\ndef compare(file1, file2):\n    return sorted(os.environ)"
+        os.environ["SECRET_KEY"] = "do-not-leak"
+        runner = ScriptRunner(max_workers=1, max_queue=0, timeout=30)
+        try:
+            names = json.loads(asyncio.run(runner.run(script, self.file1, self.file2)))["result"]
+        finally:
+            runner.shutdown()
+            del os.environ["SECRET_KEY"]
+        self.assertNotIn("SECRET_KEY", names)
+        self.assertTrue(set(names) <= set(script_runner.SCRIPT_ENV_ALLOWLIST))
+
+    def test_scripts_cannot_catch_the_deadline(self):
+        """A script catching Exception should still be stopped at its deadline"""
+        script = ("import time\ndef compare(file1, file2):\n    try:\n        time.sleep(30)\n"
+                  "    except Exception:\n        return 'survived'")
+        runner = ScriptRunner(max_workers=1, max_queue=0, timeout=0.5)
+        try:
+            with self.assertRaises(HTTPException) as ctx:
+                asyncio.run(runner.run(script, self.file1, self.file2))
+        finally:
+            runner.shutdown()
+        self.assertEqual(ctx.exception.status_code, 504)
+
+if __name__ == '__main__':
+    unittest.main()
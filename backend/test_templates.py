@@ -0,0 +1,53 @@
+import unittest
+import sys
+import os
+import json
+
+# Add the parent directory to the path so we can import the templates module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import HTTPException
+
+from templates import Pipeline, TemplateCache, compile_template
+
+class TestCompileTemplate(unittest.TestCase):
+    def test_pipeline_from_config(self):
+        """Template configs should yield the comparison options, ignoring other fields"""
+        config = json.dumps({"file1": "a.txt", "regex_pattern": r"(\w+)", "filter_pattern": "",
+                             "group_by": r"^(\w+)\.", "include_default_group": False})
+        self.assertEqual(compile_template(config), Pipeline(r"(\w+)", None, r"^(\w+)\.", False))
+        self.assertEqual(compile_template("{}"), Pipeline(None, None, None, True))
+
+    def test_invalid_configs(self):
+        """Unparsable configs and invalid patterns should be rejected with 400"""
+        for config in ("not json", "[]", json.dumps({"group_by": 1}), json.dumps({"regex_pattern": "("})):
+            with self.assertRaises(HTTPException) as raised:
+                compile_template(config)
+            self.assertEqual(raised.exception.status_code, 400)
+
+class TestTemplateCache(unittest.TestCase):
+    def test_versions_retire_older_pipelines(self):
+        """Caching a new version of a template should drop its older versions"""
+        cache = TemplateCache()
+        old, new = Pipeline("a", None, None, True), Pipeline("b", None, None, True)
+        cache.put(1, 1, old)
+        self.assertIs(cache.get(1, 1), old)
+        self.assertIsNone(cache.get(1, 2))
+        cache.put(1, 2, new)
+        self.assertIsNone(cache.get(1, 1))
+        self.assertIs(cache.get(1, 2), new)
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": 2, "misses": 2})
+
+    def test_size_bound(self):
+        """The least recently used templates should be evicted first"""
+        cache = TemplateCache(max_entries=2)
+        pipeline = Pipeline(None, None, None, True)
+        cache.put(1, 1, pipeline)
+        cache.put(2, 1, pipeline)
+        cache.get(1, 1)
+        cache.put(3, 1, pipeline)
+        self.assertIsNotNone(cache.get(1, 1))
+        self.assertIsNone(cache.get(2, 1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+import sqlite3
+import time
+
+# Add the parent directory to the path so we can import the tokens module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tokens import TokenCache, init_revocations_table, load_revocations, revoke_token, token_digest
+
+class TestTokenCache(unittest.TestCase):
+    def test_cached_until_expiry(self):
+        """Cached claims should never outlive the token's exp"""
+        cache = TokenCache(ttl=300)
+        cache.put("a", {"user_id": 1, "exp": time.time() + 60})
+        self.assertEqual(cache.get("a")["user_id"], 1)
+
+        cache.put("b", {"user_id": 2, "exp": time.time() - 1})
+        self.assertIsNone(cache.get("b"))
+
+    def test_ttl_and_size_bound(self):
+        """Entries should expire after the TTL and the least recently used should be evicted"""
+        cache = TokenCache(max_entries=2, ttl=0)
+        cache.put("a", {"user_id": 1})
+        self.assertIsNone(cache.get("a"))
+
+        cache = TokenCache(max_entries=2, ttl=300)
+        for digest in ("a", "b"):
+            cache.put(digest, {"user_id": digest})
+        cache.get("a")
+        cache.put("c", {"user_id": "c"})
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+
+    def test_revocation(self):
+        """Revoked tokens should be dropped and never cached again"""
+        cache = TokenCache()
+        cache.put("a", {"user_id": 1})
+        cache.revoke("a", time.time() + 60)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", {"user_id": 1})
+        self.assertIsNone(cache.get("a"))
+        self.assertTrue(cache.is_revoked("a"))
+
+    def test_revocations_are_shared_through_the_database(self):
+        """Revocations written by one process should reach the caches of others"""
+        conn = sqlite3.connect(":memory:")
+        init_revocations_table(conn.cursor())
+        digest = token_digest("token")
+        revoke_token(conn, digest, time.time() + 60)
+        revoke_token(conn, token_digest("expired"), time.time() - 60)
+
+        cache = TokenCache(refresh_interval=60)
+        cache.put(digest, {"user_id": 1})
+        self.assertTrue(cache.start_refresh())
+        # Requests arriving while the refresh is in flight do not refresh as well
+        self.assertFalse(cache.start_refresh())
+        cache.add_revocations(load_revocations(conn, cache.revocations_seen))
+        self.assertFalse(cache.start_refresh())
+        self.assertIsNone(cache.get(digest))
+        self.assertFalse(cache.is_revoked(token_digest("expired")))
+        self.assertEqual(load_revocations(conn, cache.revocations_seen), [])
+
+    def test_cancelled_refresh_is_retried(self):
+        """A refresh that failed should be claimed again by the next request"""
+        cache = TokenCache(refresh_interval=60)
+        self.assertTrue(cache.start_refresh())
+        cache.cancel_refresh()
+        self.assertTrue(cache.start_refresh())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import sys
+import os
+import hashlib
+import tempfile
+
+# Add the parent directory to the path so we can import the upload handling
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import blob_store
+import readers
+from uploads import receive_upload, receive_uploads
+
+app = FastAPI()
+
+@app.post("/upload")
+async def upload(request: Request, max_size: int = 0):
+    return (await receive_upload(request, max_size=max_size))._asdict()
+
+@app.post("/upload/pair")
+async def upload_pair(request: Request):
+    uploads = await receive_uploads(request, ("file1", "file2"))
+    return {field: upload._asdict() for field, upload in uploads.items()}
+
+class TestUploads(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = blob_store.BLOB_DIR
+        blob_store.BLOB_DIR = self.tmpdir.name
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        blob_store.BLOB_DIR = self.original_dir
+        self.tmpdir.cleanup()
+
+    def spooled_files(self):
+        return [name for name in os.listdir(self.tmpdir.name) if name.startswith('.upload')]
+
+    def test_text_is_cached_while_uploading(self):
+        """Text uploads should be stored, hashed and decoded in one pass"""
+        content = "a\r\nb\rc\n" * 100000
+        response = self.client.post("/upload", data={"note": "x"},
+                                    files={"file": ("data.txt", content.encode('utf-8'), "text/plain")})
+        self.assertEqual(response.status_code, 200)
+        upload = response.json()
+        self.assertEqual(upload["filename"], "data.txt")
+        self.assertEqual(upload["size"], len(content))
+        self.assertEqual(upload["blob_id"], hashlib.sha256(content.encode('utf-8')).hexdigest())
+        self.assertEqual(blob_store.get_text(upload["blob_id"]),
+                         ''.join(readers.iter_text_chunks(blob_store.raw_path(upload["blob_id"]))))
+        self.assertEqual(self.spooled_files(), [])
+
+    def test_undecodable_text_is_left_for_extraction(self):
+        """Text that does not decode should be stored without cached text"""
+        response = self.client.post("/upload", files={"file": ("data.txt", b"\xff\xfe", "text/plain")})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(blob_store.get_text_path(response.json()["blob_id"]))
+        self.assertEqual(self.spooled_files(), [])
+
+    def test_size_limit(self):
+        """Uploads over the size limit should be rejected and cleaned up"""
+        response = self.client.post("/upload?max_size=10", files={"file": ("data.txt", b"x" * 11, "text/plain")})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.spooled_files(), [])
+
+        response = self.client.post("/upload?max_size=10", files={"file": ("data.txt", b"x" * 10, "text/plain")})
+        self.assertEqual(response.status_code, 200)
+
+    def test_missing_file(self):
+        """Requests without a file part should be rejected"""
+        response = self.client.post("/upload", files={"other": ("data.txt", b"x", "text/plain")})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post("/upload", json={"file": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_several_fields(self):
+        """Every requested field should be stored, and all of them are required"""
+        files = {"file1": ("a.txt", b"a\n", "text/plain"), "file2": ("b.mif", b"b\n", "text/plain")}
+        response = self.client.post("/upload/pair", files=files)
+        self.assertEqual(response.status_code, 200)
+        uploads = response.json()
+        self.assertEqual(uploads["file1"]["filename"], "a.txt")
+        self.assertEqual(blob_store.get_text(uploads["file2"]["blob_id"]), "b\n")
+
+        response = self.client.post("/upload/pair", files={"file1": ("a.txt", b"a\n", "text/plain")})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.spooled_files(), [])
+
+    def test_malformed_body(self):
+        """Broken multipart bodies should be rejected as client errors"""
+        body = b"--boundary\r\nContent Disposition: form-data\r\n\r\nabc\r\n--boundary--\r\n"
+        response = self.client.post("/upload", content=body,
+                                    headers={"Content-Type": "multipart/form-data; boundary=boundary"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.spooled_files(), [])
+
+if __name__ == '__main__':
+    unittest.main()
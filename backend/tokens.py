@@ -0,0 +1,142 @@
+"""
+Verified access token cache and revocation list.
+
+Verifying a JWT signature on every request is the dominant auth cost for
+clients that reuse one token for thousands of calls. Verified claims are
+therefore cached, keyed by the SHA-256 digest of the token, for at most
+TOKEN_CACHE_TTL seconds and never past the token's ``exp``: expiry is
+checked against the clock on every hit, exactly like a full decode would.
+
+Revoked tokens (see /auth/logout) are stored by digest in the
+``revoked_tokens`` table, so every backend process learns about them. Each
+process mirrors the table in memory and picks up new rows at most every
+TOKEN_REVOCATION_REFRESH seconds, which bounds how long a revoked token can
+still be used elsewhere. Only one request at a time refreshes the list; the
+others go on with the current one meanwhile.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))
+TOKEN_REVOCATION_REFRESH = float(os.getenv("TOKEN_REVOCATION_REFRESH", "5"))
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def init_revocations_table(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_digest TEXT UNIQUE NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+def revoke_token(conn: sqlite3.Connection, digest: str, expires_at: float):
+    """Record a revoked token and drop revocations of tokens that have expired anyway"""
+    conn.execute("DELETE FROM revoked_tokens WHERE expires_at < ?", (time.time(),))
+    conn.execute("INSERT OR IGNORE INTO revoked_tokens (token_digest, expires_at) VALUES (?, ?)",
+                 (digest, expires_at))
+
+
+def load_revocations(conn: sqlite3.Connection, after_id: int) -> List[Tuple[int, str, float]]:
+    return conn.execute(
+        "SELECT id, token_digest, expires_at FROM revoked_tokens WHERE id > ? AND expires_at >= ? ORDER BY id",
+        (after_id, time.time())
+    ).fetchall()
+
+
+class TokenCache:
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL,
+                 refresh_interval: float = TOKEN_REVOCATION_REFRESH):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        # digest -> (claims, cached until)
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        # digest -> expiry of the revoked token
+        self._revoked: Dict[str, float] = {}
+        self.revocations_seen = 0
+        self._next_refresh = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[dict]:
+        """Cached claims of a token that is neither expired nor revoked"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            claims, until = entry
+            if time.time() >= until:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def put(self, digest: str, claims: dict):
+        if self.max_entries <= 0 or self.is_revoked(digest):
+            return
+        until = time.time() + self.ttl
+        if "exp" in claims:
+            until = min(until, float(claims["exp"]))
+        with self._lock:
+            self._entries[digest] = (claims, until)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def is_revoked(self, digest: str) -> bool:
+        return digest in self._revoked
+
+    def revoke(self, digest: str, expires_at: float):
+        with self._lock:
+            self._revoked[digest] = expires_at
+            self._entries.pop(digest, None)
+
+    def start_refresh(self) -> bool:
+        """Claim a due refresh of the revocations; False if none is due or another caller has it"""
+        with self._lock:
+            if self._refreshing or time.monotonic() < self._next_refresh:
+                return False
+            self._refreshing = True
+            return True
+
+    def cancel_refresh(self):
+        """Give up a claimed refresh, so that the next caller retries it"""
+        with self._lock:
+            self._refreshing = False
+
+    def add_revocations(self, rows: List[Tuple[int, str, float]]):
+        """Mirror new rows of revoked_tokens and forget revocations of expired tokens"""
+        now = time.time()
+        with self._lock:
+            for row_id, digest, expires_at in rows:
+                self._revoked[digest] = expires_at
+                self._entries.pop(digest, None)
+                self.revocations_seen = max(self.revocations_seen, row_id)
+            for digest in [digest for digest, expires_at in self._revoked.items() if expires_at < now]:
+                del self._revoked[digest]
+            self._next_refresh = time.monotonic() + self.refresh_interval
+            self._refreshing = False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._revoked.clear()
+            self.revocations_seen = 0
+            self._next_refresh = 0.0
+            self._refreshing = False
+
+
+token_cache = TokenCache()
@@ -0,0 +1,129 @@
+"""
+Streaming reception of multipart file uploads.
+
+The request body is parsed as it arrives instead of being buffered by the
+framework first. Each file part is spooled to disk and hashed on the way
+(see blob_store.BlobWriter), and the upload is rejected with 413 as soon as
+it grows past MAX_FILE_SIZE. Text files are decoded while they arrive, so
+their text is already cached when the upload completes. Memory use does not
+depend on the size of the upload, and the parsing, hashing and disk writes
+run on a thread rather than on the event loop.
+"""
+
+import asyncio
+import os
+from typing import Dict, NamedTuple, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13 only ships the multipart package
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+
+import blob_store
+import readers
+
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))  # 0 disables the limit
+
+
+class Upload(NamedTuple):
+    filename: str
+    blob_id: str
+    size: int
+
+
+class _UploadParser:
+    """Multipart callbacks writing the first file part of each named field into a BlobWriter"""
+
+    def __init__(self, fields: Sequence[str], max_size: int):
+        self.fields = {field.encode('utf-8'): field for field in fields}
+        self.max_size = max_size
+        # field -> (filename, writer), in arrival order
+        self.files: Dict[str, Tuple[str, blob_store.BlobWriter]] = {}
+        self._headers = {}
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._current: Optional[blob_store.BlobWriter] = None
+
+    def callbacks(self) -> dict:
+        return {
+            'on_part_begin': self._headers.clear,
+            'on_header_field': lambda data, start, end: self._header_field.extend(data[start:end]),
+            'on_header_value': lambda data, start, end: self._header_value.extend(data[start:end]),
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+        }
+
+    def on_header_end(self):
+        self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b'content-disposition', b''))
+        field = self.fields.get(options.get(b'name'))
+        if field is None or field in self.files or b'filename' not in options:
+            return
+        filename = options[b'filename'].decode('utf-8', errors='replace')
+        extension = os.path.splitext(filename)[1]
+        decoder = readers.text_decoder() if blob_store.text_kind(extension) == 'text' else None
+        self._current = blob_store.BlobWriter(self.max_size, decoder)
+        self.files[field] = (filename, self._current)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if self._current is not None:
+            self._current.write(data[start:end])
+
+    def on_part_end(self):
+        self._current = None
+
+    def commit(self) -> Dict[str, Upload]:
+        uploads = {}
+        for field, (filename, writer) in self.files.items():
+            blob_id = blob_store.blob_id_for(writer.commit(), os.path.splitext(filename)[1])
+            uploads[field] = Upload(filename, blob_id, writer.size)
+        return uploads
+
+
+def request_body_schema(*fields: str) -> dict:
+    """OpenAPI request body of a multipart upload with one file per field, for openapi_extra"""
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "required": list(fields),
+        "properties": {field: {"type": "string", "format": "binary"} for field in fields},
+    }}}}}
+
+
+async def receive_uploads(request: Request, fields: Sequence[str],
+                          max_size: int = MAX_FILE_SIZE) -> Dict[str, Upload]:
+    """Stream the file parts of a multipart request into the blob store, one per field"""
+    content_type, options = parse_options_header(request.headers.get('content-type', ''))
+    if content_type != b'multipart/form-data' or b'boundary' not in options:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    upload = _UploadParser(fields, max_size)
+    parser = MultipartParser(options[b'boundary'], upload.callbacks())
+    try:
+        async for chunk in request.stream():
+            await asyncio.to_thread(parser.write, chunk)
+        await asyncio.to_thread(parser.finalize)
+        for field in fields:
+            if field not in upload.files:
+                raise HTTPException(status_code=400, detail=f"Missing file field: {field}")
+        return await asyncio.to_thread(upload.commit)
+    except BaseException as e:
+        for _, writer in upload.files.values():
+            writer.discard()
+        if isinstance(e, MultipartParseError):
+            raise HTTPException(status_code=400, detail=f"Malformed multipart body: {e}")
+        raise
+
+
+async def receive_upload(request: Request, field: str = "file", max_size: int = MAX_FILE_SIZE) -> Upload:
+    """Stream the file part of a multipart request into the blob store"""
+    return (await receive_uploads(request, (field,), max_size))[field]
@@ -1,4 +1,5 @@
 import React, { createContext, useContext, useState } from 'react';
+import { logout as revokeToken } from '../services/api';
 
 const AuthContext = createContext();
 
@@ -18,6 +19,8 @@ export function AuthProvider({ children }) {
   };
 
   const logout = () => {
+    // Revoke the token server-side; the local session ends either way
+    revokeToken().catch(() => {});
     localStorage.removeItem('token');
     localStorage.removeItem('user');
     setToken(null);
@@ -25,6 +25,10 @@ export const login = (username, password) => {
   return api.post('/auth/login', { username, password });
 };
 
+export const logout = () => {
+  return api.post('/auth/logout');
+};
+
 // File endpoints
 export const uploadFile = (file) => {
   const formData = new FormData();
@@ -41,6 +45,35 @@ export const compareFiles = (data) => {
   return api.post('/compare', data);
 };
 
+export const compareKeyed = (data) => {
+  return api.post('/compare/keyed', null, { params: data });
+};
+
+export const startIncrementalCompare = (params) => {
+  return api.post('/compare/incremental', null, { params });
+};
+
+export const updateIncrementalCompare = (id, params) => {
+  return api.post(`/compare/incremental/${id}`, null, { params });
+};
+
+export const compareBatch = (params) => {
+  return api.post('/compare/batch', null, { params, responseType: 'text' });
+};
+
+// Comparison job endpoints
+export const createCompareJob = (data) => {
+  return api.post('/jobs/compare', null, { params: data });
+};
+
+export const getJob = (id) => {
+  return api.get(`/jobs/${id}`);
+};
+
+export const getJobResult = (id) => {
+  return api.get(`/jobs/${id}/result`);
+};
+
 // Script endpoints
 export const getScripts = (params) => {
   return api.get('/scripts', { params });
@@ -62,6 +95,10 @@ export const deleteScript = (id) => {
   return api.delete(`/scripts/${id}`);
 };
 
+export const runScript = (id, params) => {
+  return api.post(`/scripts/${id}/run`, null, { params });
+};
+
 // Comparison template endpoints
 export const getComparisons = (params) => {
   return api.get('/comparisons', { params });
@@ -83,4 +120,13 @@ export const deleteComparison = (id) => {
   return api.delete(`/comparisons/${id}`);
 };
 
+export const runComparison = (id, params, files) => {
+  // Files are uploaded with the run itself, as file1/file2 parts
+  const formData = files ? new FormData() : null;
+  if (files) {
+    Object.entries(files).forEach(([field, file]) => formData.append(field, file));
+  }
+  return api.post(`/comparisons/${id}/run`, formData, { params });
+};
+
 export default api;
\ No newline at end of file